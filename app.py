@@ -71,7 +71,7 @@ def generate_audio_response(text, speaker_id):
         try:
             audio = synthesizer.synthesize(
                     [text], paths=[real_path], speaker_ids=[speaker_id],
-                    attention_trim=True, isKorean=isKorean)[0]
+                    isKorean=isKorean)[0]
         except Exception as e:
             traceback.print_exc()
             return jsonify(success=False), 400
@@ -125,13 +125,16 @@ if __name__ == '__main__':
     parser.add_argument('--port', default=51000, type=int)
     parser.add_argument('--debug', default=False, type=str2bool)
     parser.add_argument('--is_korean', default=True, type=str2bool)
+    parser.add_argument('--vocoder_workers', default=None, type=int,
+            help='Griffin-Lim processes (default: autotune.py config, else 0)')
     config = parser.parse_args()
 
     if os.path.exists(config.load_path):
         prepare_dirs(config, hparams)
 
         global_config = config
-        synthesizer.load(config.load_path, config.num_speakers, config.checkpoint_step)
+        synthesizer.load(config.load_path, config.num_speakers, config.checkpoint_step,
+                vocoder_workers=config.vocoder_workers)
     else:
         print(" [!] load_path not found: {}".format(config.load_path))
 
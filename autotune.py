@@ -0,0 +1,233 @@
+# Tunes the TensorFlow thread pools, the Griffin-Lim workers and (optionally)
+# the CPU affinity of synthesis and training on this host. The result is
+# written to tuned_config.json, which Synthesizer, app.py and train.py load:
+#
+#   python3 autotune.py --load_path logs/son-20171015 --cpu_affinity True
+#
+# Without load_path, a randomly initialized model of hparams.py is tuned.
+# TensorFlow creates its thread pools once per process, so every setting is
+# measured in its own process.
+import os
+import sys
+import json
+import shutil
+import socket
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import tensorflow as tf
+from datetime import datetime
+from collections import OrderedDict
+
+from hparams import hparams
+from synthesizer import Synthesizer
+from utils import write_json, load_json, load_hparams, str2bool
+from utils.tuning import TUNED_CONFIG_PATH, get_session_config, set_cpu_affinity
+from benchmarks import measure, summarize, print_table
+from benchmarks.rnn_cells import build_models, get_train_feed_dict
+from benchmarks.end_to_end import get_tokens, save_random_checkpoint
+
+
+def get_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+
+def get_default_threads(max_threads):
+    # 1, 2, 4, ... and max_threads
+    threads = [2 ** idx for idx in range(max_threads.bit_length()) if 2 ** idx < max_threads]
+    return ",".join(str(num) for num in threads + [max_threads])
+
+
+def to_tuned_config(setting):
+    '''Setting of the search -> section of tuned_config.json'''
+    tuned_config = {
+            'intra_op_parallelism_threads': setting['intra_op_threads'],
+            'inter_op_parallelism_threads': setting['inter_op_threads'],
+    }
+
+    if 'vocoder_workers' in setting:
+        num_workers = setting['vocoder_workers']
+        tuned_config['vocoder_workers'] = num_workers
+
+        cpus = get_cpus()
+        if setting.get('split_cpus') and 0 < num_workers < len(cpus):
+            # Griffin-Lim workers on the last cpus, TensorFlow on the others
+            tuned_config['cpu_affinity'] = cpus[:-num_workers]
+            tuned_config['vocoder_cpu_affinity'] = cpus[-num_workers:]
+
+    return tuned_config
+
+
+def get_setting_name(setting):
+    return ",".join("{}={}".format(key, value) for key, value in setting.items())
+
+
+def run_synthesis(setting, config):
+    synthesizer = Synthesizer()
+    synthesizer.load(config.load_path, config.num_speakers,
+            tuned_config=to_tuned_config(setting))
+
+    rng = np.random.RandomState(123)
+    tokens = [get_tokens(config.num_tokens, rng) for _ in range(config.batch_size)]
+
+    result = summarize(measure(
+            lambda: synthesizer.synthesize(tokens=tokens), config.num_repeat))
+    synthesizer.close()
+    return result
+
+
+def run_train(setting, config):
+    tuned_config = to_tuned_config(setting)
+    set_cpu_affinity(tuned_config.get('cpu_affinity'))
+
+    load_hparams(hparams, config.load_path)
+    model, _ = build_models(config.num_speakers)
+
+    with tf.Session(config=get_session_config(tuned_config)) as sess:
+        sess.run(tf.global_variables_initializer())
+
+        feed_dict = get_train_feed_dict(
+                model, config.train_batch_size, config.num_tokens,
+                config.num_steps, np.random.RandomState(123))
+        return summarize(measure(
+                lambda: sess.run(model.optimize, feed_dict), config.num_repeat))
+
+
+ROLES = OrderedDict([
+    ('synthesis', run_synthesis),
+    ('train', run_train),
+])
+
+
+def run_setting(role, setting, config):
+    output = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__)] + sys.argv[1:] + [
+                    '--load_path', config.load_path,
+                    '--child_role', role, '--child_setting', json.dumps(setting)])
+    result = json.loads(output.decode('utf-8').strip().split('\n')[-1])
+
+    print(" [*] {} {}: {:.4f} sec".format(role, get_setting_name(setting), result['mean']))
+    return result
+
+
+def coordinate_search(role, space, start, config):
+    '''Tunes one setting at a time with the others fixed at their best value
+    so far, for num_rounds rounds. Returns the best setting and every result.'''
+    best = OrderedDict(start)
+    results = OrderedDict()
+
+    def get_time(setting):
+        name = get_setting_name(setting)
+        if name not in results:
+            results[name] = run_setting(role, setting, config)
+        return results[name]['mean']
+
+    for _ in range(config.num_rounds):
+        for key, values in space.items():
+            best[key] = min(values, key=lambda value: get_time(
+                    OrderedDict(best, **{key: value})))
+
+    return best, results
+
+
+def main():
+    cpus = get_cpus()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--load_path', default=None,
+            help='Model to tune for (default: a random model of hparams.py)')
+    parser.add_argument('--roles', default=",".join(ROLES))
+    parser.add_argument('--num_speakers', default=1, type=int)
+    parser.add_argument('--intra_op_threads', default=get_default_threads(len(cpus)))
+    parser.add_argument('--inter_op_threads', default='1,2,4')
+    parser.add_argument('--vocoder_workers', default=None,
+            help='Griffin-Lim processes of synthesis (default: 0, 1, 2, ... up to batch_size)')
+    parser.add_argument('--cpu_affinity', default=False, type=str2bool,
+            help='Also try to pin the Griffin-Lim workers and TensorFlow to disjoint cpus')
+    parser.add_argument('--batch_size', default=8, type=int,
+            help='Utterances per Synthesizer.synthesize call')
+    parser.add_argument('--train_batch_size', default=hparams.batch_size, type=int)
+    parser.add_argument('--num_tokens', default=60, type=int)
+    parser.add_argument('--num_steps', default=40, type=int,
+            help='Decoder steps of the synthetic training targets')
+    parser.add_argument('--num_repeat', default=3, type=int)
+    parser.add_argument('--num_rounds', default=2, type=int)
+    parser.add_argument('--output_path', default=TUNED_CONFIG_PATH)
+    parser.add_argument('--child_role', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--child_setting', default=None, help=argparse.SUPPRESS)
+    config = parser.parse_args()
+
+    if config.child_role is not None:
+        setting = json.loads(config.child_setting, object_pairs_hook=OrderedDict)
+        print(json.dumps(ROLES[config.child_role](setting, config)))
+        return
+
+    if config.vocoder_workers is None:
+        max_workers = min(config.batch_size, len(cpus) // 2)
+        config.vocoder_workers = get_default_threads(max_workers) if max_workers > 0 else '1'
+        config.vocoder_workers = '0,' + config.vocoder_workers
+
+    parse = lambda values: [int(value) for value in values.split(",")]
+
+    tmp_dir = None
+    if config.load_path is None:
+        tmp_dir = tempfile.mkdtemp()
+        config.load_path = tmp_dir
+        hparams.num_speakers = config.num_speakers
+        save_random_checkpoint(tmp_dir, config, tf.ConfigProto())
+
+    output = {}
+    if os.path.exists(config.output_path):
+        output = load_json(config.output_path)
+        if output.get('cpu_count') != os.cpu_count():
+            output = {}
+
+    try:
+        for role in config.roles.split(","):
+            if role not in ROLES:
+                raise Exception(" [!] Unkown role: {}".format(role))
+
+            # Starts from the settings used without tuning
+            space = OrderedDict([
+                    ('intra_op_threads', parse(config.intra_op_threads)),
+                    ('inter_op_threads', parse(config.inter_op_threads)),
+            ])
+            if role == 'synthesis':
+                start = OrderedDict([
+                        ('intra_op_threads', 1), ('inter_op_threads', 2),
+                        ('vocoder_workers', 0), ('split_cpus', False)])
+                space['vocoder_workers'] = parse(config.vocoder_workers)
+                space['split_cpus'] = [False, True] if config.cpu_affinity else [False]
+            else:
+                # 0: TensorFlow default, as train.py without tuning
+                start = OrderedDict([
+                        ('intra_op_threads', 0), ('inter_op_threads', 0)])
+                for values in space.values():
+                    values.insert(0, 0)
+
+            best, results = coordinate_search(role, space, start, config)
+            print_table(results)
+            best_name = get_setting_name(best)
+            print(" [*] Best {} setting: {} ({:.4f} sec)".format(
+                    role, best_name, results[best_name]['mean']))
+
+            output[role] = to_tuned_config(best)
+            output.setdefault('results', {})[role] = results
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    output.update({
+            'host': socket.gethostname(),
+            'cpu_count': os.cpu_count(),
+            'time': datetime.now().isoformat(),
+    })
+    write_json(config.output_path, output)
+    print(" [*] Tuned config: {}".format(config.output_path))
+
+
+if __name__ == '__main__':
+    main()
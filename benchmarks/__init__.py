@@ -0,0 +1,65 @@
+import time
+import numpy as np
+
+from hparams import hparams
+from text import text_to_sequence
+
+
+en_texts = [
+    "Winter is coming.",
+    "The quick brown fox jumps over the lazy dog.",
+    "Speech synthesis is the artificial production of human speech.",
+    "A computer system used for this purpose is called a speech synthesizer, and can be implemented in software or hardware products.",
+    "The birch canoe slid on the smooth planks, and the juice of lemons makes fine punch.",
+]
+
+
+def get_texts():
+    if 'korean_cleaners' in hparams.cleaners:
+        from eval import texts
+        return texts
+    return en_texts
+
+
+def get_inputs(texts):
+    sequences = [text_to_sequence(text) for text in texts]
+    max_len = max(len(seq) for seq in sequences)
+
+    inputs = np.zeros([len(sequences), max_len], dtype=np.int32)
+    for idx, seq in enumerate(sequences):
+        inputs[idx, :len(seq)] = seq
+
+    # Same as Synthesizer.synthesize: position of the EOS token
+    input_lengths = np.argmax(inputs == 1, 1)
+    return inputs, input_lengths
+
+
+def measure(fn, num_repeat=5, num_warmup=1):
+    for _ in range(num_warmup):
+        fn()
+
+    times = []
+    for _ in range(num_repeat):
+        start_time = time.time()
+        fn()
+        times.append(time.time() - start_time)
+    return times
+
+
+def summarize(times):
+    return {
+        'mean': float(np.mean(times)),
+        'p50': float(np.percentile(times, 50)),
+        'p90': float(np.percentile(times, 90)),
+        'p99': float(np.percentile(times, 99)),
+        'count': len(times),
+    }
+
+
+def print_table(results, keys=('mean', 'p50', 'p90', 'p99')):
+    name_width = max(len(name) for name in results)
+    print(" ".join(["{:<{}}".format("name", name_width)] + \
+            ["{:>10}".format(key) for key in keys]))
+    for name, result in results.items():
+        print(" ".join(["{:<{}}".format(name, name_width)] + \
+                ["{:>10.4f}".format(result[key]) for key in keys]))
@@ -0,0 +1,54 @@
+# Time-to-alignment of training runs, e.g. a reduction_factor_schedule
+# against a fixed reduction factor, from the alignment.json that train.py
+# writes at every test_interval:
+#
+#   python3 -m benchmarks.alignment --log_dirs logs/son-fixed,logs/son-schedule
+#
+# A run is aligned at the first test whose alignment score (mean attention
+# peak) reaches `threshold`.
+import os
+import argparse
+from collections import OrderedDict
+
+from utils import load_json, write_json
+from benchmarks import print_table
+
+
+def get_time_to_alignment(history, threshold):
+    start_time = history[0]['time']
+    for item in history:
+        if item['score'] >= threshold:
+            return {
+                    'step': item['step'],
+                    'hours': (item['time'] - start_time) / 3600.,
+                    'reduction_factor': item['reduction_factor'],
+                    'final_score': history[-1]['score'],
+            }
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--log_dirs', required=True)
+    parser.add_argument('--threshold', default=0.7, type=float)
+    parser.add_argument('--output_path', default="alignment.json")
+    config = parser.parse_args()
+
+    results = OrderedDict()
+    for log_dir in config.log_dirs.split(","):
+        history = load_json(os.path.join(log_dir, 'alignment.json'))
+        result = get_time_to_alignment(history, config.threshold)
+
+        if result is None:
+            print(" [!] {} is not aligned after step {}".format(
+                    log_dir, history[-1]['step']))
+        else:
+            results[log_dir] = result
+
+    if results:
+        print_table(results, keys=('step', 'hours', 'reduction_factor', 'final_score'))
+    write_json(config.output_path, results)
+
+
+if __name__ == '__main__':
+    main()
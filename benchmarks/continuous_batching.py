@@ -0,0 +1,102 @@
+# End-to-end latency and throughput of the decoder scheduler under a
+# Poisson load (including the post CBHG and Griffin-Lim):
+#
+#   python3 -m benchmarks.continuous_batching --load_path logs/son-20171015 --rate 2
+#
+# compares iteration-level (continuous) batching against request-level
+# batching, where a batch only starts once the previous one is done.
+import time
+import argparse
+import threading
+import numpy as np
+from collections import OrderedDict
+
+from scheduler import DecoderScheduler
+from synthesizer import Synthesizer
+from utils import write_json
+from benchmarks import get_texts, summarize, print_table
+
+
+def run_load(scheduler, texts, arrival_times, num_speakers):
+    lock = threading.Lock()
+    done_times = {}
+
+    def on_done(idx):
+        def callback(future):
+            with lock:
+                done_times[idx] = time.time()
+        return callback
+
+    futures, submit_times = [], []
+    start_time = time.time()
+
+    for idx, arrival_time in enumerate(arrival_times):
+        delay = start_time + arrival_time - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+        future = scheduler.submit(
+                texts[idx % len(texts)], speaker_id=idx % num_speakers)
+        submit_times.append(time.time())
+        future.add_done_callback(on_done(idx))
+        futures.append(future)
+
+    for future in futures:
+        future.result()
+
+    latencies = [done_times[idx] - submit_times[idx] for idx in range(len(futures))]
+    elapsed = max(done_times.values()) - start_time
+
+    result = summarize(latencies)
+    result['utterances/sec'] = len(futures) / elapsed
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--load_path', required=True)
+    parser.add_argument('--num_speakers', default=1, type=int)
+    parser.add_argument('--checkpoint_step', default=None, type=int)
+    parser.add_argument('--rate', default=2.0, type=float,
+            help='Mean number of requests per second')
+    parser.add_argument('--num_requests', default=100, type=int)
+    parser.add_argument('--max_batch_size', default=16, type=int)
+    parser.add_argument('--chunk_steps', default=5, type=int)
+    parser.add_argument('--num_vocoder_workers', default=4, type=int)
+    parser.add_argument('--seed', default=123, type=int)
+    parser.add_argument('--output_path', default="continuous_batching.json")
+    config = parser.parse_args()
+
+    synthesizer = Synthesizer()
+    synthesizer.load(config.load_path, config.num_speakers,
+            config.checkpoint_step, streaming=True)
+
+    # The same arrival times and texts for both modes
+    rng = np.random.RandomState(config.seed)
+    arrival_times = np.cumsum(
+            rng.exponential(1.0 / config.rate, config.num_requests))
+
+    texts = get_texts()
+    texts = [texts[idx] for idx in rng.randint(len(texts), size=config.num_requests)]
+
+    results = OrderedDict()
+    for name, continuous in [('request', False), ('continuous', True)]:
+        scheduler = DecoderScheduler(
+                synthesizer, config.max_batch_size, config.chunk_steps,
+                config.num_vocoder_workers, continuous=continuous)
+
+        # Warm up the session before timing
+        scheduler.submit(texts[0]).result()
+
+        results[name] = run_load(
+                scheduler, texts, arrival_times, config.num_speakers)
+        scheduler.close()
+
+    synthesizer.close()
+
+    print_table(results, keys=('p50', 'p99', 'utterances/sec'))
+    write_json(config.output_path, results)
+
+
+if __name__ == '__main__':
+    main()
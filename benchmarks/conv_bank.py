@@ -0,0 +1,102 @@
+# Forward time of the encoder and post CBHG with the per-width conv bank
+# and with the fused conv bank, on a randomly initialized model:
+#
+#   python3 -m benchmarks.conv_bank --batch_size 8 --num_steps 200
+#
+# Both versions share the same variables, so the outputs must match.
+import argparse
+import numpy as np
+import tensorflow as tf
+from collections import OrderedDict
+
+from hparams import hparams
+from models.modules import cbhg
+from utils import write_json
+from benchmarks import measure, summarize, print_table
+
+
+def build_cbhgs(inputs, input_lengths, prefix, fused_conv_bank, reuse):
+    hp = hparams
+    with tf.variable_scope('model/inference', reuse=reuse):
+        if prefix == 'encoder':
+            return cbhg(
+                    inputs, input_lengths, False,
+                    hp.enc_bank_size, hp.enc_bank_channel_size,
+                    hp.enc_maxpool_width, hp.enc_highway_depth, hp.enc_rnn_size,
+                    hp.enc_proj_sizes, hp.enc_proj_width,
+                    scope="encoder_cbhg", fused_conv_bank=fused_conv_bank)
+        else:
+            return cbhg(
+                    inputs, None, False,
+                    hp.post_bank_size, hp.post_bank_channel_size,
+                    hp.post_maxpool_width, hp.post_highway_depth, hp.post_rnn_size,
+                    hp.post_proj_sizes, hp.post_proj_width,
+                    scope="post_cbhg", fused_conv_bank=fused_conv_bank)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', default=8, type=int)
+    parser.add_argument('--num_tokens', default=100, type=int)
+    parser.add_argument('--num_steps', default=200, type=int)
+    parser.add_argument('--num_repeat', default=20, type=int)
+    parser.add_argument('--intra_op_parallelism_threads', default=1, type=int)
+    parser.add_argument('--inter_op_parallelism_threads', default=2, type=int)
+    parser.add_argument('--output_path', default="conv_bank.json")
+    config = parser.parse_args()
+
+    rng = np.random.RandomState(123)
+    num_frames = config.num_steps * hparams.reduction_factor
+
+    settings = {
+        'encoder': (hparams.enc_prenet_sizes[-1], config.num_tokens),
+        'post': (hparams.num_mels, num_frames),
+    }
+
+    feed_dict = {}
+    outputs = OrderedDict()
+
+    for prefix, (dim, length) in settings.items():
+        inputs = tf.placeholder(tf.float32, [None, None, dim])
+        input_lengths = tf.placeholder(tf.int32, [None])
+
+        feed_dict[inputs] = rng.rand(config.batch_size, length, dim)
+        feed_dict[input_lengths] = [length] * config.batch_size
+
+        outputs[prefix] = build_cbhgs(
+                inputs, input_lengths, prefix, False, reuse=False)
+        outputs[prefix + '_fused'] = build_cbhgs(
+                inputs, input_lengths, prefix, True, reuse=True)
+
+    sess_config = tf.ConfigProto(
+            intra_op_parallelism_threads=config.intra_op_parallelism_threads,
+            inter_op_parallelism_threads=config.inter_op_parallelism_threads)
+
+    with tf.Session(config=sess_config) as sess:
+        sess.run(tf.global_variables_initializer())
+
+        # Non-trivial batch norm statistics for the equality check
+        for var in tf.global_variables():
+            if 'moving_' in var.op.name or '/gamma' in var.op.name or '/beta' in var.op.name:
+                var.load(rng.uniform(0.5, 1.5, var.get_shape().as_list()), sess)
+
+        results = OrderedDict()
+        for name, output in outputs.items():
+            results[name] = summarize(measure(
+                    lambda: sess.run(output, feed_dict), config.num_repeat))
+
+        for prefix in settings:
+            original, fused = sess.run(
+                    [outputs[prefix], outputs[prefix + '_fused']], feed_dict)
+            results[prefix + '_fused']['max_abs_diff'] = \
+                    float(np.abs(original - fused).max())
+
+    print_table(results)
+    for prefix in settings:
+        print(" [*] {} max abs diff: {:.3e}".format(
+                prefix, results[prefix + '_fused']['max_abs_diff']))
+    write_json(config.output_path, results)
+
+
+if __name__ == '__main__':
+    main()
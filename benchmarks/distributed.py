@@ -0,0 +1,160 @@
+# Scaling of synchronous data-parallel training on a local cluster of CPU
+# processes (one parameter server and N workers, random weights,
+# synthetic batches of batch_size per worker):
+#
+#   python3 -m benchmarks.distributed --num_workers 1,2,4
+#
+# `efficiency` is the throughput (examples/sec) of N workers divided by N
+# times the throughput of one worker.
+import sys
+import json
+import time
+import socket
+import argparse
+import subprocess
+import numpy as np
+import tensorflow as tf
+from collections import OrderedDict
+
+from hparams import hparams
+from utils import write_json
+from benchmarks import measure, summarize, print_table
+from benchmarks.rnn_cells import build_models, get_train_feed_dict
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+def run_task(config):
+    cluster = tf.train.ClusterSpec({
+            'ps': [config.ps_host],
+            'worker': config.worker_hosts.split(","),
+    })
+    server = tf.train.Server(
+            cluster, job_name=config.job_name, task_index=config.task_index)
+
+    if config.job_name == 'ps':
+        server.join()
+        return
+
+    num_workers = cluster.num_tasks('worker')
+    is_chief = config.task_index == 0
+
+    with tf.device(tf.train.replica_device_setter(
+            worker_device='/job:worker/task:{}'.format(config.task_index),
+            cluster=cluster)):
+        model, _ = build_models(config.num_speakers, num_workers)
+        uninitialized = tf.report_uninitialized_variables()
+
+    # Disjoint synthetic shards
+    feed_dict = get_train_feed_dict(
+            model, config.batch_size, config.num_tokens, config.num_steps,
+            np.random.RandomState(123 + config.task_index))
+
+    with tf.Session(server.target) as sess:
+        if is_chief:
+            sess.run(tf.global_variables_initializer())
+        else:
+            while sess.run(uninitialized).size > 0:
+                time.sleep(1)
+        sess.run(tf.local_variables_initializer())
+
+        if num_workers > 1:
+            if is_chief:
+                sess.run(model.optimizer.chief_init_op)
+                sess.run(model.optimizer.get_init_tokens_op())
+                model.optimizer.get_chief_queue_runner().create_threads(
+                        sess, daemon=True, start=True)
+            else:
+                sess.run(model.optimizer.local_step_init_op)
+
+        if not is_chief:
+            # Until the benchmark stops the cluster
+            while True:
+                sess.run(model.optimize, feed_dict)
+
+        times = measure(
+                lambda: sess.run(model.optimize, feed_dict),
+                config.num_repeat, num_warmup=3)
+
+        result = summarize(times)
+        result['examples_per_sec'] = num_workers * config.batch_size / result['mean']
+        print(json.dumps(result), flush=True)
+
+
+def run_cluster(num_workers, argv):
+    ps_host = 'localhost:{}'.format(get_free_port())
+    worker_hosts = ",".join(
+            'localhost:{}'.format(get_free_port()) for _ in range(num_workers))
+
+    def start(job_name, task_index, **kwargs):
+        return subprocess.Popen([
+                sys.executable, '-m', 'benchmarks.distributed',
+                '--ps_host', ps_host, '--worker_hosts', worker_hosts,
+                '--job_name', job_name, '--task_index', str(task_index)] + argv, **kwargs)
+
+    processes = [start('ps', 0)]
+    processes.extend(start('worker', idx) for idx in range(1, num_workers))
+    chief = start('worker', 0, stdout=subprocess.PIPE)
+    processes.append(chief)
+
+    try:
+        for line in chief.stdout:
+            line = line.decode('utf-8').strip()
+            if line.startswith('{'):
+                return json.loads(line)
+        raise Exception(" [!] Chief exited with {}".format(chief.wait()))
+    finally:
+        for process in processes:
+            process.kill()
+            process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_workers', default='1,2,4')
+    parser.add_argument('--num_speakers', default=1, type=int)
+    parser.add_argument('--batch_size', default=hparams.batch_size, type=int)
+    parser.add_argument('--num_tokens', default=60, type=int)
+    parser.add_argument('--num_steps', default=40, type=int,
+            help='Decoder steps of the synthetic training targets')
+    parser.add_argument('--num_repeat', default=10, type=int)
+    parser.add_argument('--output_path', default="distributed.json")
+
+    parser.add_argument('--ps_host', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--worker_hosts', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--job_name', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--task_index', default=0, type=int, help=argparse.SUPPRESS)
+    config = parser.parse_args()
+
+    if config.job_name is not None:
+        return run_task(config)
+
+    argv = [
+            '--num_speakers', str(config.num_speakers),
+            '--batch_size', str(config.batch_size),
+            '--num_tokens', str(config.num_tokens),
+            '--num_steps', str(config.num_steps),
+            '--num_repeat', str(config.num_repeat),
+    ]
+
+    results = OrderedDict()
+    for num_workers in map(int, config.num_workers.split(",")):
+        results['workers_{}'.format(num_workers)] = run_cluster(num_workers, argv)
+
+    base = next(iter(results.values()))
+    base_workers = int(config.num_workers.split(",")[0])
+    for name, result in results.items():
+        num_workers = int(name.split("_")[1])
+        result['efficiency'] = result['examples_per_sec'] * base_workers / \
+                (base['examples_per_sec'] * num_workers)
+
+    print_table(results, keys=('mean', 'p50', 'examples_per_sec', 'efficiency'))
+    write_json(config.output_path, results)
+
+
+if __name__ == '__main__':
+    main()
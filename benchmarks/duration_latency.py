@@ -0,0 +1,50 @@
+# Per-utterance CPU latency of the attention and the duration decoder
+# (no Griffin-Lim):
+#
+#   python3 -m benchmarks.duration_latency \
+#       --attention_path logs/son-20171015 --duration_path logs/son-duration
+import argparse
+import tensorflow as tf
+from collections import OrderedDict
+
+from synthesizer import Synthesizer
+from utils import write_json
+from benchmarks import get_texts, summarize, print_table
+from benchmarks.export_latency import measure_utterances
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--attention_path', required=True)
+    parser.add_argument('--duration_path', required=True)
+    parser.add_argument('--num_speakers', default=1, type=int)
+    parser.add_argument('--num_repeat', default=5, type=int)
+    parser.add_argument('--output_path', default="duration_latency.json")
+    config = parser.parse_args()
+
+    texts = get_texts()
+    results = OrderedDict()
+
+    for name, load_path in [
+            ('attention', config.attention_path),
+            ('duration', config.duration_path)]:
+        tf.reset_default_graph()
+
+        synthesizer = Synthesizer()
+        synthesizer.load(load_path, config.num_speakers)
+
+        results[name] = summarize(
+                measure_utterances(synthesizer, texts, config.num_repeat))
+        synthesizer.close()
+
+    results['speedup'] = {
+            key: results['attention'][key] / results['duration'][key] \
+                    for key in ['mean', 'p50', 'p90', 'p99']
+    }
+
+    print_table(results)
+    write_json(config.output_path, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,325 @@
+# End-to-end benchmarks without datasets or checkpoints: synthetic audio and
+# .npz data, and a randomly initialized model of an hparams preset:
+#
+#   python3 -m benchmarks.end_to_end --preset hparams_en_single --output_path e2e.json
+#   python3 -m benchmarks.end_to_end --baseline_path e2e.json --output_path e2e-new.json
+#
+# Measures preprocessing (_process_utterance), DataFeeder batches, training
+# step time, Synthesizer.synthesize latency by number of tokens and batch size,
+# Synthesizer.synthesize_stream latency to the first and the last chunk,
+# Griffin-Lim and the /generate endpoint of app.py. A random model rarely
+# predicts the end of an utterance, so synthesis mostly runs to max_iters:
+# compare runs with each other, not with a trained model.
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import importlib
+import numpy as np
+import tensorflow as tf
+from datetime import datetime
+from collections import OrderedDict
+
+from hparams import hparams
+from models import create_model
+from audio import save_audio, inv_spectrogram
+from synthesizer import Synthesizer
+from datasets.datafeeder import DataFeeder
+from datasets.generate_data import _process_utterance
+from utils import write_json, load_json, save_hparams, get_git_revision_hash, str2bool
+from benchmarks import measure, summarize, print_table
+from benchmarks.rnn_cells import build_models, get_train_feed_dict
+
+
+def load_preset(name):
+    preset = importlib.import_module(name).hparams
+    for key, value in preset.values().items():
+        setattr(hparams, key, value)
+
+
+def get_tokens(num_tokens, rng):
+    # Random symbols followed by EOS, like text_to_sequence
+    return list(rng.randint(2, 30, size=num_tokens - 1)) + [1]
+
+
+def get_synthetic_wav(duration, rng):
+    # Harmonics of a drifting pitch with noise, so spectrograms are not flat
+    t = np.arange(int(duration * hparams.sample_rate)) / hparams.sample_rate
+    f0 = rng.uniform(100, 250) * (1 + 0.1 * np.sin(2 * np.pi * rng.uniform(0.5, 2) * t))
+    phase = 2 * np.pi * np.cumsum(f0) / hparams.sample_rate
+
+    wav = sum(np.sin(k * phase) / k for k in range(1, 6))
+    wav += 0.05 * rng.randn(len(t))
+    return wav.astype(np.float32)
+
+
+def get_duration(n_frame):
+    return n_frame * hparams.frame_shift_ms / 1000.
+
+
+def run_preprocess(base_dir, config, rng):
+    '''Writes synthetic wavs and preprocesses them into <speaker>/data/*.npz.'''
+    # Long enough for the min_iters and min_tokens filters of DataFeeder
+    min_duration = get_duration(hparams.reduction_factor * hparams.min_iters) + 0.5
+    max_duration = get_duration(hparams.reduction_factor * (hparams.max_iters - 1)) - 0.5
+
+    data_dirs, times, n_frames = [], [], []
+    for speaker_idx in range(config.num_speakers):
+        speaker_dir = os.path.join(base_dir, 'speaker{}'.format(speaker_idx))
+        data_dir = os.path.join(speaker_dir, 'data')
+        os.makedirs(os.path.join(speaker_dir, 'audio'))
+        os.makedirs(data_dir)
+        data_dirs.append(data_dir)
+
+        for idx in range(config.num_utterances):
+            audio_path = os.path.join(speaker_dir, 'audio', '{:04d}.wav'.format(idx))
+            save_audio(get_synthetic_wav(
+                    rng.uniform(min_duration, min(max_duration, 6.)), rng), audio_path)
+
+            tokens = np.asarray(get_tokens(
+                    rng.randint(hparams.min_tokens + 1, 150), rng), dtype=np.int32)
+
+            start_time = time.time()
+            n_frames.append(_process_utterance(audio_path, data_dir, tokens, 1.))
+            times.append(time.time() - start_time)
+
+    result = summarize(times)
+    result['utterances_per_sec'] = len(times) / sum(times)
+    result['audio_sec_per_sec'] = get_duration(sum(n_frames)) / sum(times)
+    return data_dirs, result
+
+
+def run_feeder(data_dirs, config, sess_config):
+    tf.reset_default_graph()
+
+    feeder_config = argparse.Namespace(
+            skip_path_filter=False, random_seed=config.random_seed, bucket_size=1,
+            task_index=0, num_workers=1, speaker_id_offset=0)
+
+    coord = tf.train.Coordinator()
+    feeder = DataFeeder(
+            coord, data_dirs, hparams, feeder_config, config.batches_per_group,
+            data_type='train', batch_size=config.batch_size)
+
+    with tf.Session(config=sess_config) as sess:
+        feeder.start_in_session(sess, 0)
+        # Includes the first group, as at the start of training
+        times = measure(lambda: sess.run(feeder.inputs), config.num_batches, num_warmup=0)
+        feeder.stop()
+
+    result = summarize(times)
+    result['batches_per_sec'] = len(times) / sum(times)
+    return result
+
+
+def run_train_step(config, sess_config):
+    tf.reset_default_graph()
+    model, _ = build_models(config.num_speakers)
+
+    with tf.Session(config=sess_config) as sess:
+        sess.run(tf.global_variables_initializer())
+
+        feed_dict = get_train_feed_dict(
+                model, config.batch_size, config.num_tokens,
+                config.num_steps, np.random.RandomState(config.random_seed))
+        return summarize(measure(
+                lambda: sess.run(model.optimize, feed_dict), config.num_repeat))
+
+
+def save_random_checkpoint(model_dir, config, sess_config):
+    '''Checkpoint and hparams of a random model, as train.py writes them.'''
+    tf.reset_default_graph()
+
+    inputs = tf.placeholder(tf.int32, [None, None], 'inputs')
+    input_lengths = tf.placeholder(tf.int32, [None], 'input_lengths')
+    speaker_id = tf.placeholder_with_default(
+            tf.zeros([tf.shape(inputs)[0]], dtype=tf.int32), [None], 'speaker_id')
+
+    with tf.variable_scope('model'):
+        model = create_model(hparams)
+        model.initialize(inputs, input_lengths, config.num_speakers, speaker_id)
+
+    with tf.Session(config=sess_config) as sess:
+        sess.run(tf.global_variables_initializer())
+        tf.train.Saver().save(
+                sess, os.path.join(model_dir, 'model.ckpt'), global_step=0)
+    save_hparams(model_dir, hparams)
+
+
+def run_synthesize(synthesizer, config, rng):
+    results = OrderedDict()
+    for num_tokens in map(int, config.token_lengths.split(",")):
+        for batch_size in map(int, config.synth_batch_sizes.split(",")):
+            tokens = [get_tokens(num_tokens, rng) for _ in range(batch_size)]
+            results['synthesize/tokens_{}/batch_{}'.format(num_tokens, batch_size)] = \
+                    summarize(measure(lambda: synthesizer.synthesize(tokens=tokens),
+                            config.num_repeat))
+    return results
+
+
+def run_stream(model_dir, config):
+    '''Decodes a whole utterance with synthesize_stream, chunk by chunk.'''
+    tf.reset_default_graph()
+    synthesizer = Synthesizer()
+    synthesizer.load(model_dir, config.num_speakers, streaming=True)
+
+    first_times, last_times = [], []
+    for _ in range(config.num_repeat):
+        start_time = time.time()
+        chunks = []
+        for chunk in synthesizer.synthesize_stream(
+                'The quick brown fox jumps over the lazy dog'):
+            if not chunks:
+                first_times.append(time.time() - start_time)
+            chunks.append(chunk)
+        last_times.append(time.time() - start_time)
+
+        if len(np.concatenate(chunks)) == 0:
+            raise Exception(" [!] synthesize_stream yielded no audio")
+    synthesizer.close()
+
+    return OrderedDict([
+            ('stream/first_chunk', summarize(first_times)),
+            ('stream/last_chunk', summarize(last_times)),
+    ])
+
+
+def run_griffin_lim(data_dirs, config):
+    paths = sorted(os.path.join(data_dirs[0], filename) \
+            for filename in os.listdir(data_dirs[0]))[:config.num_repeat]
+
+    times, n_frames = [], []
+    for path in paths:
+        linear = np.load(path)['linear']
+
+        start_time = time.time()
+        inv_spectrogram(linear.T)
+        times.append(time.time() - start_time)
+        n_frames.append(len(linear))
+
+    result = summarize(times)
+    result['audio_sec_per_sec'] = get_duration(sum(n_frames)) / sum(times)
+    return result
+
+
+def run_web(model_dir, synthesizer, config):
+    # Flask is only needed for this benchmark
+    import app as web
+
+    web.synthesizer = synthesizer
+    web.global_config = argparse.Namespace(
+            load_path=model_dir, is_korean='korean_cleaners' in hparams.cleaners)
+    client = web.app.test_client()
+
+    def request(text):
+        start_time = time.time()
+        response = client.get('/generate', query_string={'text': text, 'speaker_id': 0})
+        if response.status_code != 200:
+            raise Exception(" [!] /generate failed with {}".format(response.status_code))
+        return time.time() - start_time
+
+    audio_dir = os.path.join(web.ROOT_PATH, web.AUDIO_DIR, os.path.basename(model_dir))
+    try:
+        text = 'The quick brown fox jumps over the lazy dog'
+        results = OrderedDict([
+                # New texts are synthesized, known ones are served from web/audio
+                ('web/generate', summarize([
+                        request('{} {}'.format(text, idx)) for idx in range(config.num_repeat)])),
+                ('web/generate_cached', summarize([
+                        request('{} 0'.format(text)) for _ in range(config.num_repeat)])),
+        ])
+    finally:
+        shutil.rmtree(audio_dir, ignore_errors=True)
+    return results
+
+
+def print_comparison(results, baseline):
+    name_width = max(len(name) for name in results)
+    print(" ".join(["{:<{}}".format("name", name_width)] + \
+            ["{:>10}".format(key) for key in ('mean', 'baseline', 'ratio')]))
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        baseline_mean = baseline[name]['mean']
+        print(" ".join(["{:<{}}".format(name, name_width)] + \
+                ["{:>10.4f}".format(value) for value in \
+                        (result['mean'], baseline_mean, result['mean'] / baseline_mean)]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--preset', default='hparams',
+            help='Module of the hparams: hparams, hparams_en_single, hparams_en_multi or hparams_kor_multi')
+    parser.add_argument('--num_speakers', default=1, type=int)
+    parser.add_argument('--num_utterances', default=64, type=int,
+            help='Synthetic utterances per speaker')
+    parser.add_argument('--batch_size', default=32, type=int)
+    parser.add_argument('--batches_per_group', default=32, type=int)
+    parser.add_argument('--num_batches', default=64, type=int,
+            help='Batches read from the DataFeeder')
+    parser.add_argument('--num_tokens', default=60, type=int)
+    parser.add_argument('--num_steps', default=40, type=int,
+            help='Decoder steps of the synthetic training targets')
+    parser.add_argument('--token_lengths', default='20,60,120')
+    parser.add_argument('--synth_batch_sizes', default='1,4')
+    parser.add_argument('--num_repeat', default=5, type=int)
+    parser.add_argument('--random_seed', default=123, type=int)
+    parser.add_argument('--use_gpu', default=False, type=str2bool)
+    parser.add_argument('--stream', default=True, type=str2bool,
+            help='Also measure Synthesizer.synthesize_stream')
+    parser.add_argument('--web', default=True, type=str2bool,
+            help='Also measure the /generate endpoint of app.py (needs Flask)')
+    parser.add_argument('--baseline_path', default=None,
+            help='Results of an earlier run to compare with')
+    parser.add_argument('--output_path', default="end_to_end.json")
+    config = parser.parse_args()
+
+    load_preset(config.preset)
+    hparams.num_speakers = config.num_speakers
+
+    rng = np.random.RandomState(config.random_seed)
+    sess_config = tf.ConfigProto(device_count={'GPU': 1 if config.use_gpu else 0})
+
+    base_dir = tempfile.mkdtemp()
+    results = OrderedDict()
+    try:
+        data_dirs, results['preprocess'] = run_preprocess(base_dir, config, rng)
+        results['feeder'] = run_feeder(data_dirs, config, sess_config)
+        results['train_step'] = run_train_step(config, sess_config)
+        results['griffin_lim'] = run_griffin_lim(data_dirs, config)
+
+        model_dir = os.path.join(base_dir, 'random_model')
+        os.makedirs(model_dir)
+        save_random_checkpoint(model_dir, config, sess_config)
+
+        tf.reset_default_graph()
+        synthesizer = Synthesizer()
+        synthesizer.load(model_dir, config.num_speakers)
+
+        results.update(run_synthesize(synthesizer, config, rng))
+        if config.web:
+            results.update(run_web(model_dir, synthesizer, config))
+        synthesizer.close()
+
+        if config.stream:
+            results.update(run_stream(model_dir, config))
+    finally:
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+    print_table(results)
+    if config.baseline_path is not None:
+        print_comparison(results, load_json(config.baseline_path)['results'])
+
+    write_json(config.output_path, {
+            'meta': {
+                    'time': datetime.now().isoformat(),
+                    'git_revision': get_git_revision_hash().strip(),
+                    'config': vars(config),
+            },
+            'results': results,
+    })
+
+
+if __name__ == '__main__':
+    main()
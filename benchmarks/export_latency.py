@@ -0,0 +1,71 @@
+# Per-utterance CPU latency of the model graph (no Griffin-Lim):
+#
+#   python3 -m benchmarks.export_latency --load_path logs/son-20171015
+#
+# compares the checkpoint graph, the plain frozen export and the
+# optimized frozen export (folded batch norms and constants).
+import os
+import argparse
+import tempfile
+import tensorflow as tf
+from collections import OrderedDict
+
+from export import export
+from synthesizer import Synthesizer
+from utils import write_json
+from benchmarks import get_texts, get_inputs, measure, summarize, print_table
+
+
+def measure_utterances(synthesizer, texts, num_repeat):
+    times = []
+    for text in texts:
+        inputs, input_lengths = get_inputs([text])
+        feed_dict = {
+                synthesizer.model.inputs: inputs,
+                synthesizer.model.input_lengths: input_lengths,
+                **synthesizer.model.get_dummy_feed_dict(),
+        }
+        times.extend(measure(lambda: synthesizer.sess.run(
+                synthesizer.model.linear_outputs, feed_dict), num_repeat))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--load_path', required=True)
+    parser.add_argument('--num_speakers', default=1, type=int)
+    parser.add_argument('--checkpoint_step', default=None, type=int)
+    parser.add_argument('--num_repeat', default=5, type=int)
+    parser.add_argument('--output_path', default="export_latency.json")
+    config = parser.parse_args()
+
+    export_root = tempfile.mkdtemp()
+    load_paths = OrderedDict([
+        ('checkpoint', config.load_path),
+        ('frozen', export(
+                config.load_path, os.path.join(export_root, 'frozen'),
+                config.num_speakers, config.checkpoint_step, optimize=False)),
+        ('optimized', export(
+                config.load_path, os.path.join(export_root, 'optimized'),
+                config.num_speakers, config.checkpoint_step, optimize=True)),
+    ])
+
+    texts = get_texts()
+    results = OrderedDict()
+
+    for name, load_path in load_paths.items():
+        tf.reset_default_graph()
+
+        synthesizer = Synthesizer()
+        synthesizer.load(load_path, config.num_speakers, config.checkpoint_step)
+
+        results[name] = summarize(
+                measure_utterances(synthesizer, texts, config.num_repeat))
+        synthesizer.close()
+
+    print_table(results)
+    write_json(config.output_path, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# Peak memory and training step time of the attention Tacotron with the
+# training memory options (random weights, synthetic batches):
+#
+#   python3 -m benchmarks.memory --batch_size 32 --num_steps 100
+#
+# Every mode runs in its own process, since the peak resident memory of a
+# process never goes down. `peak_rss_mb` is the host peak of the whole
+# process and `peak_gpu_mb` the peak of the TensorFlow GPU allocator.
+# decoder_swap_memory only moves GPU memory, so it changes nothing on CPU.
+import sys
+import json
+import resource
+import argparse
+import subprocess
+import numpy as np
+import tensorflow as tf
+from collections import OrderedDict
+
+from hparams import hparams
+from utils import write_json
+from benchmarks import measure, summarize, print_table
+from benchmarks.rnn_cells import build_models, get_train_feed_dict
+
+
+MODES = OrderedDict([
+    ('default', {}),
+    ('recompute', {'recompute_post_cbhg': True}),
+    ('swap_memory', {'decoder_swap_memory': True}),
+    ('recompute+swap_memory', {'recompute_post_cbhg': True, 'decoder_swap_memory': True}),
+])
+
+
+def run_mode(mode, config):
+    for key, value in MODES[mode].items():
+        setattr(hparams, key, value)
+
+    model, _ = build_models(config.num_speakers)
+
+    fetches = [model.optimize]
+    if tf.test.is_gpu_available():
+        fetches.append(tf.contrib.memory_stats.MaxBytesInUse())
+
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+
+        feed_dict = get_train_feed_dict(
+                model, config.batch_size, config.num_tokens,
+                config.num_steps, np.random.RandomState(123))
+
+        outputs = []
+        result = summarize(measure(
+                lambda: outputs.append(sess.run(fetches, feed_dict)), config.num_repeat))
+
+    # ru_maxrss is in KB on Linux
+    result['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+    result['peak_gpu_mb'] = outputs[-1][1] / 1024. ** 2 if len(fetches) > 1 else 0.
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modes', default=",".join(MODES))
+    parser.add_argument('--num_speakers', default=1, type=int)
+    parser.add_argument('--batch_size', default=hparams.batch_size, type=int)
+    parser.add_argument('--num_tokens', default=60, type=int)
+    parser.add_argument('--num_steps', default=hparams.max_iters // 2, type=int,
+            help='Decoder steps of the synthetic training targets')
+    parser.add_argument('--num_repeat', default=3, type=int)
+    parser.add_argument('--output_path', default="memory.json")
+    parser.add_argument('--child_mode', default=None, help=argparse.SUPPRESS)
+    config = parser.parse_args()
+
+    if config.child_mode is not None:
+        print(json.dumps(run_mode(config.child_mode, config)))
+        return
+
+    results = OrderedDict()
+    for mode in config.modes.split(","):
+        if mode not in MODES:
+            raise Exception(" [!] Unkown mode: {}".format(mode))
+
+        output = subprocess.check_output(
+                [sys.executable, '-m', 'benchmarks.memory', '--child_mode', mode] + sys.argv[1:])
+        results[mode] = json.loads(output.decode('utf-8').strip().split('\n')[-1])
+
+    print_table(results, keys=('mean', 'p50', 'peak_rss_mb', 'peak_gpu_mb'))
+    write_json(config.output_path, results)
+
+
+if __name__ == '__main__':
+    main()
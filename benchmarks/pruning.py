@@ -0,0 +1,77 @@
+# Quality, size and per-utterance CPU latency of pruned models:
+#
+#   python3 -m benchmarks.pruning \
+#       --load_paths logs/son-20171015,logs/son-prune50,logs/son-prune75
+#
+# The first model is the dense reference of the spectrogram error. Each
+# model is exported with the pruned weights shrunk.
+import os
+import argparse
+import tempfile
+import numpy as np
+import tensorflow as tf
+from collections import OrderedDict
+
+from export import export
+from models import get_most_recent_checkpoint
+from quantize import GraphRunner, read_graph_def, spectrogram_error
+from utils import write_json
+from benchmarks import get_texts, summarize, print_table
+
+
+def get_sparsity(checkpoint_path):
+    reader = tf.train.NewCheckpointReader(checkpoint_path)
+    shapes = reader.get_variable_to_shape_map()
+
+    num_kept, num_total = 0, 0
+    for name in shapes:
+        if not name.startswith('pruning/') or not name.endswith('/mask'):
+            continue
+
+        mask = reader.get_tensor(name)
+        kernel_shape = shapes[name[len('pruning/'):-len('/mask')]]
+
+        num_kept += mask.sum() * kernel_shape[1]
+        num_total += np.prod(kernel_shape)
+
+    return 1. - num_kept / num_total if num_total > 0 else 0.
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--load_paths', required=True)
+    parser.add_argument('--num_speakers', default=1, type=int)
+    parser.add_argument('--num_repeat', default=5, type=int)
+    parser.add_argument('--output_path', default="pruning.json")
+    config = parser.parse_args()
+
+    texts = get_texts()
+    export_root = tempfile.mkdtemp()
+
+    results = OrderedDict()
+    references = None
+
+    for idx, load_path in enumerate(config.load_paths.split(",")):
+        frozen_path = export(
+                load_path, os.path.join(export_root, str(idx)),
+                config.num_speakers, optimize=True)
+
+        runner = GraphRunner(read_graph_def(frozen_path))
+        outputs = runner.synthesize(texts)
+        if references is None:
+            references = outputs
+
+        result = summarize(runner.latencies(texts, config.num_repeat))
+        result['sparsity'] = float(get_sparsity(get_most_recent_checkpoint(load_path)))
+        result['size_mb'] = os.path.getsize(frozen_path) / 1024 / 1024
+        result['error'] = spectrogram_error(references, outputs)
+        runner.close()
+
+        results[load_path] = result
+
+    print_table(results, keys=('sparsity', 'size_mb', 'mean', 'p50', 'p99', 'error'))
+    write_json(config.output_path, results)
+
+
+if __name__ == '__main__':
+    main()
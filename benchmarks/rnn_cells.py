@@ -0,0 +1,105 @@
+# CPU training step time and per-utterance inference latency of the
+# attention Tacotron for each rnn_cell_type, with random weights:
+#
+#   python3 -m benchmarks.rnn_cells --cell_types gru,gru_block
+import argparse
+import numpy as np
+import tensorflow as tf
+from collections import OrderedDict
+
+from hparams import hparams
+from models.tacotron import Tacotron
+from utils import write_json
+from benchmarks import get_texts, get_inputs, measure, summarize, print_table
+
+
+def build_models(num_speakers, num_replicas=1):
+    inputs = tf.placeholder(tf.int32, [None, None], 'inputs')
+    input_lengths = tf.placeholder(tf.int32, [None], 'input_lengths')
+    speaker_id = tf.placeholder_with_default(
+            tf.zeros([tf.shape(inputs)[0]], dtype=tf.int32), [None], 'speaker_id')
+
+    mel_targets = tf.placeholder(tf.float32, [None, None, hparams.num_mels], 'mel_targets')
+    linear_targets = tf.placeholder(tf.float32, [None, None, hparams.num_freq], 'linear_targets')
+    loss_coeff = tf.placeholder(tf.float32, [None], 'loss_coeff')
+
+    global_step = tf.Variable(0, name='global_step', trainable=False)
+
+    with tf.variable_scope('model') as scope:
+        model = Tacotron(hparams)
+        model.initialize(
+                inputs, input_lengths, num_speakers, speaker_id,
+                mel_targets, linear_targets, loss_coeff,
+                is_randomly_initialized=True)
+        model.add_loss()
+        model.add_optimizer(global_step, num_replicas=num_replicas)
+
+    with tf.variable_scope('model', reuse=True) as scope:
+        test_model = Tacotron(hparams)
+        test_model.initialize(
+                inputs, input_lengths, num_speakers, speaker_id,
+                manual_attention=False)
+
+    return model, test_model
+
+
+def get_train_feed_dict(model, batch_size, num_tokens, num_steps, rng):
+    num_frames = num_steps * hparams.reduction_factor
+    return {
+            model.inputs: rng.randint(2, 30, size=[batch_size, num_tokens]),
+            model.input_lengths: [num_tokens] * batch_size,
+            model.mel_targets: rng.rand(batch_size, num_frames, hparams.num_mels),
+            model.linear_targets: rng.rand(batch_size, num_frames, hparams.num_freq),
+            model.loss_coeff: np.ones([batch_size]),
+            **model.get_dummy_feed_dict(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cell_types', default='gru,gru_block')
+    parser.add_argument('--num_speakers', default=1, type=int)
+    parser.add_argument('--batch_size', default=hparams.batch_size, type=int)
+    parser.add_argument('--num_tokens', default=60, type=int)
+    parser.add_argument('--num_steps', default=40, type=int,
+            help='Decoder steps of the synthetic training targets')
+    parser.add_argument('--num_repeat', default=5, type=int)
+    parser.add_argument('--output_path', default="rnn_cells.json")
+    config = parser.parse_args()
+
+    sess_config = tf.ConfigProto(device_count={'GPU': 0})
+    texts = get_texts()
+
+    results = OrderedDict()
+    for cell_type in config.cell_types.split(","):
+        tf.reset_default_graph()
+        hparams.rnn_cell_type = cell_type
+
+        model, test_model = build_models(config.num_speakers)
+
+        with tf.Session(config=sess_config) as sess:
+            sess.run(tf.global_variables_initializer())
+
+            feed_dict = get_train_feed_dict(
+                    model, config.batch_size, config.num_tokens,
+                    config.num_steps, np.random.RandomState(123))
+            results[cell_type + '/train_step'] = summarize(measure(
+                    lambda: sess.run(model.optimize, feed_dict), config.num_repeat))
+
+            times = []
+            for text in texts:
+                inputs, input_lengths = get_inputs([text])
+                feed_dict = {
+                        test_model.inputs: inputs,
+                        test_model.input_lengths: input_lengths,
+                }
+                times.extend(measure(lambda: sess.run(
+                        test_model.linear_outputs, feed_dict), config.num_repeat))
+            results[cell_type + '/inference'] = summarize(times)
+
+    print_table(results)
+    write_json(config.output_path, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# CPU compile time, steady-state training step time and per-utterance
+# inference latency of the default executor against XLA JIT, with and
+# without length buckets (random weights, synthetic training batches):
+#
+#   python3 -m benchmarks.xla --bucket_size 10
+#
+# `first_pass` is the time of the first run over every batch (or text),
+# which includes one XLA compilation per distinct shape.
+import time
+import argparse
+import numpy as np
+import tensorflow as tf
+from collections import OrderedDict
+
+from hparams import hparams
+from utils import write_json, xla_scope
+from datasets.datafeeder import _prepare_inputs, _round_up
+from benchmarks import get_texts, get_inputs, measure, summarize, print_table
+from benchmarks.rnn_cells import build_models, get_train_feed_dict
+
+
+def time_runs(sess, fetch, feed_dicts, num_repeat):
+    start_time = time.time()
+    for feed_dict in feed_dicts:
+        sess.run(fetch, feed_dict)
+    first_pass = time.time() - start_time
+
+    times = []
+    for feed_dict in feed_dicts:
+        times.extend(measure(
+                lambda: sess.run(fetch, feed_dict), num_repeat, num_warmup=0))
+
+    result = summarize(times)
+    result['first_pass'] = first_pass
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_speakers', default=1, type=int)
+    parser.add_argument('--batch_size', default=hparams.batch_size, type=int)
+    parser.add_argument('--num_batches', default=10, type=int)
+    parser.add_argument('--min_tokens', default=30, type=int)
+    parser.add_argument('--max_tokens', default=90, type=int)
+    parser.add_argument('--bucket_size', default=10, type=int)
+    parser.add_argument('--num_repeat', default=5, type=int)
+    parser.add_argument('--output_path', default="xla.json")
+    config = parser.parse_args()
+
+    sess_config = tf.ConfigProto(device_count={'GPU': 0})
+    texts = get_texts()
+
+    rng = np.random.RandomState(123)
+    lengths = rng.randint(config.min_tokens, config.max_tokens + 1, config.num_batches)
+
+    results = OrderedDict()
+    for name, xla, bucket_size in [
+            ('default', False, 1),
+            ('xla', True, 1),
+            ('xla_bucket', True, config.bucket_size)]:
+        tf.reset_default_graph()
+
+        with xla_scope(xla):
+            model, test_model = build_models(config.num_speakers)
+
+        train_feed_dicts = []
+        for num_tokens in lengths:
+            # About 2 decoder steps per token
+            feed_dict = get_train_feed_dict(
+                    model, config.batch_size,
+                    _round_up(num_tokens, bucket_size),
+                    _round_up(2 * num_tokens, bucket_size),
+                    np.random.RandomState(123))
+            feed_dict[model.input_lengths] = [num_tokens] * config.batch_size
+            train_feed_dicts.append(feed_dict)
+
+        test_feed_dicts = []
+        for text in texts:
+            inputs, input_lengths = get_inputs([text])
+            test_feed_dicts.append({
+                    test_model.inputs: _prepare_inputs(inputs, bucket_size),
+                    test_model.input_lengths: input_lengths,
+            })
+
+        with tf.Session(config=sess_config) as sess:
+            sess.run(tf.global_variables_initializer())
+
+            results[name + '/train_step'] = time_runs(
+                    sess, model.optimize, train_feed_dicts, config.num_repeat)
+            results[name + '/inference'] = time_runs(
+                    sess, test_model.linear_outputs, test_feed_dicts, config.num_repeat)
+
+    print_table(results, keys=('first_pass', 'mean', 'p50', 'p99'))
+    write_json(config.output_path, results)
+
+
+if __name__ == '__main__':
+    main()
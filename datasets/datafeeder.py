@@ -1,5 +1,6 @@
 import os
 import time
+import bisect
 import pprint
 import random
 import threading
@@ -19,6 +20,12 @@ from audio.get_duration import get_durations
 _pad = 0
 _p_cmudict=0.5
 
+def get_duration_path(data_path):
+    # datasets/son/data/xxx.npz -> datasets/son/durations/xxx.npy
+    data_dir, filename = os.path.split(data_path)
+    return os.path.join(os.path.dirname(data_dir),
+            'durations', filename.replace('.npz', '.npy'))
+
 def get_frame(path):
     data = np.load(path)
     n_frame = data["linear"].shape[0]
@@ -31,13 +38,27 @@ def get_path_dict(
         rng=np.random.RandomState(123)):
 
     # Load metadata:
-    path_dict = {}
+    path_dict, n_frame_dict = {}, {}
     for data_dir in data_dirs:
         paths = glob("{}/*.npz".format(data_dir))
 
         if data_type == 'train':
             rng.shuffle(paths)
 
+        if hparams.num_held_out_per_speaker > 0:
+            # The last paths in sorted order, so the held-out set does not
+            # depend on the shuffling of the training paths. Chosen before the
+            # frame filter, which depends on reduction_factor, so it is the
+            # same at every stage of a reduction_factor_schedule.
+            held_out = sorted(paths)[-hparams.num_held_out_per_speaker:]
+            held_out_set = set(held_out)
+            if data_type == 'eval':
+                paths = held_out
+            else:
+                paths = [path for path in paths if path not in held_out_set]
+        elif data_type == 'eval':
+            raise Exception(" [!] Evaluation needs num_held_out_per_speaker > 0 in training")
+
         if not config.skip_path_filter:
             items = parallel_run(
                     get_frame, paths, desc="filter_by_min_max_frame_batch", parallel=True)
@@ -55,6 +76,7 @@ def get_path_dict(
 
             new_paths = [path for path, n in new_items]
             new_n_frames = [n for path, n in new_items]
+            n_frame_dict.update(new_items)
 
             hours = frames_to_hours(new_n_frames)
 
@@ -67,14 +89,20 @@ def get_path_dict(
 
         if data_type == 'train':
             new_paths = new_paths[:-n_test]
+            # Every worker of distributed training gets a disjoint shard.
+            # Workers share the random seed, so they shuffle the same way.
+            new_paths = new_paths[config.task_index::config.num_workers]
         elif data_type == 'test':
             new_paths = new_paths[-n_test:]
+        elif data_type == 'eval':
+            # Held-out paths that pass the frame filter of this stage
+            pass
         else:
             raise Exception(" [!] Unkown data_type: {}".format(data_type))
 
         path_dict[data_dir] = new_paths
 
-    return path_dict
+    return path_dict, n_frame_dict
 
 class DataFeeder(threading.Thread):
     '''Feeds batches of data into a queue on a background thread.'''
@@ -99,15 +127,36 @@ class DataFeeder(threading.Thread):
         self.min_n_frame = hparams.reduction_factor * hparams.min_iters
         self.max_n_frame = hparams.reduction_factor * hparams.max_iters - hparams.reduction_factor
         self.skip_path_filter = config.skip_path_filter
+        # Pad tokens and decoder steps to multiples of this, so that XLA
+        # compiles one graph per bucket instead of one per length
+        self.bucket_size = config.bucket_size
 
         # Load metadata:
-        self.path_dict = get_path_dict(
+        self.path_dict, n_frame_dict = get_path_dict(
                 data_dirs, self._hp, config, self.data_type,
                 n_test=self.batch_size, rng=self.rng)
 
+        # Token durations extracted by extract_durations.py
+        self.use_durations = hparams.decoder_type == 'duration'
+        if self.use_durations:
+            for data_dir, paths in self.path_dict.items():
+                self.path_dict[data_dir] = [path for path in paths \
+                        if os.path.exists(get_duration_path(path))]
+                if not self.path_dict[data_dir]:
+                    raise Exception(" [!] No durations for {}. Run extract_durations.py first". \
+                            format(data_dir))
+
+        # Length curriculum: sample from the shortest examples first
+        self.curriculum_end_step = \
+                hparams.curriculum_end_step if data_type == 'train' else 0
+        if self.curriculum_end_step > 0:
+            self._prepare_curriculum(n_frame_dict)
+
         self.data_dirs = list(self.path_dict.keys())
+        # Speakers added by adaptation come after those of the checkpoint
         self.data_dir_to_id = {
-                data_dir: idx for idx, data_dir in enumerate(self.data_dirs)}
+                data_dir: config.speaker_id_offset + idx \
+                        for idx, data_dir in enumerate(self.data_dirs)}
 
         data_weight = {
                 data_dir: 1. for data_dir in self.data_dirs
@@ -148,7 +197,7 @@ class DataFeeder(threading.Thread):
         # Create queue for buffering data:
         dtypes = [tf.int32, tf.int32, tf.float32, tf.float32, tf.float32]
 
-        self.is_multi_speaker = len(self.data_dirs) > 1
+        self.is_multi_speaker = config.speaker_id_offset + len(self.data_dirs) > 1
 
         if self.is_multi_speaker:
             self._placeholders.append(
@@ -156,17 +205,21 @@ class DataFeeder(threading.Thread):
             )
             dtypes.append(tf.int32)
 
+        if self.use_durations:
+            self._placeholders.append(
+                    tf.placeholder(tf.int32, [None, None], 'durations'),
+            )
+            dtypes.append(tf.int32)
+
         num_worker = 8 if self.data_type == 'train' else 1
         queue = tf.FIFOQueue(num_worker, dtypes, name='input_queue')
 
         self._enqueue_op = queue.enqueue(self._placeholders)
+        self._close_op = queue.close(cancel_pending_enqueues=True)
 
-        if self.is_multi_speaker:
-            self.inputs, self.input_lengths, self.loss_coeff, \
-                    self.mel_targets, self.linear_targets, self.speaker_id = queue.dequeue()
-        else:
-            self.inputs, self.input_lengths, self.loss_coeff, \
-                    self.mel_targets, self.linear_targets = queue.dequeue()
+        outputs = queue.dequeue()
+        self.inputs, self.input_lengths, self.loss_coeff, \
+                self.mel_targets, self.linear_targets = outputs[:5]
 
         self.inputs.set_shape(self._placeholders[0].shape)
         self.input_lengths.set_shape(self._placeholders[1].shape)
@@ -175,10 +228,17 @@ class DataFeeder(threading.Thread):
         self.linear_targets.set_shape(self._placeholders[4].shape)
 
         if self.is_multi_speaker:
+            self.speaker_id = outputs[5]
             self.speaker_id.set_shape(self._placeholders[5].shape)
         else:
             self.speaker_id = None
 
+        if self.use_durations:
+            self.durations = outputs[-1]
+            self.durations.set_shape(self._placeholders[-1].shape)
+        else:
+            self.durations = None
+
         if self.data_type == 'test':
             examples = []
             while True:
@@ -214,11 +274,49 @@ class DataFeeder(threading.Thread):
         self.start()
 
 
+    def _prepare_curriculum(self, n_frame_dict):
+        # Lengths come from the metadata filter, unless it was skipped
+        paths = [path for paths in self.path_dict.values() \
+                for path in paths if path not in n_frame_dict]
+        if paths:
+            items = parallel_run(get_frame, paths, desc="curriculum_lengths", parallel=True)
+            n_frame_dict.update((path, n) for path, n, n_tokens in items)
+
+        self.curriculum_paths, self.curriculum_n_frames = {}, {}
+        for data_dir, paths in self.path_dict.items():
+            paths = sorted(paths, key=lambda path: n_frame_dict[path])
+            self.curriculum_paths[data_dir] = paths
+            self.curriculum_n_frames[data_dir] = [n_frame_dict[path] for path in paths]
+
+    def _get_curriculum_max_n_frame(self):
+        # Widens linearly from curriculum_start_max_iters to max_iters
+        progress = min(float(self._step) / self.curriculum_end_step, 1.)
+        start_n_frame = self._hp.reduction_factor * self._hp.curriculum_start_max_iters
+        return start_n_frame + progress * (self.max_n_frame - start_n_frame)
+
+    def _get_curriculum_path(self, data_dir):
+        n_frames = self.curriculum_n_frames[data_dir]
+        max_n_frame = self._get_curriculum_max_n_frame()
+
+        # At least a batch of the shortest examples
+        count = max(bisect.bisect_right(n_frames, max_n_frame),
+                min(self.batch_size, len(n_frames)))
+        return self.curriculum_paths[data_dir][self.rng.randint(count)]
+
+    def stop(self):
+        '''Stops the thread, e.g. before the graph is rebuilt.'''
+        self._coord.request_stop()
+        self._session.run(self._close_op)
+        self.join()
+
     def run(self):
         try:
             while not self._coord.should_stop():
                 self._enqueue_next_group()
         except Exception as e:
+            if self._coord.should_stop():
+                # Pending enqueue cancelled by stop()
+                return
             traceback.print_exc()
             self._coord.request_stop(e)
 
@@ -253,8 +351,17 @@ class DataFeeder(threading.Thread):
             self.rng.shuffle(batches)
 
         log('Generated %d batches of size %d in %.03f sec' % (len(batches), n, time.time() - start))
+        if self._step < self.curriculum_end_step:
+            log('Curriculum: up to %d frames' % self._get_curriculum_max_n_frame())
         for batch in batches:
-            feed_dict = dict(zip(self._placeholders, _prepare_batch(batch, r, self.rng, self.data_type)))
+            values = _prepare_batch(
+                    batch, r, self.rng, self.data_type, self.bucket_size)
+            if not self.is_multi_speaker:
+                values = values[:5]
+            if self.use_durations:
+                values += (_prepare_inputs([x[5] for x in batch], self.bucket_size),)
+
+            feed_dict = dict(zip(self._placeholders, values))
             self._session.run(self._enqueue_op, feed_dict=feed_dict)
             self._step += 1
 
@@ -264,14 +371,17 @@ class DataFeeder(threading.Thread):
         data_paths = self.path_dict[data_dir]
 
         while True:
-            if self._offset[data_dir] >= len(data_paths):
-                self._offset[data_dir] = 0
+            if self._step < self.curriculum_end_step:
+                data_path = self._get_curriculum_path(data_dir)
+            else:
+                if self._offset[data_dir] >= len(data_paths):
+                    self._offset[data_dir] = 0
 
-                if self.data_type == 'train':
-                    self.rng.shuffle(data_paths)
+                    if self.data_type == 'train':
+                        self.rng.shuffle(data_paths)
 
-            data_path = data_paths[self._offset[data_dir]]
-            self._offset[data_dir] += 1
+                data_path = data_paths[self._offset[data_dir]]
+                self._offset[data_dir] += 1
 
             try:
                 if os.path.exists(data_path):
@@ -293,7 +403,8 @@ class DataFeeder(threading.Thread):
         mel_target = data['mel']
 
         # cmu_dict enabled -> convert some chararcter in known words to arpabet (p_cmudict possibilty)
-        if self._cmudict and random.random()<_p_cmudict:
+        # (not with durations, which are per original token)
+        if self._cmudict and not self.use_durations and random.random()<_p_cmudict:
             txt = text.sequence_to_text(input_data, False, True)
             txt = ' '.join([self._maybe_get_arpabet(word) for word in txt.split(' ')])
             input_data = (text.text_to_sequence(txt, as_token=False))
@@ -305,6 +416,11 @@ class DataFeeder(threading.Thread):
             loss_coeff = 1
         linear_target = data['linear']
 
+        if self.use_durations:
+            durations = np.load(get_duration_path(data_path))
+            return (input_data, loss_coeff, mel_target, linear_target,
+                    self.data_dir_to_id[data_dir], durations, len(linear_target))
+
         return (input_data, loss_coeff, mel_target, linear_target, 
                 self.data_dir_to_id[data_dir], len(linear_target))
     
@@ -313,18 +429,20 @@ class DataFeeder(threading.Thread):
         return '{%s}' % arpabet[0] if arpabet is not None and random.random() < 0.5 else word
 
 
-def _prepare_batch(batch, reduction_factor, rng, data_type=None):
+def _prepare_batch(batch, reduction_factor, rng, data_type=None, bucket_size=1):
     if data_type == 'train':
         rng.shuffle(batch)
 
-    inputs = _prepare_inputs([x[0] for x in batch])
+    inputs = _prepare_inputs([x[0] for x in batch], bucket_size)
     input_lengths = np.asarray([len(x[0]) for x in batch], dtype=np.int32)
     loss_coeff = np.asarray([x[1] for x in batch], dtype=np.float32)
 
-    mel_targets = _prepare_targets([x[2] for x in batch], reduction_factor)
-    linear_targets = _prepare_targets([x[3] for x in batch], reduction_factor)
+    mel_targets = _prepare_targets(
+            [x[2] for x in batch], reduction_factor * bucket_size)
+    linear_targets = _prepare_targets(
+            [x[3] for x in batch], reduction_factor * bucket_size)
 
-    if len(batch[0]) == 6:
+    if len(batch[0]) >= 6:
         speaker_id = np.asarray([x[4] for x in batch], dtype=np.int32)
         return (inputs, input_lengths, loss_coeff,
                 mel_targets, linear_targets, speaker_id)
@@ -332,8 +450,8 @@ def _prepare_batch(batch, reduction_factor, rng, data_type=None):
         return (inputs, input_lengths, loss_coeff, mel_targets, linear_targets)
 
 
-def _prepare_inputs(inputs):
-    max_len = max((len(x) for x in inputs))
+def _prepare_inputs(inputs, bucket_size=1):
+    max_len = _round_up(max((len(x) for x in inputs)), bucket_size)
     return np.stack([_pad_input(x, max_len) for x in inputs])
 
 
@@ -0,0 +1,213 @@
+import os
+import time
+import argparse
+import numpy as np
+import tensorflow as tf
+
+from hparams import hparams, hparams_debug_string
+from models import create_model, restore_variables
+from utils import str2bool, load_hparams, infolog
+from datasets.datafeeder import get_path_dict, get_duration_path, \
+        _prepare_batch, _prepare_inputs
+from train import get_alignment_score, get_reduction_factor, get_duration_kwargs
+
+log = infolog.log
+
+
+def load_example(path, speaker_id, use_durations):
+    # Same layout as DataFeeder._get_next_example
+    data = np.load(path)
+    loss_coeff = data['loss_coeff'] if 'loss_coeff' in data else 1
+
+    example = (data['tokens'], loss_coeff, data['mel'], data['linear'], speaker_id)
+    if use_durations:
+        example += (np.load(get_duration_path(path)),)
+    return example + (len(data['linear']),)
+
+
+class EvalData(object):
+    '''Held-out examples of every speaker, in padded batches of similar length.'''
+
+    def __init__(self, data_dirs, config):
+        path_dict, n_frame_dict = get_path_dict(
+                data_dirs, hparams, config, 'eval')
+
+        # Speakers added by adaptation come after those of the checkpoint
+        speaker_id_offset = hparams.num_speakers - len(data_dirs)
+        items = [(path, speaker_id_offset + idx) \
+                for idx, data_dir in enumerate(data_dirs) for path in path_dict[data_dir]]
+        items.sort(key=lambda item: n_frame_dict.get(item[0], 0))
+
+        self.batches = [items[idx:idx + config.batch_size] \
+                for idx in range(0, len(items), config.batch_size)]
+        self.num_examples = len(items)
+
+        self.is_multi_speaker = hparams.num_speakers > 1
+        self.use_durations = hparams.decoder_type == 'duration'
+
+        self.inputs = tf.placeholder(tf.int32, [None, None], 'inputs')
+        self.input_lengths = tf.placeholder(tf.int32, [None], 'input_lengths')
+        self.loss_coeff = tf.placeholder(tf.float32, [None], 'loss_coeff')
+        self.mel_targets = tf.placeholder(
+                tf.float32, [None, None, hparams.num_mels], 'mel_targets')
+        self.linear_targets = tf.placeholder(
+                tf.float32, [None, None, hparams.num_freq], 'linear_targets')
+        self.speaker_id = tf.placeholder(tf.int32, [None], 'speaker_id') \
+                if self.is_multi_speaker else None
+        self.durations = tf.placeholder(tf.int32, [None, None], 'durations') \
+                if self.use_durations else None
+
+    def get_feed_dicts(self):
+        placeholders = [self.inputs, self.input_lengths, self.loss_coeff,
+                        self.mel_targets, self.linear_targets]
+        if self.is_multi_speaker:
+            placeholders.append(self.speaker_id)
+
+        for batch in self.batches:
+            examples = [load_example(path, speaker_id, self.use_durations) \
+                    for path, speaker_id in batch]
+            values = _prepare_batch(examples, hparams.reduction_factor, None, 'eval')
+
+            feed_dict = dict(zip(placeholders, values))
+            if self.use_durations:
+                feed_dict[self.durations] = _prepare_inputs([x[5] for x in examples])
+            yield len(batch), feed_dict
+
+
+class Evaluator(object):
+    '''Teacher-forced and free-running losses of a checkpoint on EvalData.'''
+
+    def __init__(self, data_dirs, config):
+        self.reduction_factor = hparams.reduction_factor
+
+        tf.reset_default_graph()
+        self.data = EvalData(data_dirs, config)
+
+        self.models = {}
+        for name, free_running in [('teacher_forced', False), ('free_running', True)]:
+            with tf.variable_scope('model', reuse=free_running):
+                model = create_model(hparams)
+                model.initialize(
+                        self.data.inputs, self.data.input_lengths,
+                        hparams.num_speakers, self.data.speaker_id,
+                        self.data.mel_targets, self.data.linear_targets,
+                        self.data.loss_coeff, rnn_decoder_test_mode=free_running,
+                        manual_attention=False, is_training=False,
+                        **get_duration_kwargs(self.data))
+                model.add_loss()
+            self.models[name] = model
+
+        self.fetches = {
+                name: {
+                        'loss_mel': model.mel_loss,
+                        'loss_linear': model.linear_loss,
+                        'loss': model.loss_without_coeff,
+                        'alignments': model.alignments,
+                } for name, model in self.models.items()
+        }
+
+        sess_config = tf.ConfigProto(allow_soft_placement=True)
+        sess_config.gpu_options.allow_growth = True
+        self.sess = tf.Session(config=sess_config)
+
+    def evaluate(self, checkpoint_path):
+        '''Returns {"teacher_forced/loss": ..., "free_running/alignment_score": ...}'''
+        restore_variables(self.sess, checkpoint_path)
+
+        totals = {}
+        for batch_size, feed_dict in self.data.get_feed_dicts():
+            results = self.sess.run(self.fetches, feed_dict=feed_dict)
+
+            for name, values in results.items():
+                values['alignment_score'] = get_alignment_score(values.pop('alignments'))
+                for key, value in values.items():
+                    tag = '{}/{}'.format(name, key)
+                    # Losses are batch means, weighted by the batch size
+                    totals[tag] = totals.get(tag, 0.) + value * batch_size
+
+        return {tag: total / self.data.num_examples for tag, total in totals.items()}
+
+
+def get_checkpoint_step(checkpoint_path):
+    return int(checkpoint_path.split('-')[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--load_path', required=True,
+            help='Model dir of a training run, checked for new checkpoints')
+    parser.add_argument('--data_paths', default='datasets/kr_example',
+            help='data_paths of the training run')
+    parser.add_argument('--batch_size', type=int, default=64)
+    parser.add_argument('--interval', type=int, default=60,
+            help='Seconds between checks for a new checkpoint')
+    parser.add_argument('--use_gpu', type=str2bool, default=False,
+            help='By default the evaluator runs on CPU, next to training on the GPUs')
+    parser.add_argument('--once', type=str2bool, default=False,
+            help='Evaluate the latest checkpoint and exit')
+    parser.add_argument('--skip_path_filter',
+            type=str2bool, default=False, help='Use only for debugging')
+    config = parser.parse_args()
+
+    if not config.use_gpu:
+        os.environ['CUDA_VISIBLE_DEVICES'] = ''
+
+    # get_path_dict only shards training paths
+    config.task_index, config.num_workers = 0, 1
+
+    load_hparams(hparams, config.load_path)
+    data_dirs = [os.path.join(data_path, "data") \
+            for data_path in config.data_paths.split(",")]
+
+    eval_dir = os.path.join(config.load_path, 'eval')
+    if not os.path.exists(eval_dir):
+        os.makedirs(eval_dir)
+
+    infolog.init(os.path.join(eval_dir, 'eval.log'), config.load_path)
+    log(hparams_debug_string())
+
+    summary_writer = tf.summary.FileWriter(eval_dir)
+    evaluator, last_checkpoint_path = None, None
+
+    while True:
+        # The checkpoint state is written after the checkpoint files,
+        # so it never points to a checkpoint that is still being written
+        checkpoint_path = tf.train.latest_checkpoint(config.load_path)
+
+        if checkpoint_path is None or checkpoint_path == last_checkpoint_path:
+            if config.once:
+                break
+            time.sleep(config.interval)
+            continue
+
+        step = get_checkpoint_step(checkpoint_path)
+
+        # reduction_factor_schedule changes the shapes of the model
+        reduction_factor, _ = get_reduction_factor(step)
+        if evaluator is None or evaluator.reduction_factor != reduction_factor:
+            if evaluator is not None:
+                evaluator.sess.close()
+            hparams.reduction_factor = reduction_factor
+            evaluator = Evaluator(data_dirs, config)
+            log(' [*] Evaluating on {} held-out examples (reduction_factor={})'. \
+                    format(evaluator.data.num_examples, reduction_factor))
+
+        start_time = time.time()
+        results = evaluator.evaluate(checkpoint_path)
+
+        summary_writer.add_summary(tf.Summary(value=[
+                tf.Summary.Value(tag='eval/' + tag, simple_value=value) \
+                        for tag, value in sorted(results.items())]), step)
+        summary_writer.flush()
+
+        log('Step %-7d [%.01f sec] teacher-forced loss=%.05f, free-running loss=%.05f' % (
+                step, time.time() - start_time,
+                results['teacher_forced/loss'], results['free_running/loss']))
+
+        last_checkpoint_path = checkpoint_path
+        if config.once:
+            break
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+import os
+import argparse
+import numpy as np
+import tensorflow as tf
+from collections import Counter
+from tensorflow.python.framework import tensor_util
+
+from hparams import hparams
+from models import create_model, get_most_recent_checkpoint, restore_variables
+from utils import load_hparams, save_hparams, makedirs, str2bool
+
+
+FROZEN_GRAPH_NAME = "frozen_model.pb"
+
+INPUT_NAMES = ['inputs', 'input_lengths', 'speaker_id']
+OUTPUT_NAMES = ['mel_outputs', 'linear_outputs', 'alignments', 'output_lengths']
+
+# Single speaker models do not use speaker_id, so freezing would drop the
+# placeholder: an identity of it is kept as an extra output
+SPEAKER_ID_OUTPUT = 'speaker_id_output'
+FROZEN_OUTPUT_NAMES = OUTPUT_NAMES + [SPEAKER_ID_OUTPUT]
+
+
+class FrozenTacotron(object):
+    '''Tensors of an imported frozen graph, named like the fields of models.Tacotron.'''
+    def __init__(self, graph):
+        for name in INPUT_NAMES + OUTPUT_NAMES:
+            setattr(self, name, graph.get_tensor_by_name(name + ':0'))
+
+        # Manual attention is not part of the exported graph
+        self.is_manual_attention = None
+        self.manual_alignments = None
+
+    def get_dummy_feed_dict(self):
+        return {}
+
+
+def build_inference_graph(num_speakers, fold_batch_norm=False):
+    inputs = tf.placeholder(tf.int32, [None, None], 'inputs')
+    input_lengths = tf.placeholder(tf.int32, [None], 'input_lengths')
+
+    batch_size = tf.shape(inputs)[0]
+    speaker_id = tf.placeholder_with_default(
+            tf.zeros([batch_size], dtype=tf.int32), [None], 'speaker_id')
+
+    with tf.variable_scope('model') as scope:
+        model = create_model(hparams)
+        model.initialize(
+                inputs, input_lengths,
+                num_speakers, speaker_id,
+                manual_attention=False,
+                fold_batch_norm=fold_batch_norm)
+
+    # Give the outputs stable names at the top of the graph
+    for name in OUTPUT_NAMES:
+        tf.identity(getattr(model, name), name=name)
+    tf.identity(speaker_id, name=SPEAKER_ID_OUTPUT)
+
+    return model
+
+
+def freeze_graph(sess, output_names=FROZEN_OUTPUT_NAMES):
+    # Only the nodes needed for the outputs are kept, so dropout,
+    # loss, optimizer and Adam slot variables do not make it in.
+    graph_def = sess.graph.as_graph_def()
+    return tf.graph_util.convert_variables_to_constants(
+            sess, graph_def, output_names)
+
+
+def fold_batch_norms(values, folded_names, epsilon=1e-3):
+    '''Maps checkpoint values onto the variables of a graph built with fold_batch_norm=True.
+
+    Args:
+        values: dict of variable name to value of the original inference graph
+        folded_names: variable names of the folded inference graph
+        epsilon: epsilon of tf.layers.batch_normalization
+    '''
+    folded = {name: values[name] for name in folded_names if name in values}
+
+    for name in values:
+        if not name.endswith('batch_normalization/gamma'):
+            continue
+        scope = name[:-len('batch_normalization/gamma')]
+
+        # Inference batch norm: x * scale + shift
+        scale = values[scope + 'batch_normalization/gamma'] / \
+                np.sqrt(values[scope + 'batch_normalization/moving_variance'] + epsilon)
+        shift = values[scope + 'batch_normalization/beta'] - \
+                values[scope + 'batch_normalization/moving_mean'] * scale
+
+        if scope + 'folded_batch_normalization/scale' in folded_names:
+            folded[scope + 'folded_batch_normalization/scale'] = scale
+            folded[scope + 'folded_batch_normalization/shift'] = shift
+        else:
+            # kernel: [width, in_channels, out_channels]
+            folded[scope + 'conv1d/kernel'] = values[scope + 'conv1d/kernel'] * scale
+            folded[scope + 'conv1d/bias'] = values[scope + 'conv1d/bias'] * scale + shift
+
+    missing = [name for name in folded_names if name not in folded]
+    if missing:
+        raise Exception(" [!] No value to fold into: {}".format(missing))
+
+    return folded
+
+
+def optimize_graph(graph_def):
+    from tensorflow.tools.graph_transforms import TransformGraph
+
+    return TransformGraph(
+            graph_def, INPUT_NAMES, FROZEN_OUTPUT_NAMES,
+            ['fold_constants(ignore_errors=true)'])
+
+
+def _input_name(name):
+    return name.lstrip('^').split(':')[0]
+
+
+def _add_const_chain(graph_def, name, value, chain):
+    # Same Identity and Enter nodes as `chain`, so that the constant
+    # reaches the same while loop frame as the weight
+    const = graph_def.node.add()
+    const.op = 'Const'
+    const.name = name
+    const.attr['dtype'].type = tf.as_dtype(value.dtype).as_datatype_enum
+    const.attr['value'].tensor.CopyFrom(tensor_util.make_tensor_proto(value))
+
+    output_name = const.name
+    for idx, node in enumerate(reversed(chain)):
+        copied = graph_def.node.add()
+        copied.CopyFrom(node)
+        copied.name = "{}/{}_{}".format(name, node.op.lower(), idx)
+        copied.attr['T'].type = const.attr['dtype'].type
+        if '_class' in copied.attr:
+            del copied.attr['_class']
+
+        del copied.input[:]
+        copied.input.append(output_name)
+        output_name = copied.name
+
+    return output_name
+
+
+def shrink_pruned_weights(graph_def, min_pruned_ratio=0.1):
+    '''Drops the zero rows of MatMul weights and gathers the matching input columns.
+
+    Kernels pruned by models.pruning have whole rows of zeros, and
+    matmul(x, W) == matmul(gather(x, rows, axis=1), W[rows]).
+    '''
+    nodes = {node.name: node for node in graph_def.node}
+    num_consumers = Counter(
+            _input_name(name) for node in graph_def.node for name in node.input)
+
+    num_shrunk = 0
+    for node in list(graph_def.node):
+        if node.op != 'MatMul' or \
+                node.attr['transpose_a'].b or node.attr['transpose_b'].b:
+            continue
+
+        # Follow the variable read and the while loop Enter nodes
+        chain = []
+        weight = nodes[_input_name(node.input[1])]
+        while weight.op in ['Identity', 'Enter']:
+            chain.append(weight)
+            weight = nodes[_input_name(weight.input[0])]
+
+        if weight.op != 'Const' or \
+                any(num_consumers[item.name] > 1 for item in [weight] + chain):
+            continue
+
+        value = tensor_util.MakeNdarray(weight.attr['value'].tensor)
+        rows = np.where(np.any(value != 0, axis=1))[0].astype(np.int32)
+
+        if len(rows) > (1 - min_pruned_ratio) * len(value):
+            continue
+        elif len(rows) == 0:
+            rows = np.zeros([1], dtype=np.int32)
+
+        weight.attr['value'].tensor.CopyFrom(
+                tensor_util.make_tensor_proto(value[rows]))
+
+        gather = graph_def.node.add()
+        gather.op = 'GatherV2'
+        gather.name = node.name + '/pruned_inputs'
+        gather.input.extend([
+                node.input[0],
+                _add_const_chain(graph_def, node.name + '/pruned_rows', rows, chain),
+                _add_const_chain(graph_def, node.name + '/pruned_axis',
+                        np.array(1, dtype=np.int32), chain),
+        ])
+        gather.attr['Tparams'].type = node.attr['T'].type
+        gather.attr['Tindices'].type = tf.int32.as_datatype_enum
+        gather.attr['Taxis'].type = tf.int32.as_datatype_enum
+
+        node.input[0] = gather.name
+        num_shrunk += 1
+
+    if num_shrunk > 0:
+        print(" [*] Shrunk {} pruned weights".format(num_shrunk))
+    return graph_def
+
+
+def load_frozen_graph(frozen_path):
+    graph_def = tf.GraphDef()
+    with tf.gfile.GFile(frozen_path, "rb") as f:
+        graph_def.ParseFromString(f.read())
+
+    tf.import_graph_def(graph_def, name='')
+    return FrozenTacotron(tf.get_default_graph())
+
+
+def export(load_path, export_dir, num_speakers,
+        checkpoint_step=None, optimize=True):
+    checkpoint_path = get_most_recent_checkpoint(load_path, checkpoint_step)
+    load_hparams(hparams, load_path)
+
+    with tf.Graph().as_default():
+        build_inference_graph(num_speakers)
+
+        with tf.Session() as sess:
+            restore_variables(sess, checkpoint_path)
+
+            if optimize:
+                variables = tf.global_variables()
+                values = dict(zip(
+                        [var.op.name for var in variables], sess.run(variables)))
+            else:
+                graph_def = freeze_graph(sess)
+
+    if optimize:
+        with tf.Graph().as_default():
+            build_inference_graph(num_speakers, fold_batch_norm=True)
+
+            with tf.Session() as sess:
+                variables = tf.global_variables()
+                folded = fold_batch_norms(
+                        values, [var.op.name for var in variables])
+
+                for var in variables:
+                    var.load(folded[var.op.name], sess)
+
+                graph_def = shrink_pruned_weights(
+                        optimize_graph(freeze_graph(sess)))
+
+    makedirs(export_dir)
+    frozen_path = os.path.join(export_dir, FROZEN_GRAPH_NAME)
+
+    with tf.gfile.GFile(frozen_path, "wb") as f:
+        f.write(graph_def.SerializeToString())
+    save_hparams(export_dir, hparams)
+
+    print(" [*] Exported {} ({} nodes, {:.2f} MB): {}".format(
+            checkpoint_path, len(graph_def.node),
+            os.path.getsize(frozen_path) / 1024 / 1024, frozen_path))
+    return frozen_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--load_path', required=True)
+    parser.add_argument('--export_dir', default=None)
+    parser.add_argument('--num_speakers', default=1, type=int)
+    parser.add_argument('--checkpoint_step', default=None, type=int)
+    parser.add_argument('--optimize', default=True, type=str2bool,
+            help='Fold batch norms and constants, and shrink pruned weights')
+    config = parser.parse_args()
+
+    export_dir = config.export_dir or os.path.join(config.load_path, "export")
+    export(config.load_path, export_dir,
+            config.num_speakers, config.checkpoint_step, config.optimize)
@@ -0,0 +1,92 @@
+import os
+import argparse
+import numpy as np
+from glob import glob
+from tqdm import tqdm
+import tensorflow as tf
+
+from hparams import hparams
+from models import get_most_recent_checkpoint, restore_variables
+from models.tacotron import Tacotron
+from utils import load_hparams, makedirs
+from datasets.datafeeder import get_duration_path, _prepare_targets
+
+
+def get_durations(alignment, num_frames, reduction_factor):
+    '''Number of frames of each token from a teacher-forced alignment.
+
+    Args:
+        alignment: [T_in, T_dec] alignment of the attention decoder
+        num_frames: number of frames of the target
+        reduction_factor: frames per decoder step
+    '''
+    num_steps = (num_frames + reduction_factor - 1) // reduction_factor
+
+    # Every decoder step goes to the token it attends to most
+    tokens = np.argmax(alignment[:, :num_steps], axis=0)
+    durations = np.bincount(tokens, minlength=len(alignment)) * reduction_factor
+
+    # The last step also covers the padding after the target
+    durations[tokens[-1]] -= num_steps * reduction_factor - num_frames
+    return durations.astype(np.int32)
+
+
+def extract_durations(load_path, data_paths, checkpoint_step=None):
+    checkpoint_path = get_most_recent_checkpoint(load_path, checkpoint_step)
+    load_hparams(hparams, load_path)
+
+    num_speakers = len(data_paths)
+    r = hparams.reduction_factor
+
+    inputs = tf.placeholder(tf.int32, [None, None], 'inputs')
+    input_lengths = tf.placeholder(tf.int32, [None], 'input_lengths')
+    speaker_id = tf.placeholder(tf.int32, [None], 'speaker_id')
+    mel_targets = tf.placeholder(tf.float32, [None, None, hparams.num_mels], 'mel_targets')
+
+    # Teacher-forced attention model, without dropout
+    with tf.variable_scope('model') as scope:
+        model = Tacotron(hparams)
+        model.initialize(
+                inputs, input_lengths, num_speakers, speaker_id,
+                mel_targets, manual_attention=False, is_training=False)
+
+    with tf.Session() as sess:
+        restore_variables(sess, checkpoint_path)
+
+        for idx, data_path in enumerate(data_paths):
+            paths = glob("{}/*.npz".format(os.path.join(data_path, "data")))
+
+            num_skipped = 0
+            for path in tqdm(paths, desc=data_path):
+                data = np.load(path)
+                tokens, mel = data['tokens'], data['mel']
+
+                alignment = sess.run(model.alignments, {
+                        inputs: [tokens],
+                        input_lengths: [len(tokens)],
+                        speaker_id: [idx],
+                        mel_targets: _prepare_targets([mel], r),
+                })[0]
+
+                # Decoding stops at max_iters
+                if alignment.shape[1] * r < len(mel):
+                    num_skipped += 1
+                    continue
+
+                duration_path = get_duration_path(path)
+                makedirs(os.path.dirname(duration_path))
+                np.save(duration_path, get_durations(alignment, len(mel), r))
+
+            print(" [*] Extracted durations of {} files in {} ({} too long)". \
+                    format(len(paths) - num_skipped, data_path, num_skipped))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--load_path', required=True)
+    parser.add_argument('--data_paths', default='datasets/kr_example')
+    parser.add_argument('--checkpoint_step', default=None, type=int)
+    config = parser.parse_args()
+
+    extract_durations(
+            config.load_path, config.data_paths.split(","), config.checkpoint_step)
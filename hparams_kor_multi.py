@@ -31,6 +31,8 @@ if True:
 basic_params.update({
     # Model
     'model_type': 'deepvoice', # [single, simple, deepvoice]
+    'decoder_type': 'attention', # [attention, duration] duration: decode all frames at once from token durations
+    'rnn_cell_type': 'gru', # [gru, gru_block] gru_block: fused GRUBlockCell, reads gru checkpoints
     'speaker_embedding_size': f(16),
 
     'embedding_size': f(256),
@@ -50,6 +52,7 @@ basic_params.update({
     'attention_type': 'bah_mon', # ntm2-5
     'attention_size': f(256),
     'attention_state_size': f(256),
+    'attention_window_size': 0, # inference only: attend to this many inputs around the last peak (0: full)
 
     # Decoder recurrent network
     'dec_layer_num': 2,
@@ -65,7 +68,21 @@ basic_params.update({
     'post_proj_sizes': [f(256), 80], # num_mels=80
     'post_proj_width': 3,
 
+    'fused_conv_bank': False, # run each CBHG conv bank as one convolution (same variables)
+
+    # Training memory: recompute the post CBHG activations in backprop
+    # instead of keeping them (the decoder loop is not recomputed), and
+    # swap the decoder loop activations to host memory (no effect on CPU)
+    'recompute_post_cbhg': False,
+    'decoder_swap_memory': False,
+
+    # Duration decoder (decoder_type: duration)
+    'duration_predictor_channels': f(256),
+    'duration_predictor_width': 3,
+
     'reduction_factor': 4,
+    # start_step:r stages, e.g. "0:5,20000:3,60000:2" (overrides reduction_factor)
+    'reduction_factor_schedule': '',
 })
 
 if False: # Deep Voice 2 AudioBook Dataset
@@ -120,6 +137,7 @@ elif False: # Single Speaker with generalization
 basic_params.update({
     # Training
     'batch_size': 16,
+    'gradient_accumulation_steps': 1, # updates average the gradients of this many batches
     'adam_beta1': 0.9,
     'adam_beta2': 0.999,
     'use_fixed_test_inputs': False,
@@ -128,6 +146,10 @@ basic_params.update({
     'decay_learning_rate_mode': 1, # True in deepvoice2 paper
     'initial_data_greedy': True,
     'initial_phase_step': 8000,
+    # Length curriculum: > 0 samples the shortest utterances first and widens
+    # from curriculum_start_max_iters to max_iters decoder steps by this step
+    'curriculum_end_step': 0,
+    'curriculum_start_max_iters': 50,
     'main_data_greedy_factor': 0,
     'main_data': [''],
     'prioritize_loss': False,
@@ -135,11 +157,25 @@ basic_params.update({
     'recognition_loss_coeff': 0.2,
     'ignore_recognition_level': 0, # 0: use all, 1: ignore only unmatched_alignment, 2: fully ignore recognition
 
+    # Pruning: zero row blocks of the 2D kernels, sparsity grows from 0 to the target (0: disabled)
+    'prune_target_sparsity': 0.0,
+    'prune_block_size': 4,
+    'prune_begin_step': 0,
+    'prune_end_step': 20000,
+    'prune_frequency': 100,
+
+    # Distillation (train.py --teacher_path): weight of the teacher outputs and alignments
+    'distill_coeff': 0.5,
+    'distill_alignment_coeff': 0.1,
+
     # Eval
     'min_tokens': 30,#originally 50, 30 is good for korean,
     'min_iters': 30,
     'max_iters': 200,
     'skip_inadequate': False,
+    # Examples per speaker kept out of training for evaluator.py
+    'num_held_out_per_speaker': 0,
+    'stop_threshold': 0.2, # stop when attention reached the last token and every output value is below this
 
     'griffin_lim_iters': 60,
     'power': 1.5, # Power to raise magnitudes to prior to Griffin-Lim
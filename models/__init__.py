@@ -1,19 +1,150 @@
 import os
 from glob import glob
+import numpy as np
+import tensorflow as tf
 from .tacotron import Tacotron
+from .duration import DurationTacotron
 
 
 def create_model(hparams):
+  if hparams.decoder_type == 'duration':
+    return DurationTacotron(hparams)
   return Tacotron(hparams)
 
 
-def get_most_recent_checkpoint(checkpoint_dir):
-    checkpoint_paths = [path for path in glob("{}/*.ckpt-*.data-*".format(checkpoint_dir))]
-    idxes = [int(os.path.basename(path).split('-')[1].split('.')[0]) for path in checkpoint_paths]
+def get_most_recent_checkpoint(checkpoint_dir, checkpoint_step=None):
+    if checkpoint_step is None:
+        checkpoint_paths = [path for path in glob("{}/*.ckpt-*.data-*".format(checkpoint_dir))]
+        idxes = [int(os.path.basename(path).split('-')[1].split('.')[0]) for path in checkpoint_paths]
 
-    max_idx = max(idxes)
+        max_idx = max(idxes)
+    else:
+        max_idx = checkpoint_step
     lastest_checkpoint = os.path.join(checkpoint_dir, "model.ckpt-{}".format(max_idx))
 
     #latest_checkpoint=checkpoint_paths[0]
     print(" [*] Found lastest checkpoint: {}".format(lastest_checkpoint))
     return lastest_checkpoint
+
+
+# Variables of GRUCell and of GRUBlockCell (rnn_cell_type: gru_block)
+GRU_VARIABLE_NAMES = [
+    ('gru_cell/gates/kernel', 'GRUBlockCell/w_ru'),
+    ('gru_cell/gates/bias', 'GRUBlockCell/b_ru'),
+    ('gru_cell/candidate/kernel', 'GRUBlockCell/w_c'),
+    ('gru_cell/candidate/bias', 'GRUBlockCell/b_c'),
+]
+
+
+def get_checkpoint_name(name, checkpoint_names):
+    '''Name of the variable `name` in a checkpoint, which may use the other GRU cell type.'''
+    if name in checkpoint_names:
+        return name
+
+    for gru_name, block_name in GRU_VARIABLE_NAMES:
+        for old, new in [(gru_name, block_name), (block_name, gru_name)]:
+            if name.endswith(old) and name[:-len(old)] + new in checkpoint_names:
+                return name[:-len(old)] + new
+    return None
+
+
+def restore_variables(sess, checkpoint_path, var_list=None,
+        allow_missing=False, checkpoint_scope=None):
+    '''Restores `var_list` (default: all global variables) from a checkpoint.
+
+    GRU variables are mapped between GRUCell and GRUBlockCell names, so a
+    checkpoint loads with either rnn_cell_type. Returns the variables that
+    are not in the checkpoint with the same shape, which is an error unless
+    `allow_missing`.
+
+    Args:
+        checkpoint_scope: replaces the top scope of the variable names,
+            e.g. 'model' to load a teacher built in the 'teacher' scope
+    '''
+    if var_list is None:
+        var_list = tf.global_variables()
+
+    reader = tf.train.NewCheckpointReader(checkpoint_path)
+    shapes = reader.get_variable_to_shape_map()
+
+    restored, missing = {}, []
+    for var in var_list:
+        name = var.op.name
+        if checkpoint_scope is not None:
+            name = checkpoint_scope + name[name.index('/'):]
+
+        name = get_checkpoint_name(name, shapes)
+        if name is not None and shapes[name] == var.get_shape().as_list():
+            restored[name] = var
+        else:
+            missing.append(var)
+
+    if missing and not allow_missing:
+        raise Exception(" [!] Not in {}: {}".format(
+                checkpoint_path, ", ".join(var.op.name for var in missing)))
+
+    tf.train.Saver(restored).restore(sess, checkpoint_path)
+    return missing
+
+
+def restore_available_variables(sess, checkpoint_path, var_list=None):
+    '''Restores the variables that exist in the checkpoint with the same shape.
+
+    Returns the variables that were left as initialized, e.g. the pruning
+    masks when fine-tuning a checkpoint trained without them.
+    '''
+    return restore_variables(sess, checkpoint_path, var_list, allow_missing=True)
+
+
+def restore_resized_variables(sess, checkpoint_path, var_list, num_mels):
+    '''Restores the decoder output projection (and its optimizer slots) from
+    a checkpoint trained with another reduction factor.
+
+    The last axis of these variables holds `num_mels` values for each of the
+    r frames of a decoder step. Every new frame starts from the checkpoint
+    frame that covers the same part of the step. Raises for the variables
+    that can not be restored this way.
+    '''
+    reader = tf.train.NewCheckpointReader(checkpoint_path)
+    shapes = reader.get_variable_to_shape_map()
+
+    missing = []
+    for var in var_list:
+        shape = var.get_shape().as_list()
+        name = get_checkpoint_name(var.op.name, shapes)
+
+        if name is None or not shape or shapes[name][:-1] != shape[:-1] or \
+                shape[-1] % num_mels != 0 or shapes[name][-1] % num_mels != 0:
+            missing.append(var)
+            continue
+
+        old_r, new_r = shapes[name][-1] // num_mels, shape[-1] // num_mels
+        index = (2 * np.arange(new_r) + 1) * old_r // (2 * new_r)
+
+        frames = reader.get_tensor(name).reshape(shape[:-1] + [old_r, num_mels])
+        var.load(frames[..., index, :].reshape(shape), sess)
+
+    if missing:
+        raise Exception(" [!] Not in {}: {}".format(
+                checkpoint_path, ", ".join(var.op.name for var in missing)))
+
+
+def restore_appended_rows(sess, checkpoint_path, var_list):
+    '''Restores embedding tables that have more rows than in a checkpoint,
+    e.g. for speakers added by adaptation. The first rows come from the
+    checkpoint and the appended ones keep their initial values.
+    '''
+    reader = tf.train.NewCheckpointReader(checkpoint_path)
+    shapes = reader.get_variable_to_shape_map()
+
+    for var in var_list:
+        shape = var.get_shape().as_list()
+        name = get_checkpoint_name(var.op.name, shapes)
+
+        if name is None or shapes[name][1:] != shape[1:] or shapes[name][0] > shape[0]:
+            raise Exception(" [!] Can not append rows of {} to {} in {}".format(
+                    var.op.name, name, checkpoint_path))
+
+        value = sess.run(var)
+        value[:shapes[name][0]] = reader.get_tensor(name)
+        var.load(value, sess)
@@ -0,0 +1,217 @@
+import tensorflow as tf
+
+from utils.infolog import log
+
+from .modules import cbhg, conv1d, recompute_grad
+from .tacotron import Tacotron
+
+
+def expand_by_durations(inputs, durations, max_frames):
+    '''Repeats every step of `inputs` by its duration.
+
+    Args:
+        inputs: [N, T_in, D]
+        durations: [N, T_in] int32, number of frames of each step
+        max_frames: int32 scalar, length of the outputs
+    Returns:
+        outputs: [N, max_frames, D], zeros after the last frame
+        frame_tokens: [N, max_frames], index of the input step of each frame
+        output_lengths: [N], number of frames of each item
+    '''
+    batch_size, num_tokens = tf.shape(inputs)[0], tf.shape(inputs)[1]
+
+    # [N, T_in], frame right after each token
+    ends = tf.cumsum(durations, axis=1)
+    output_lengths = ends[:, -1]
+
+    # A frame belongs to the first token that ends after it
+    frames = tf.reshape(tf.range(max_frames), [1, -1, 1])
+    frame_tokens = tf.reduce_sum(
+            tf.cast(tf.expand_dims(ends, 1) <= frames, tf.int32), axis=2)
+    frame_tokens = tf.minimum(frame_tokens, num_tokens - 1)
+
+    batch_index = tf.tile(
+            tf.expand_dims(tf.range(batch_size), 1), [1, max_frames])
+    outputs = tf.gather_nd(inputs, tf.stack([batch_index, frame_tokens], axis=2))
+
+    frame_mask = tf.sequence_mask(output_lengths, max_frames, dtype=tf.float32)
+    return outputs * tf.expand_dims(frame_mask, 2), frame_tokens, output_lengths
+
+
+class DurationTacotron(Tacotron):
+    '''Tacotron with a non-autoregressive decoder.
+
+    The encoder outputs are repeated by the number of frames of each token
+    and a CBHG predicts all mel frames at once, followed by the usual post
+    CBHG. Durations come from the alignments of a trained Tacotron
+    (extract_durations.py) in training and from a duration predictor at
+    inference.
+    '''
+
+    def initialize(
+            self, inputs, input_lengths, num_speakers, speaker_id,
+            mel_targets=None, linear_targets=None, loss_coeff=None,
+            rnn_decoder_test_mode=False, is_randomly_initialized=False,
+            manual_attention=True, fold_batch_norm=False, streaming=False,
+            is_training=None, durations=None):
+        if is_training is None:
+            is_training = linear_targets is not None
+        self.is_randomly_initialized = is_randomly_initialized
+
+        if is_training and fold_batch_norm:
+            raise Exception(" [!] fold_batch_norm is only for inference graphs")
+        if streaming:
+            raise Exception(" [!] Streaming is only for the attention decoder")
+        if mel_targets is not None and durations is None:
+            raise Exception(" [!] Training the duration decoder needs durations")
+
+        with tf.variable_scope('inference') as scope:
+            hp = self._hparams
+
+            encoder_dim = hp.enc_rnn_size * 2
+
+            # Inference input_lengths stop at the EOS token (see Synthesizer)
+            # while training ones include it, so tokens are counted up to the
+            # padding (symbol 0) instead, and EOS gets frames in both cases.
+            input_mask = tf.cast(tf.not_equal(inputs, 0), tf.float32)
+            token_lengths = tf.reduce_sum(tf.cast(input_mask, tf.int32), 1)
+
+            # [N, T_in, encoder_dim]
+            char_embedded_inputs, speaker_embed, prenet_outputs, encoder_outputs, \
+                    speaker_projections = self._initialize_encoder(
+                            inputs, token_lengths, num_speakers, speaker_id,
+                            is_training, fold_batch_norm, [
+                                    ('decoder_before_highway', encoder_dim),
+                                    ('decoder_rnn_init_state', hp.dec_rnn_size * 2)])
+
+            decoder_before_highway = speaker_projections.get('decoder_before_highway')
+            decoder_rnn_init_state = speaker_projections.get('decoder_rnn_init_state')
+
+            ##############
+            # Durations
+            ##############
+
+            with tf.variable_scope('duration_predictor'):
+                x = encoder_outputs
+                for idx in range(2):
+                    x = conv1d(
+                            x, hp.duration_predictor_width,
+                            hp.duration_predictor_channels, tf.nn.relu,
+                            is_training, 'conv1d_{}'.format(idx + 1), fold_batch_norm)
+
+                # [N, T_in], log(1 + number of frames)
+                log_durations = tf.squeeze(tf.layers.dense(x, 1), [-1])
+
+            if durations is None:
+                durations = tf.cast(
+                        tf.round(tf.maximum(tf.exp(log_durations) - 1, 0)), tf.int32)
+            durations = durations * tf.cast(input_mask, tf.int32)
+
+            if mel_targets is not None:
+                max_frames = tf.shape(mel_targets)[1]
+            else:
+                max_frames = tf.reduce_max(tf.reduce_sum(durations, 1))
+
+            # [N, T_out, encoder_dim]
+            expanded_outputs, frame_tokens, output_lengths = \
+                    expand_by_durations(encoder_outputs, durations, max_frames)
+            frame_mask = tf.sequence_mask(
+                    output_lengths, max_frames, dtype=tf.float32)
+
+            ##############
+            # Decoder
+            ##############
+
+            decoder_outputs = cbhg(
+                    expanded_outputs, output_lengths, is_training,
+                    hp.post_bank_size, hp.post_bank_channel_size,
+                    hp.post_maxpool_width, hp.post_highway_depth, hp.dec_rnn_size,
+                    [hp.post_proj_sizes[0], encoder_dim], hp.post_proj_width,
+                    scope='decoder_cbhg',
+                    before_highway=decoder_before_highway,
+                    encoder_rnn_init_state=decoder_rnn_init_state,
+                    fold_batch_norm=fold_batch_norm,
+                    fused_conv_bank=hp.fused_conv_bank,
+                    rnn_cell_type=hp.rnn_cell_type)
+
+            # [N, T_out, M]
+            mel_outputs = tf.layers.dense(decoder_outputs, hp.num_mels) * \
+                    tf.expand_dims(frame_mask, 2)
+
+            # [N, T_out, 256]
+            post_cbhg = lambda x, lengths: cbhg(
+                    x, lengths, is_training,
+                    hp.post_bank_size, hp.post_bank_channel_size,
+                    hp.post_maxpool_width, hp.post_highway_depth, hp.post_rnn_size,
+                    hp.post_proj_sizes, hp.post_proj_width,
+                    scope='post_cbhg',
+                    fold_batch_norm=fold_batch_norm,
+                    fused_conv_bank=hp.fused_conv_bank,
+                    rnn_cell_type=hp.rnn_cell_type)
+
+            if is_training and hp.recompute_post_cbhg:
+                post_outputs = recompute_grad(post_cbhg, mel_outputs, output_lengths)
+            else:
+                post_outputs = post_cbhg(mel_outputs, output_lengths)
+
+            if speaker_embed is not None and hp.model_type == 'simple':
+                expanded_speaker_emb = tf.expand_dims(speaker_embed, [1])
+                tiled_speaker_embedding = tf.tile(
+                        expanded_speaker_emb, [1, tf.shape(post_outputs)[1], 1])
+
+                # [N, T_out, 256 + alpha]
+                post_outputs = \
+                        tf.concat([tiled_speaker_embedding, post_outputs], axis=-1)
+
+            linear_outputs = tf.layers.dense(post_outputs, hp.num_freq)    # [N, T_out, F]
+
+            # One-hot alignments at the resolution of the attention decoder
+            # steps: [N, T_in, T_out / r]
+            alignments = tf.one_hot(frame_tokens, tf.shape(inputs)[1]) * \
+                    tf.expand_dims(frame_mask, 2)
+            alignments = tf.transpose(
+                    alignments[:, ::hp.reduction_factor], [0, 2, 1])
+
+            # No attention to control manually
+            self.is_manual_attention = None
+            self.manual_alignments = None
+
+            self.inputs = inputs
+            self.speaker_id = speaker_id
+            self.input_lengths = input_lengths
+            self.input_mask = input_mask
+            self.loss_coeff = loss_coeff
+            self.durations = durations
+            self.log_durations = log_durations
+            self.mel_outputs = mel_outputs
+            self.linear_outputs = linear_outputs
+            self.alignments = alignments
+            self.output_lengths = output_lengths
+            self.encoder_outputs = encoder_outputs
+            self.mel_targets = mel_targets
+            self.linear_targets = linear_targets
+
+            log('='*40)
+            log(' model_type: %s (duration decoder)' % hp.model_type)
+            log('='*40)
+
+            log('Initialized DurationTacotron model. Dimensions: ')
+            log('    embedding:               %d' % char_embedded_inputs.shape[-1])
+            log('    prenet out:              %d' % prenet_outputs.shape[-1])
+            log('    encoder out:             %d' % encoder_outputs.shape[-1])
+            log('    decoder out:             %d' % decoder_outputs.shape[-1])
+            log('    mel out:                 %d' % mel_outputs.shape[-1])
+            log('    postnet out:             %d' % post_outputs.shape[-1])
+            log('    linear out:              %d' % linear_outputs.shape[-1])
+
+    def add_loss(self):
+        '''Adds the duration loss to the losses of Tacotron. Sets "duration_loss" field.'''
+        super(DurationTacotron, self).add_loss()
+
+        with tf.variable_scope('duration_loss') as scope:
+            targets = tf.log(1. + tf.cast(self.durations, tf.float32))
+            self.duration_loss = \
+                    tf.reduce_sum(tf.square(targets - self.log_durations) * self.input_mask) / \
+                    tf.reduce_sum(self.input_mask)
+
+            self.loss += self.duration_loss
@@ -7,10 +7,12 @@ from tensorflow.contrib.seq2seq import Helper
 
 # Adapted from tf.contrib.seq2seq.GreedyEmbeddingHelper
 class TacoTestHelper(Helper):
-  def __init__(self, batch_size, output_dim, r):
+  def __init__(self, batch_size, output_dim, r, input_lengths=None, stop_threshold=0.0):
     with tf.name_scope('TacoTestHelper'):
       self._batch_size = batch_size
       self._output_dim = output_dim
+      self._input_lengths = input_lengths
+      self._stop_threshold = stop_threshold
       self._end_token = tf.tile([0.0], [output_dim * r])
 
   @property
@@ -26,7 +28,11 @@ class TacoTestHelper(Helper):
   def next_inputs(self, time, outputs, state, sample_ids, name=None):
     '''Stop on EOS. Otherwise, pass the last output as the next input and pass through state.'''
     with tf.name_scope('TacoTestHelper'):
-      finished = tf.reduce_all(tf.equal(outputs, self._end_token), axis=1)
+      if self._stop_threshold > 0 and self._input_lengths is not None:
+        finished = is_finished(
+            outputs, state[0].alignments, self._input_lengths, self._stop_threshold)
+      else:
+        finished = tf.reduce_all(tf.equal(outputs, self._end_token), axis=1)
       # Feed last output frame as next input. outputs is [N, output_dim * r]
       next_inputs = outputs[:, -self._output_dim:]
       return (finished, next_inputs, state)
@@ -67,6 +73,15 @@ class TacoTrainingHelper(Helper):
       return (finished, next_inputs, state)
 
 
+def is_finished(outputs, alignments, input_lengths, stop_threshold):
+  '''Returns [N] bool: the attention peak reached the last input token and
+  every value of the r output frames is below stop_threshold (silence).'''
+  attention_peak = tf.cast(tf.argmax(alignments, axis=1), tf.int32)
+  attention_done = tf.greater_equal(attention_peak, input_lengths - 1)
+  is_silent = tf.reduce_all(tf.less(outputs, stop_threshold), axis=1)
+  return tf.logical_and(attention_done, is_silent)
+
+
 def _go_frames(batch_size, output_dim):
   '''Returns all-zero <GO> frames for a given batch size and output dimension'''
   return tf.tile([[0.0]], [batch_size, output_dim])
@@ -1,7 +1,7 @@
 # Code based on https://github.com/keithito/tacotron/blob/master/models/tacotron.py
 
 import tensorflow as tf
-from tensorflow.contrib.rnn import GRUCell
+from tensorflow.contrib.rnn import GRUCell, GRUBlockCell
 from tensorflow.python.layers import core
 from tensorflow.contrib.seq2seq.python.ops.attention_wrapper \
         import _bahdanau_score, _BaseAttentionMechanism, BahdanauAttention, \
@@ -15,6 +15,56 @@ def get_embed(inputs, num_inputs, embed_size, name):
     return tf.nn.embedding_lookup(embed_table, inputs)
 
 
+def get_rnn_cell(cell_type, num_units):
+    if cell_type == 'gru':
+        return GRUCell(num_units)
+    elif cell_type == 'gru_block':
+        # Fused kernel, same math and initialization as GRUCell
+        return GRUBlockCell(num_units)
+    else:
+        raise Exception(" [!] Unkown rnn_cell_type: {}".format(cell_type))
+
+
+def freeze_rows(gradient, num_rows):
+    '''Zeroes the gradient (IndexedSlices) of the first `num_rows` rows of an embedding table.'''
+    mask = tf.cast(gradient.indices >= num_rows, gradient.values.dtype)
+    return tf.IndexedSlices(
+            gradient.values * tf.expand_dims(mask, 1),
+            gradient.indices, gradient.dense_shape)
+
+
+def recompute_grad(fn, *inputs):
+    '''Calls `fn(*inputs)` without keeping its activations for backprop:
+    they are recomputed from `inputs` in the backward pass.
+
+    `fn` must create its variables with tf.get_variable (as tf.layers does)
+    and must be deterministic (no dropout). `None` inputs are passed as is.
+    '''
+    tensor_index = [idx for idx, x in enumerate(inputs) if x is not None]
+    num_calls = [0]
+
+    def fn_of_tensors(*tensors):
+        args = list(inputs)
+        for idx, tensor in zip(tensor_index, tensors):
+            args[idx] = tensor
+
+        update_ops = tf.get_collection_ref(tf.GraphKeys.UPDATE_OPS)
+        num_update_ops = len(update_ops)
+
+        outputs = fn(*args)
+        if num_calls[0] > 0:
+            # Batch norm statistics are only updated by the forward pass
+            del update_ops[num_update_ops:]
+        num_calls[0] += 1
+        return outputs
+
+    # recompute_grad tracks the variables of `fn` as resource variables.
+    # Names do not change, so checkpoints are compatible either way.
+    with tf.variable_scope(tf.get_variable_scope(), use_resource=True):
+        return tf.contrib.layers.recompute_grad(fn_of_tensors)(
+                *[inputs[idx] for idx in tensor_index])
+
+
 def prenet(inputs, is_training, layer_sizes, drop_prob, scope=None):
     x = inputs
     drop_rate = drop_prob if is_training else 0.0
@@ -28,20 +78,27 @@ def cbhg(inputs, input_lengths, is_training,
         bank_size, bank_channel_size,
         maxpool_width, highway_depth, rnn_size,
         proj_sizes, proj_width, scope,
-        before_highway=None, encoder_rnn_init_state=None):
+        before_highway=None, encoder_rnn_init_state=None,
+        fold_batch_norm=False, fused_conv_bank=False, rnn_cell_type='gru'):
 
     batch_size = tf.shape(inputs)[0]
     with tf.variable_scope(scope):
         with tf.variable_scope('conv_bank'):
-            # Convolution bank: concatenate on the last axis
-            # to stack channels from all convolutions
-            conv_fn = lambda k: \
-                    conv1d(inputs, k, bank_channel_size, 
-                            tf.nn.relu, is_training, 'conv1d_%d' % k)
+            if fused_conv_bank:
+                conv_outputs = fused_conv1d_bank(
+                        inputs, bank_size, bank_channel_size,
+                        is_training, fold_batch_norm)
+            else:
+                # Convolution bank: concatenate on the last axis
+                # to stack channels from all convolutions
+                conv_fn = lambda k: \
+                        conv1d(inputs, k, bank_channel_size, 
+                                tf.nn.relu, is_training, 'conv1d_%d' % k,
+                                fold_batch_norm)
 
-            conv_outputs = tf.concat(
-                [conv_fn(k) for k in range(1, bank_size+1)], axis=-1,
-            )
+                conv_outputs = tf.concat(
+                    [conv_fn(k) for k in range(1, bank_size+1)], axis=-1,
+                )
 
         # Maxpooling:
         maxpool_output = tf.layers.max_pooling1d(
@@ -56,7 +113,7 @@ def cbhg(inputs, input_lengths, is_training,
             activation_fn = None if idx == len(proj_sizes) - 1 else tf.nn.relu
             proj_out = conv1d(
                     proj_out, proj_width, proj_size, activation_fn,
-                    is_training, 'proj_{}'.format(idx + 1))
+                    is_training, 'proj_{}'.format(idx + 1), fold_batch_norm)
 
         # Residual connection:
         if before_highway is not None:
@@ -85,7 +142,8 @@ def cbhg(inputs, input_lengths, is_training,
         else:
             initial_state_fw, initial_state_bw = None, None
 
-        cell_fw, cell_bw = GRUCell(rnn_size), GRUCell(rnn_size)
+        cell_fw = get_rnn_cell(rnn_cell_type, rnn_size)
+        cell_bw = get_rnn_cell(rnn_cell_type, rnn_size)
         outputs, states = tf.nn.bidirectional_dynamic_rnn(
                 cell_fw, cell_bw,
                 rnn_input,
@@ -120,7 +178,8 @@ def highwaynet(inputs, scope):
         return H * T + inputs * (1.0 - T)
 
 
-def conv1d(inputs, kernel_size, channels, activation, is_training, scope):
+def conv1d(inputs, kernel_size, channels, activation, is_training, scope,
+        fold_batch_norm=False):
     with tf.variable_scope(scope):
         conv1d_output = tf.layers.conv1d(
             inputs,
@@ -128,4 +187,97 @@ def conv1d(inputs, kernel_size, channels, activation, is_training, scope):
             kernel_size=kernel_size,
             activation=activation,
             padding='same')
-        return tf.layers.batch_normalization(conv1d_output, training=is_training)
+
+        if not fold_batch_norm:
+            return tf.layers.batch_normalization(conv1d_output, training=is_training)
+        elif activation is None:
+            # Batch norm statistics are folded into the conv kernel and bias
+            return conv1d_output
+        else:
+            # Batch norm comes after the activation, so it can only be
+            # reduced to a per-channel scale and shift
+            return folded_batch_norm(conv1d_output)
+
+
+def folded_batch_norm(inputs, scope='folded_batch_normalization'):
+    channels = int(inputs.get_shape()[-1])
+
+    with tf.variable_scope(scope):
+        scale = tf.get_variable(
+                'scale', [channels], initializer=tf.ones_initializer())
+        shift = tf.get_variable(
+                'shift', [channels], initializer=tf.zeros_initializer())
+        return inputs * scale + shift
+
+
+def fused_conv1d_bank(inputs, bank_size, channels, is_training,
+        fold_batch_norm=False, batch_norm_momentum=0.99, batch_norm_epsilon=1e-3):
+    '''Same outputs and variables as concatenating conv1d(inputs, k, ...) for
+    k in 1..bank_size, computed with a single convolution whose kernel stacks
+    the zero-padded kernels of every width along the output channels.'''
+    in_channels = int(inputs.get_shape()[-1])
+
+    kernels, biases = [], []
+    gammas, betas, moving_means, moving_variances = [], [], [], []
+    scales, shifts = [], []
+
+    for k in range(1, bank_size+1):
+        with tf.variable_scope('conv1d_%d' % k):
+            with tf.variable_scope('conv1d'):
+                kernel = tf.get_variable(
+                        'kernel', [k, in_channels, channels], dtype=tf.float32)
+                bias = tf.get_variable(
+                        'bias', [channels], initializer=tf.zeros_initializer())
+
+            # Align with 'same' padding: width k looks (k-1)//2 steps back
+            left = (bank_size - 1) // 2 - (k - 1) // 2
+            kernels.append(tf.pad(
+                    kernel, [[left, bank_size - k - left], [0, 0], [0, 0]]))
+            biases.append(bias)
+
+            if fold_batch_norm:
+                with tf.variable_scope('folded_batch_normalization'):
+                    scales.append(tf.get_variable(
+                            'scale', [channels], initializer=tf.ones_initializer()))
+                    shifts.append(tf.get_variable(
+                            'shift', [channels], initializer=tf.zeros_initializer()))
+            else:
+                with tf.variable_scope('batch_normalization'):
+                    gammas.append(tf.get_variable(
+                            'gamma', [channels], initializer=tf.ones_initializer()))
+                    betas.append(tf.get_variable(
+                            'beta', [channels], initializer=tf.zeros_initializer()))
+                    moving_means.append(tf.get_variable(
+                            'moving_mean', [channels],
+                            initializer=tf.zeros_initializer(), trainable=False))
+                    moving_variances.append(tf.get_variable(
+                            'moving_variance', [channels],
+                            initializer=tf.ones_initializer(), trainable=False))
+
+    # [N, T, bank_size * channels]
+    outputs = tf.nn.conv1d(
+            inputs, tf.concat(kernels, axis=-1), stride=1, padding='SAME')
+    outputs = tf.nn.relu(tf.nn.bias_add(outputs, tf.concat(biases, axis=-1)))
+
+    if fold_batch_norm:
+        return outputs * tf.concat(scales, axis=-1) + tf.concat(shifts, axis=-1)
+
+    if is_training:
+        mean, variance = tf.nn.moments(outputs, [0, 1])
+
+        for idx, (moving_mean, moving_variance) in \
+                enumerate(zip(moving_means, moving_variances)):
+            sliced = slice(idx * channels, (idx + 1) * channels)
+            for moving, value in [(moving_mean, mean[sliced]),
+                                  (moving_variance, variance[sliced])]:
+                tf.add_to_collection(
+                        tf.GraphKeys.UPDATE_OPS,
+                        tf.assign_sub(moving, (moving - value) * (1 - batch_norm_momentum)))
+    else:
+        mean = tf.concat(moving_means, axis=-1)
+        variance = tf.concat(moving_variances, axis=-1)
+
+    return tf.nn.batch_normalization(
+            outputs, mean, variance,
+            tf.concat(betas, axis=-1), tf.concat(gammas, axis=-1),
+            batch_norm_epsilon)
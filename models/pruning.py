@@ -0,0 +1,99 @@
+import tensorflow as tf
+
+
+def get_prunable_weights(scope='model'):
+    # Dense, highway, attention and GRU (GRUCell or GRUBlockCell) kernels:
+    # [input_dim, output_dim]
+    return [var for var in tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope) \
+            if var.op.name.endswith(('kernel', 'w_ru', 'w_c')) and var.get_shape().ndims == 2]
+
+
+def get_target_sparsity(global_step, hp):
+    # Cubic schedule of "To prune, or not to prune" (Zhu & Gupta, 2017)
+    step = tf.cast(global_step, tf.float32)
+    num_steps = float(max(hp.prune_end_step - hp.prune_begin_step, 1))
+
+    progress = tf.clip_by_value((step - hp.prune_begin_step) / num_steps, 0., 1.)
+    return hp.prune_target_sparsity * (1. - (1. - progress) ** 3)
+
+
+def get_row_mask(weight, sparsity, block_size):
+    '''Mask of the rows of `weight` that keeps the row blocks with the largest L2 norm.
+
+    Args:
+        weight: [input_dim, output_dim]
+        sparsity: float32 scalar, fraction of the row blocks to zero out
+        block_size: number of consecutive rows pruned together
+    Returns:
+        [input_dim] float32 mask
+    '''
+    num_rows = int(weight.get_shape()[0])
+    num_blocks = (num_rows + block_size - 1) // block_size
+
+    padded = tf.pad(weight, [[0, num_blocks * block_size - num_rows], [0, 0]])
+    norms = tf.norm(tf.reshape(padded, [num_blocks, -1]), axis=1)
+
+    num_kept = num_blocks - tf.cast(tf.floor(sparsity * num_blocks), tf.int32)
+    _, order = tf.nn.top_k(norms, k=num_blocks)
+
+    block_mask = tf.scatter_nd(
+            tf.expand_dims(order, 1),
+            tf.cast(tf.range(num_blocks) < num_kept, tf.float32),
+            [num_blocks])
+
+    row_mask = tf.reshape(
+            tf.tile(tf.expand_dims(block_mask, 1), [1, block_size]), [-1])
+    return row_mask[:num_rows]
+
+
+def add_pruning(train_op, global_step, hp, scope='model'):
+    '''Prunes the kernels of `scope` after every step of `train_op`.
+
+    Every `prune_frequency` steps between `prune_begin_step` and
+    `prune_end_step`, the masks are recomputed for the current target
+    sparsity. Pruned rows are zeroed again after every update, so they stay
+    zero and the masks only grow.
+
+    Returns:
+        train_op: `train_op` followed by the pruning
+        sparsity: fraction of the pruned kernel weights
+    '''
+    weights = get_prunable_weights(scope)
+
+    with tf.variable_scope('pruning'):
+        masks = [tf.get_variable(
+                weight.op.name + '/mask', initializer=tf.ones(weight.get_shape()[:1]),
+                trainable=False) for weight in weights]
+
+    with tf.control_dependencies([train_op]):
+        step = tf.identity(global_step)
+        updated_weights = [tf.identity(weight) for weight in weights]
+
+    target_sparsity = get_target_sparsity(step, hp)
+    is_mask_update_step = tf.logical_and(
+            tf.logical_and(
+                    step >= hp.prune_begin_step,
+                    step <= hp.prune_end_step),
+            tf.equal(step % hp.prune_frequency, 0))
+
+    assign_ops = []
+    for weight, updated_weight, mask in zip(weights, updated_weights, masks):
+        new_mask = tf.cond(
+                is_mask_update_step,
+                lambda weight=updated_weight: get_row_mask(
+                        weight, target_sparsity, hp.prune_block_size),
+                lambda mask=mask: tf.identity(mask))
+
+        assign_mask = tf.assign(mask, new_mask)
+        assign_ops.append(assign_mask)
+        assign_ops.append(tf.assign(
+                weight, updated_weight * tf.expand_dims(assign_mask, 1)))
+
+    num_weights = [int(weight.get_shape()[1]) for weight in weights]
+    num_kept = tf.add_n([
+            tf.reduce_sum(mask) * num for mask, num in zip(masks, num_weights)])
+    num_total = sum(
+            int(weight.get_shape().num_elements()) for weight in weights)
+
+    sparsity = 1. - num_kept / num_total
+    return tf.group(*assign_ops), sparsity
@@ -5,7 +5,7 @@ from tensorflow.python.ops import rnn_cell_impl
 from tensorflow.contrib.data.python.util import nest
 from tensorflow.contrib.seq2seq.python.ops.attention_wrapper \
                 import _bahdanau_score, _BaseAttentionMechanism, BahdanauAttention, \
-                             AttentionWrapperState, AttentionMechanism
+                             BahdanauMonotonicAttention, AttentionWrapperState, AttentionMechanism
 
 from .modules import prenet
 
@@ -27,6 +27,8 @@ class AttentionWrapper(RNNCell):
                  cell_input_fn=None,
                  output_attention=True,
                  initial_cell_state=None,
+                 attention_window_size=0,
+                 memory_sequence_length=None,
                  name=None):
         """Construct the `AttentionWrapper`.
         Args:
@@ -57,6 +59,11 @@ class AttentionWrapper(RNNCell):
                 now, and the user uses a `batch_size` argument of `zero_state` which
                 does not match the batch size of `initial_cell_state`, proper
                 behavior is not guaranteed.
+            attention_window_size: If positive, only this many memory steps
+                around the peak of the previous alignments are scored and
+                attended to. Only for Bahdanau style attention mechanisms.
+            memory_sequence_length: The memory lengths the attention mechanisms
+                were built with, if any. Keeps windows within each item.
             name: Name to use when creating tf.
         Raises:
             TypeError: `attention_layer_size` is not None and (`attention_mechanism`
@@ -122,6 +129,8 @@ class AttentionWrapper(RNNCell):
         self._cell_input_fn = cell_input_fn
         self._output_attention = output_attention
         self._alignment_history = alignment_history
+        self._attention_window_size = attention_window_size
+        self._memory_sequence_length = memory_sequence_length
         with tf.name_scope(name, "AttentionWrapperInit"):
             if initial_cell_state is None:
                 self._initial_cell_state = None
@@ -279,7 +288,8 @@ class AttentionWrapper(RNNCell):
             attention, alignments = _compute_attention(
                     attention_mechanism, cell_output, previous_alignments[i],
                     self._attention_layers[i] if self._attention_layers else None,
-                    self.is_manual_attention, self.manual_alignments, state.time)
+                    self.is_manual_attention, self.manual_alignments, state.time,
+                    self._attention_window_size, self._memory_sequence_length)
 
             alignment_history = previous_alignment_history[i].write(
                     state.time, alignments) if self._alignment_history else ()
@@ -303,36 +313,56 @@ class AttentionWrapper(RNNCell):
 
 def _compute_attention(
         attention_mechanism, cell_output, previous_alignments,
-        attention_layer, is_manual_attention, manual_alignments, time):
+        attention_layer, is_manual_attention, manual_alignments, time,
+        attention_window_size=0, memory_sequence_length=None):
+
+    if attention_window_size > 0:
+        computed_alignments, context = _compute_windowed_attention(
+                attention_mechanism, cell_output,
+                previous_alignments, attention_window_size, memory_sequence_length)
+    else:
+        computed_alignments = attention_mechanism(
+                cell_output, previous_alignments=previous_alignments)
+        context = None
 
-    computed_alignments = attention_mechanism(
-            cell_output, previous_alignments=previous_alignments)
     batch_size, max_time = \
             tf.shape(computed_alignments)[0], tf.shape(computed_alignments)[1]
 
-    alignments = tf.cond(
-            is_manual_attention,
-            lambda: manual_alignments[:, time, :],
-            lambda: computed_alignments,
-    )
+    def compute_context(alignments):
+        # Reshape from [batch_size, memory_time] to [batch_size, 1, memory_time]
+        expanded_alignments = tf.expand_dims(alignments, 1)
+
+        # Context is the inner product of alignments and values along the
+        # memory time dimension.
+        # alignments shape is
+        #         [batch_size, 1, memory_time]
+        # attention_mechanism.values shape is
+        #         [batch_size, memory_time, memory_size]
+        # the batched matmul is over memory_time, so the output shape is
+        #         [batch_size, 1, memory_size].
+        # we then squeeze out the singleton dim.
+        context = tf.matmul(expanded_alignments, attention_mechanism.values)
+        return tf.squeeze(context, [1])
+
+    def computed():
+        # Without a window, the full context is only built in this branch
+        if context is not None:
+            return computed_alignments, context
+        return computed_alignments, compute_context(computed_alignments)
+
+    def manual():
+        # Manual alignments are not restricted to the window, so only
+        # this branch attends to the whole memory
+        alignments = manual_alignments[:, time, :]
+        return alignments, compute_context(alignments)
+
+    if is_manual_attention is None:
+        alignments, context = computed()
+    else:
+        alignments, context = tf.cond(is_manual_attention, manual, computed)
 
     #alignments = tf.one_hot(tf.zeros((batch_size,), dtype=tf.int32), max_time, dtype=tf.float32)
 
-    # Reshape from [batch_size, memory_time] to [batch_size, 1, memory_time]
-    expanded_alignments = tf.expand_dims(alignments, 1)
-
-    # Context is the inner product of alignments and values along the
-    # memory time dimension.
-    # alignments shape is
-    #         [batch_size, 1, memory_time]
-    # attention_mechanism.values shape is
-    #         [batch_size, memory_time, memory_size]
-    # the batched matmul is over memory_time, so the output shape is
-    #         [batch_size, 1, memory_size].
-    # we then squeeze out the singleton dim.
-    context = tf.matmul(expanded_alignments, attention_mechanism.values)
-    context = tf.squeeze(context, [1])
-
     if attention_layer is not None:
         attention = attention_layer(tf.concat([cell_output, context], 1))
     else:
@@ -341,6 +371,74 @@ def _compute_attention(
     return attention, alignments
 
 
+def _compute_windowed_attention(
+        attention_mechanism, cell_output, previous_alignments, window_size,
+        memory_sequence_length=None):
+    '''Same as calling a Bahdanau style `attention_mechanism` and taking the
+    context, but only for the `window_size` memory steps centered on the peak
+    of `previous_alignments`. Alignments outside of the window are zero.
+
+    Uses the same variables as `attention_mechanism.__call__`, so models
+    trained with full attention can be run with a window.
+
+    With `memory_sequence_length`, windows end within each item, so the window
+    positions the mechanism masks are exactly the padded memory steps.
+    '''
+    if isinstance(attention_mechanism, BahdanauMonotonicAttention):
+        default_scope = "bahdanau_monotonic_attention"
+    elif isinstance(attention_mechanism, BahdanauAttention):
+        default_scope = "bahdanau_attention"
+    else:
+        raise Exception(" [!] Windowed attention is not supported for {}". \
+                format(type(attention_mechanism).__name__))
+
+    keys, values = attention_mechanism.keys, attention_mechanism.values
+    batch_size, max_time = tf.shape(keys)[0], tf.shape(keys)[1]
+    window_size = tf.minimum(window_size, max_time)
+
+    if memory_sequence_length is None:
+        max_start = max_time - window_size
+    else:
+        max_start = tf.maximum(memory_sequence_length - window_size, 0)
+
+    peak = tf.cast(tf.argmax(previous_alignments, axis=1), tf.int32)
+    start = tf.maximum(tf.minimum(peak - window_size // 2, max_start), 0)
+
+    # [batch_size, window_size, 2] of (batch index, memory index)
+    window_indices = tf.expand_dims(start, 1) + \
+            tf.expand_dims(tf.range(window_size), 0)
+    batch_indices = tf.tile(
+            tf.expand_dims(tf.range(batch_size), 1), [1, window_size])
+    indices = tf.stack([batch_indices, window_indices], axis=2)
+
+    window_keys = tf.gather_nd(keys, indices)
+    window_values = tf.gather_nd(values, indices)
+    window_previous_alignments = tf.gather_nd(previous_alignments, indices)
+
+    with tf.variable_scope(None, default_scope, [cell_output]):
+        processed_query = attention_mechanism.query_layer(cell_output) \
+                if attention_mechanism.query_layer else cell_output
+        score = _bahdanau_score(
+                processed_query, window_keys, attention_mechanism._normalize)
+
+        if isinstance(attention_mechanism, BahdanauMonotonicAttention):
+            score_bias = tf.get_variable(
+                    "attention_score_bias", dtype=processed_query.dtype,
+                    initializer=attention_mechanism._score_bias_init)
+            score += score_bias
+
+    # [batch_size, window_size]
+    window_alignments = attention_mechanism._probability_fn(
+            score, window_previous_alignments)
+
+    alignments = tf.scatter_nd(
+            indices, window_alignments, [batch_size, max_time])
+    context = tf.squeeze(tf.matmul(
+            tf.expand_dims(window_alignments, 1), window_values), [1])
+
+    return alignments, context
+
+
 class DecoderPrenetWrapper(RNNCell):
     '''Runs RNN inputs through a prenet before sending them to the cell.'''
     def __init__(
@@ -3,13 +3,14 @@
 import numpy as np
 import tensorflow as tf
 from tensorflow.contrib.seq2seq import BasicDecoder, BahdanauAttention, BahdanauMonotonicAttention
-from tensorflow.contrib.rnn import GRUCell, MultiRNNCell, OutputProjectionWrapper, ResidualWrapper
+from tensorflow.contrib.rnn import MultiRNNCell, OutputProjectionWrapper, ResidualWrapper
+from tensorflow.contrib.data.python.util import nest
 
 from utils.infolog import log
 from text.symbols import symbols, en_symbols, en_symbols_arpabet
 
 from .modules import *
-from .helpers import TacoTestHelper, TacoTrainingHelper
+from .helpers import TacoTestHelper, TacoTrainingHelper, is_finished
 from .rnn_wrappers import AttentionWrapper, DecoderPrenetWrapper, ConcatOutputAndAttentionWrapper
 
 
@@ -22,143 +23,91 @@ class Tacotron():
 			self, inputs, input_lengths, num_speakers, speaker_id,
 			mel_targets=None, linear_targets=None, loss_coeff=None,
 			rnn_decoder_test_mode=False, is_randomly_initialized=False,
+			manual_attention=True, fold_batch_norm=False, streaming=False,
+			is_training=None,
 		):
-		is_training = linear_targets is not None
+		# A teacher of distillation runs with targets but without dropout
+		if is_training is None:
+			is_training = linear_targets is not None
 		self.is_randomly_initialized = is_randomly_initialized
 
+		if is_training and (fold_batch_norm or streaming):
+			raise Exception(" [!] fold_batch_norm and streaming are only for inference graphs")
+
 		with tf.variable_scope('inference') as scope:
 			hp = self._hparams
 			batch_size = tf.shape(inputs)[0]
 
-			# Embeddings
-			# 1. check whether english/korean
-			if ('english_cleaners' in hp.cleaners): 
-				if hp.use_cmudict:
-					char_embed_table = tf.get_variable(
-						'embedding', [len(en_symbols_arpabet), hp.embedding_size], dtype=tf.float32,
-						initializer=tf.truncated_normal_initializer(stddev=0.5))
-				else:
-					char_embed_table = tf.get_variable(
-						'embedding', [len(en_symbols), hp.embedding_size], dtype=tf.float32,
-						initializer=tf.truncated_normal_initializer(stddev=0.5))
-			else:
-				char_embed_table = tf.get_variable(
-					'embedding', [len(symbols), hp.embedding_size], dtype=tf.float32,
-					initializer=tf.truncated_normal_initializer(stddev=0.5))
-			# [N, T_in, embedding_size]
-			char_embedded_inputs = \
-					tf.nn.embedding_lookup(char_embed_table, inputs)
-
-			self.num_speakers = num_speakers
-			if self.num_speakers > 1:
-				if hp.speaker_embedding_size != 1:
-					speaker_embed_table = tf.get_variable(
-							'speaker_embedding',
-							[self.num_speakers, hp.speaker_embedding_size], dtype=tf.float32,
-							initializer=tf.truncated_normal_initializer(stddev=0.5))
-					# [N, T_in, speaker_embedding_size]
-					speaker_embed = tf.nn.embedding_lookup(speaker_embed_table, speaker_id)
-
-				if hp.model_type == 'deepvoice':
-					if hp.speaker_embedding_size == 1:
-						before_highway = get_embed(
-								speaker_id, self.num_speakers, 
-								hp.enc_prenet_sizes[-1], "before_highway")
-						encoder_rnn_init_state = get_embed(
-								speaker_id, self.num_speakers, 
-								hp.enc_rnn_size * 2, "encoder_rnn_init_state")
-
-						attention_rnn_init_state = get_embed(
-								speaker_id, self.num_speakers, 
-								hp.attention_state_size, "attention_rnn_init_state")
-						decoder_rnn_init_states = [get_embed(
-								speaker_id, self.num_speakers, 
-								hp.dec_rnn_size, "decoder_rnn_init_states{}".format(idx + 1)) \
-										for idx in range(hp.dec_layer_num)]
-					else:
-						deep_dense = lambda x, dim: \
-								tf.layers.dense(x, dim, activation=tf.nn.softsign)
-
-						before_highway = deep_dense(
-								speaker_embed, hp.enc_prenet_sizes[-1])
-						encoder_rnn_init_state = deep_dense(
-								speaker_embed, hp.enc_rnn_size * 2)
-
-						attention_rnn_init_state = deep_dense(
-								speaker_embed, hp.attention_state_size)
-						decoder_rnn_init_states = [deep_dense(
-								speaker_embed, hp.dec_rnn_size) for _ in range(hp.dec_layer_num)]
-
-					speaker_embed = None # deepvoice does not use speaker_embed directly
-				elif hp.model_type == 'simple':
-					before_highway = None
-					encoder_rnn_init_state = None
-					attention_rnn_init_state = None
-					decoder_rnn_init_states = None
-				else:
-					raise Exception(" [!] Unkown multi-speaker model type: {}".format(hp.model_type))
+			decoder_speaker_projections = [
+					('attention_rnn_init_state', hp.attention_state_size)] + [
+					("decoder_rnn_init_states{}".format(idx + 1), hp.dec_rnn_size) \
+							for idx in range(hp.dec_layer_num)]
+
+			char_embedded_inputs, speaker_embed, prenet_outputs, encoder_outputs, \
+					speaker_projections = self._initialize_encoder(
+							inputs, input_lengths, num_speakers, speaker_id,
+							is_training, fold_batch_norm, decoder_speaker_projections)
+
+			if speaker_projections:
+				attention_rnn_init_state = speaker_projections['attention_rnn_init_state']
+				decoder_rnn_init_states = [speaker_projections[name] \
+						for name, _ in decoder_speaker_projections[1:]]
 			else:
-				speaker_embed = None
-				before_highway = None
-				encoder_rnn_init_state = None
 				attention_rnn_init_state = None
 				decoder_rnn_init_states = None
 
-			##############
-			# Encoder
-			##############
-
-			# [N, T_in, enc_prenet_sizes[-1]]
-			prenet_outputs = prenet(char_embedded_inputs, is_training,
-					hp.enc_prenet_sizes, hp.dropout_prob,
-					scope='prenet')
-
-			encoder_outputs = cbhg(
-					prenet_outputs, input_lengths, is_training,
-					hp.enc_bank_size, hp.enc_bank_channel_size,
-					hp.enc_maxpool_width, hp.enc_highway_depth, hp.enc_rnn_size,
-					hp.enc_proj_sizes, hp.enc_proj_width,
-					scope="encoder_cbhg",
-					before_highway=before_highway,
-					encoder_rnn_init_state=encoder_rnn_init_state)
-
 
 			##############
 			# Attention
 			##############
 
 			# For manaul control of attention
-			self.is_manual_attention = tf.placeholder(
-					tf.bool, shape=(), name='is_manual_attention',
-			)
-			self.manual_alignments = tf.placeholder(
-					tf.float32, shape=[None, None, None], name="manual_alignments",
-			)
+			if manual_attention:
+				self.is_manual_attention = tf.placeholder(
+						tf.bool, shape=(), name='is_manual_attention',
+				)
+				self.manual_alignments = tf.placeholder(
+						tf.float32, shape=[None, None, None], name="manual_alignments",
+				)
+			else:
+				self.is_manual_attention = None
+				self.manual_alignments = None
 
 			dec_prenet_outputs = DecoderPrenetWrapper(
-					GRUCell(hp.attention_state_size),
+					get_rnn_cell(hp.rnn_cell_type, hp.attention_state_size),
 					speaker_embed,
 					is_training, hp.dec_prenet_sizes, hp.dropout_prob)
 
+			# Batches of the decoder scheduler are padded, so streaming only
+			# attends to the inputs of each item. Inference input_lengths are
+			# the position of EOS (see Synthesizer), hence the + 1.
+			memory_sequence_length = input_lengths + 1 if streaming else None
+
 			if hp.attention_type == 'bah_mon':
 				attention_mechanism = BahdanauMonotonicAttention(
-						hp.attention_size, encoder_outputs)
+						hp.attention_size, encoder_outputs,
+						memory_sequence_length=memory_sequence_length)
 			elif hp.attention_type == 'bah_norm':
 				attention_mechanism = BahdanauAttention(
-						hp.attention_size, encoder_outputs, normalize=True)
+						hp.attention_size, encoder_outputs, normalize=True,
+						memory_sequence_length=memory_sequence_length)
 			elif hp.attention_type == 'luong_scaled':
 				attention_mechanism = LuongAttention(
-						hp.attention_size, encoder_outputs, scale=True)
+						hp.attention_size, encoder_outputs, scale=True,
+						memory_sequence_length=memory_sequence_length)
 			elif hp.attention_type == 'luong':
 				attention_mechanism = LuongAttention(
-						hp.attention_size, encoder_outputs)
+						hp.attention_size, encoder_outputs,
+						memory_sequence_length=memory_sequence_length)
 			elif hp.attention_type == 'bah':
 				attention_mechanism = BahdanauAttention(
-						hp.attention_size, encoder_outputs)
+						hp.attention_size, encoder_outputs,
+						memory_sequence_length=memory_sequence_length)
 			elif hp.attention_type.startswith('ntm2'):
 				shift_width = int(hp.attention_type.split('-')[-1])
 				attention_mechanism = NTMAttention2(
-						hp.attention_size, encoder_outputs, shift_width=shift_width)
+						hp.attention_size, encoder_outputs, shift_width=shift_width,
+						memory_sequence_length=memory_sequence_length)
 			else:
 				raise Exception(" [!] Unkown attention type: {}".format(hp.attention_type))
 
@@ -168,8 +117,12 @@ class Tacotron():
 					self.is_manual_attention,
 					self.manual_alignments,
 					initial_cell_state=attention_rnn_init_state,
-					alignment_history=True,
-					output_attention=False
+					memory_sequence_length=memory_sequence_length,
+					# Streaming states are fed back in, so no TensorArray
+					alignment_history=not streaming,
+					output_attention=False,
+					# Training always attends to the whole input
+					attention_window_size=0 if is_training else hp.attention_window_size,
 			)
 
 			# Concatenate attention context vector and RNN cell output into a 512D vector.
@@ -180,7 +133,8 @@ class Tacotron():
 			# Decoder (layers specified bottom to top):
 			cells = [OutputProjectionWrapper(concat_cell, hp.dec_rnn_size)]
 			for _ in range(hp.dec_layer_num):
-				cells.append(ResidualWrapper(GRUCell(hp.dec_rnn_size)))
+				cells.append(ResidualWrapper(
+						get_rnn_cell(hp.rnn_cell_type, hp.dec_rnn_size)))
 
 			# [N, T_in, 256]
 			decoder_cell = MultiRNNCell(cells, state_is_tuple=True)
@@ -207,32 +161,60 @@ class Tacotron():
 
 				decoder_init_state = tuple(decoder_init_state)
 
-			if is_training:
-				helper = TacoTrainingHelper(
-						inputs, mel_targets, hp.num_mels, hp.reduction_factor,
-						rnn_decoder_test_mode)
-			else:
-				helper = TacoTestHelper(
-						batch_size, hp.num_mels, hp.reduction_factor)
-
-			(decoder_outputs, _), final_decoder_state, _ = \
-					tf.contrib.seq2seq.dynamic_decode(
-							BasicDecoder(output_cell, helper, decoder_init_state),
-							maximum_iterations=hp.max_iters)
+			if streaming:
+				self._initialize_decoder_steps(
+						output_cell, decoder_init_state, input_lengths)
 
-			# [N, T_out, M]
-			mel_outputs = tf.reshape(
-					decoder_outputs, [batch_size, -1, hp.num_mels])
+				# The post CBHG runs on mel frames fed from the decoder steps
+				mel_outputs = tf.placeholder(
+						tf.float32, [None, None, hp.num_mels], 'mel_outputs')
+				output_lengths = None
+				final_decoder_state = None
+			else:
+				if mel_targets is not None:
+					helper = TacoTrainingHelper(
+							inputs, mel_targets, hp.num_mels, hp.reduction_factor,
+							rnn_decoder_test_mode)
+				else:
+					helper = TacoTestHelper(
+							batch_size, hp.num_mels, hp.reduction_factor,
+							input_lengths, hp.stop_threshold)
+
+				# At inference, finished items keep their last state and emit
+				# zeros until the whole batch is done. Their steps are still
+				# computed: only ending the loop early saves time.
+				(decoder_outputs, _), final_decoder_state, final_decoder_lengths = \
+						tf.contrib.seq2seq.dynamic_decode(
+								BasicDecoder(output_cell, helper, decoder_init_state),
+								impute_finished=not is_training,
+								maximum_iterations=hp.max_iters,
+								swap_memory=is_training and hp.decoder_swap_memory)
+
+				# [N, T_out, M]
+				mel_outputs = tf.reshape(
+						decoder_outputs, [batch_size, -1, hp.num_mels])
+
+				# [N], number of valid frames of each item
+				output_lengths = final_decoder_lengths * hp.reduction_factor
 
 			# Add post-processing CBHG:
 			# [N, T_out, 256]
 			#post_outputs = post_cbhg(mel_outputs, hp.num_mels, is_training)
-			post_outputs = cbhg(
-					mel_outputs, None, is_training,
+			post_cbhg = lambda x, lengths: cbhg(
+					x, lengths, is_training,
 					hp.post_bank_size, hp.post_bank_channel_size,
 					hp.post_maxpool_width, hp.post_highway_depth, hp.post_rnn_size,
 					hp.post_proj_sizes, hp.post_proj_width,
-					scope='post_cbhg')
+					scope='post_cbhg',
+					fold_batch_norm=fold_batch_norm,
+					fused_conv_bank=hp.fused_conv_bank,
+					rnn_cell_type=hp.rnn_cell_type)
+
+			if is_training and hp.recompute_post_cbhg:
+				post_outputs = recompute_grad(post_cbhg, mel_outputs, None)
+			else:
+				post_outputs = post_cbhg(
+						mel_outputs, None if is_training else output_lengths)
 
 			if speaker_embed is not None and hp.model_type == 'simple':
 				expanded_speaker_emb = tf.expand_dims(speaker_embed, [1])
@@ -246,8 +228,11 @@ class Tacotron():
 			linear_outputs = tf.layers.dense(post_outputs, hp.num_freq)	   # [N, T_out, F]
 
 			# Grab alignments from the final decoder state:
-			alignments = tf.transpose(
-					final_decoder_state[0].alignment_history.stack(), [1, 2, 0])
+			if streaming:
+				alignments = None
+			else:
+				alignments = tf.transpose(
+						final_decoder_state[0].alignment_history.stack(), [1, 2, 0])
 
 
 			self.inputs = inputs
@@ -257,6 +242,9 @@ class Tacotron():
 			self.mel_outputs = mel_outputs
 			self.linear_outputs = linear_outputs
 			self.alignments = alignments
+			self.output_lengths = output_lengths
+			self.encoder_outputs = encoder_outputs
+			self.attention_keys = attention_mechanism.keys
 			self.mel_targets = mel_targets
 			self.linear_targets = linear_targets
 			self.final_decoder_state = final_decoder_state
@@ -276,12 +264,187 @@ class Tacotron():
 			log('	 attention out:			   %d' % attention_cell.output_size)
 			log('	 concat attn & out:		   %d' % concat_cell.output_size)
 			log('	 decoder cell out:		   %d' % decoder_cell.output_size)
-			log('	 decoder out (%d frames):  %d' % (hp.reduction_factor, decoder_outputs.shape[-1]))
+			log('	 decoder out (%d frames):  %d' % (hp.reduction_factor, output_cell.output_size))
 			log('	 decoder out (1 frame):	   %d' % mel_outputs.shape[-1])
 			log('	 postnet out:			   %d' % post_outputs.shape[-1])
 			log('	 linear out:			   %d' % linear_outputs.shape[-1])
 
 
+	def _initialize_encoder(
+			self, inputs, input_lengths, num_speakers, speaker_id,
+			is_training, fold_batch_norm, speaker_projections=()):
+		'''Embeddings, speakers and encoder, shared with DurationTacotron.
+
+		`speaker_projections` are the (name, size) of the deepvoice projections
+		of the speakers that the decoder needs. They are returned as a dict of
+		[N, size] tensors, empty unless model_type is deepvoice. Also sets
+		`num_speakers` and `speaker_variables`.
+
+		Returns:
+			char_embedded_inputs, speaker_embed (None unless model_type is
+			simple), prenet_outputs, encoder_outputs, speaker_projections
+		'''
+		hp = self._hparams
+
+		# Embeddings
+		# 1. check whether english/korean
+		if 'english_cleaners' in hp.cleaners:
+			num_symbols = len(en_symbols_arpabet if hp.use_cmudict else en_symbols)
+		else:
+			num_symbols = len(symbols)
+
+		char_embed_table = tf.get_variable(
+				'embedding', [num_symbols, hp.embedding_size], dtype=tf.float32,
+				initializer=tf.truncated_normal_initializer(stddev=0.5))
+		# [N, T_in, embedding_size]
+		char_embedded_inputs = \
+				tf.nn.embedding_lookup(char_embed_table, inputs)
+
+		speaker_embed = None
+		before_highway = None
+		encoder_rnn_init_state = None
+		projections = {}
+
+		self.num_speakers = num_speakers
+		num_variables = len(tf.trainable_variables())
+		if self.num_speakers > 1:
+			if hp.speaker_embedding_size != 1:
+				speaker_embed_table = tf.get_variable(
+						'speaker_embedding',
+						[self.num_speakers, hp.speaker_embedding_size], dtype=tf.float32,
+						initializer=tf.truncated_normal_initializer(stddev=0.5))
+				# [N, speaker_embedding_size]
+				speaker_embed = tf.nn.embedding_lookup(speaker_embed_table, speaker_id)
+
+			if hp.model_type == 'deepvoice':
+				if hp.speaker_embedding_size == 1:
+					project = lambda name, dim: get_embed(
+							speaker_id, self.num_speakers, dim, name)
+				else:
+					project = lambda name, dim: tf.layers.dense(
+							speaker_embed, dim, activation=tf.nn.softsign)
+
+				before_highway = project(
+						"before_highway", hp.enc_prenet_sizes[-1])
+				encoder_rnn_init_state = project(
+						"encoder_rnn_init_state", hp.enc_rnn_size * 2)
+				for name, dim in speaker_projections:
+					projections[name] = project(name, dim)
+
+				speaker_embed = None # deepvoice does not use speaker_embed directly
+			elif hp.model_type != 'simple':
+				raise Exception(" [!] Unkown multi-speaker model type: {}".format(hp.model_type))
+
+		# Speaker embedding tables and the deepvoice projections of the
+		# speaker embedding (trained alone by speaker adaptation)
+		self.speaker_variables = tf.trainable_variables()[num_variables:]
+
+		##############
+		# Encoder
+		##############
+
+		# [N, T_in, enc_prenet_sizes[-1]]
+		prenet_outputs = prenet(char_embedded_inputs, is_training,
+				hp.enc_prenet_sizes, hp.dropout_prob,
+				scope='prenet')
+
+		encoder_outputs = cbhg(
+				prenet_outputs, input_lengths, is_training,
+				hp.enc_bank_size, hp.enc_bank_channel_size,
+				hp.enc_maxpool_width, hp.enc_highway_depth, hp.enc_rnn_size,
+				hp.enc_proj_sizes, hp.enc_proj_width,
+				scope="encoder_cbhg",
+				before_highway=before_highway,
+				encoder_rnn_init_state=encoder_rnn_init_state,
+				fold_batch_norm=fold_batch_norm,
+				fused_conv_bank=hp.fused_conv_bank,
+				rnn_cell_type=hp.rnn_cell_type)
+
+		return char_embedded_inputs, speaker_embed, prenet_outputs, \
+				encoder_outputs, projections
+
+	def _initialize_decoder_steps(self, output_cell, decoder_init_state, input_lengths):
+		'''Builds a graph that runs `stream_num_steps` decoder steps from a fed state.
+
+		`stream_states` default to the initial decoder state, so the first call only
+		needs the model inputs. Later calls feed back `stream_next_states`,
+		`stream_next_inputs` and `stream_next_finished` of the previous call. Feeding
+		`encoder_outputs` and `attention_keys` skips running the encoder again.
+		'''
+		hp = self._hparams
+
+		flat_init_state = nest.flatten(decoder_init_state)
+		self.stream_states = [
+				tf.placeholder_with_default(
+						state, state.get_shape(), name='stream_state_%d' % idx)
+				for idx, state in enumerate(flat_init_state)]
+		init_state = nest.pack_sequence_as(decoder_init_state, self.stream_states)
+
+		# Position of the [N, T_in] attention alignments among the flat states
+		self.stream_alignments_index = [
+				idx for idx, state in enumerate(flat_init_state) \
+						if state is decoder_init_state[0].alignments][0]
+
+		# The last state is the top decoder GRU: [N, dec_rnn_size]
+		batch_size = tf.shape(self.stream_states[-1])[0]
+
+		self.stream_num_steps = tf.placeholder_with_default(
+				10, [], name='stream_num_steps')
+		self.stream_inputs = tf.placeholder_with_default(
+				tf.zeros([batch_size, hp.num_mels]), [None, hp.num_mels], name='stream_inputs')
+		self.stream_finished = tf.placeholder_with_default(
+				tf.tile([False], [batch_size]), [None], name='stream_finished')
+
+		def body(step, inputs, state, finished, outputs_ta, alignments_ta, lengths):
+			outputs, next_state = output_cell(inputs, state)
+
+			# Finished items keep their state and emit zeros
+			next_state = nest.map_structure(
+					lambda new, cur: new if new.get_shape().ndims == 0 \
+							else tf.where(finished, cur, new),
+					next_state, state)
+			outputs = tf.where(finished, tf.zeros_like(outputs), outputs)
+			lengths += tf.where(finished, tf.zeros_like(lengths), tf.ones_like(lengths))
+
+			if hp.stop_threshold > 0:
+				next_finished = tf.logical_or(finished, is_finished(
+						outputs, next_state[0].alignments, input_lengths, hp.stop_threshold))
+			else:
+				next_finished = finished
+
+			return (step + 1, outputs[:, -hp.num_mels:], next_state, next_finished,
+					outputs_ta.write(step, outputs),
+					alignments_ta.write(step, next_state[0].alignments), lengths)
+
+		def cond(step, inputs, state, finished, *_):
+			return tf.logical_and(
+					step < self.stream_num_steps,
+					tf.logical_not(tf.reduce_all(finished)))
+
+		# Same variable scope as dynamic_decode
+		with tf.variable_scope('decoder'):
+			_, next_inputs, next_state, next_finished, outputs_ta, alignments_ta, lengths = \
+					tf.while_loop(cond, body, [
+							tf.constant(0),
+							self.stream_inputs, init_state, self.stream_finished,
+							tf.TensorArray(tf.float32, size=0, dynamic_size=True),
+							tf.TensorArray(tf.float32, size=0, dynamic_size=True),
+							tf.zeros([batch_size], dtype=tf.int32),
+					])
+
+		# [N, steps * r, M]
+		self.stream_outputs = tf.reshape(
+				tf.transpose(outputs_ta.stack(), [1, 0, 2]), [batch_size, -1, hp.num_mels])
+		# [N, T_in, steps]
+		self.stream_alignments = tf.transpose(alignments_ta.stack(), [1, 2, 0])
+		# [N], number of valid frames in stream_outputs
+		self.stream_output_lengths = lengths * hp.reduction_factor
+
+		self.stream_next_inputs = next_inputs
+		self.stream_next_states = nest.flatten(next_state)
+		self.stream_next_finished = next_finished
+
+
 	def add_loss(self):
 		'''Adds loss to the model. Sets "loss" field. initialize must have been called.'''
 		with tf.variable_scope('loss') as scope:
@@ -313,11 +476,42 @@ class Tacotron():
 			self.loss_without_coeff = self.mel_loss + self.linear_loss
 
 
-	def add_optimizer(self, global_step):
+	def add_distillation_loss(self, teacher):
+		'''Mixes the outputs and alignments of a teacher model into "loss". add_loss must have been called.
+
+		Args:
+			teacher: Tacotron with the same inputs and targets, built with is_training=False
+		'''
+		with tf.variable_scope('distillation_loss') as scope:
+			hp = self._hparams
+
+			teacher_mel_outputs = tf.stop_gradient(teacher.mel_outputs)
+			teacher_linear_outputs = tf.stop_gradient(teacher.linear_outputs)
+			teacher_alignments = tf.stop_gradient(teacher.alignments)
+
+			self.distill_mel_loss = tf.reduce_mean(
+					tf.abs(teacher_mel_outputs - self.mel_outputs))
+			self.distill_linear_loss = tf.reduce_mean(
+					tf.abs(teacher_linear_outputs - self.linear_outputs))
+			# L1 distance between the attention distributions of each decoder step
+			self.distill_alignment_loss = tf.reduce_mean(tf.reduce_sum(
+					tf.abs(teacher_alignments - self.alignments), axis=1))
+
+			self.loss = (1 - hp.distill_coeff) * self.loss + \
+					hp.distill_coeff * (self.distill_mel_loss + self.distill_linear_loss) + \
+					hp.distill_alignment_coeff * self.distill_alignment_loss
+
+
+	def add_optimizer(self, global_step, var_list=None, num_replicas=1, num_frozen_speakers=0):
 		'''Adds optimizer. Sets "gradients" and "optimize" fields. add_loss must have been called.
 
 		Args:
 			global_step: int32 scalar Tensor representing current global step in training
+			var_list: variables to train (default: all trainable variables)
+			num_replicas: number of workers of synchronous data-parallel training,
+				whose gradients are averaged by a SyncReplicasOptimizer ("optimizer" field)
+			num_frozen_speakers: rows of the speaker embedding tables that are not
+				updated, i.e. the existing speakers when adapting to new ones
 		'''
 		with tf.variable_scope('optimizer') as scope:
 			hp = self._hparams
@@ -336,17 +530,87 @@ class Tacotron():
 						tf.train.exponential_decay(1., step, 3000, 0.95)
 
 			optimizer = tf.train.AdamOptimizer(self.learning_rate, hp.adam_beta1, hp.adam_beta2)
-			gradients, variables = zip(*optimizer.compute_gradients(self.loss))
+			if num_replicas > 1:
+				if hp.gradient_accumulation_steps > 1:
+					raise Exception(" [!] gradient_accumulation_steps is not supported with multiple workers")
+				optimizer = tf.train.SyncReplicasOptimizer(
+						optimizer, replicas_to_aggregate=num_replicas,
+						total_num_replicas=num_replicas)
+			self.optimizer = optimizer
+
+			gradients, variables = zip(*optimizer.compute_gradients(self.loss, var_list))
+			if num_frozen_speakers > 0:
+				gradients = [freeze_rows(grad, num_frozen_speakers) \
+						if isinstance(grad, tf.IndexedSlices) and var in self.speaker_variables else grad
+						for grad, var in zip(gradients, variables)]
 			self.gradients = gradients
-			clipped_gradients, _ = tf.clip_by_global_norm(gradients, 1.0)
+
+			def apply_gradients(gradients):
+				clipped_gradients, _ = tf.clip_by_global_norm(gradients, 1.0)
+				return optimizer.apply_gradients(zip(clipped_gradients, variables),
+					global_step=global_step)
 
 			# Add dependency on UPDATE_OPS; otherwise batchnorm won't work correctly. See:
 			# https://github.com/tensorflow/tensorflow/issues/1122
-			with tf.control_dependencies(tf.get_collection(tf.GraphKeys.UPDATE_OPS)):
-				self.optimize = optimizer.apply_gradients(zip(clipped_gradients, variables),
-					global_step=global_step)
+			# Adaptation keeps the moving statistics too, since the existing
+			# speakers are synthesized with them
+			update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS) \
+					if num_frozen_speakers == 0 else []
+			with tf.control_dependencies(update_ops):
+				if hp.gradient_accumulation_steps > 1:
+					self.optimize, self.is_update_step = self._accumulate_gradients(
+							gradients, variables, apply_gradients)
+				else:
+					self.optimize = apply_gradients(gradients)
+					self.is_update_step = tf.constant(True)
+
+	def _accumulate_gradients(self, gradients, variables, apply_fn):
+		'''Sums the gradients of gradient_accumulation_steps runs (micro-batches)
+		and calls `apply_fn` with their mean on the last one, so global_step and
+		the learning rate only advance with the updates.
+
+		Returns:
+			optimize: op to run once per micro-batch
+			is_update_step: bool scalar, whether the run applied an update
+		'''
+		num_steps = self._hparams.gradient_accumulation_steps
+
+		# Local variables: not saved, since checkpoints are taken after updates
+		with tf.variable_scope('accumulators'):
+			accumulators = [tf.get_variable(
+					var.op.name, var.get_shape(), initializer=tf.zeros_initializer(),
+					trainable=False, collections=[tf.GraphKeys.LOCAL_VARIABLES]) \
+							if grad is not None else None
+					for grad, var in zip(gradients, variables)]
+			counter = tf.get_variable(
+					'counter', [], tf.int32, initializer=tf.zeros_initializer(),
+					trainable=False, collections=[tf.GraphKeys.LOCAL_VARIABLES])
+
+		accumulate_ops = [tf.assign_add(accumulator, grad) \
+				for accumulator, grad in zip(accumulators, gradients) if grad is not None]
+		with tf.control_dependencies(accumulate_ops):
+			count = tf.assign_add(counter, 1)
+
+		def update():
+			mean_gradients = [accumulator / num_steps if accumulator is not None else None \
+					for accumulator in accumulators]
+
+			with tf.control_dependencies([apply_fn(mean_gradients)]):
+				reset_ops = [tf.assign(accumulator, tf.zeros_like(accumulator)) \
+						for accumulator in accumulators if accumulator is not None]
+				reset_ops.append(tf.assign(counter, 0))
+
+			with tf.control_dependencies(reset_ops):
+				return tf.constant(True)
+
+		is_update_step = tf.cond(
+				count >= num_steps, update, lambda: tf.constant(False))
+		return is_update_step.op, is_update_step
 
 	def get_dummy_feed_dict(self):
+		if self.is_manual_attention is None:
+			return {}
+
 		feed_dict = {
 				self.is_manual_attention: False,
 				self.manual_alignments: np.zeros([1, 1, 1]),
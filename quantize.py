@@ -0,0 +1,232 @@
+# Stores the large float32 weights of an exported graph as int8 with a float
+# scale per output channel, to shrink the file (about 4x for those weights):
+#
+#   python3 quantize.py --load_path logs/son-20171015 --num_speakers=1
+#
+# The weights are dequantized when the graph is loaded, so inference runs in
+# float32 with the memory use and latency of the float32 export.
+import os
+import argparse
+import tempfile
+import numpy as np
+import tensorflow as tf
+from collections import OrderedDict
+from tensorflow.python.framework import tensor_util
+
+from hparams import hparams
+from export import export, FrozenTacotron, FROZEN_GRAPH_NAME
+from utils import save_hparams, makedirs, write_json
+from benchmarks import get_texts, get_inputs, measure, print_table
+
+
+QUANTIZED_SUFFIX = '/quantized'
+SCALE_SUFFIX = '/scale'
+DEQUANTIZE_SUFFIX = '/dequantize'
+
+
+def read_graph_def(path):
+    graph_def = tf.GraphDef()
+    with tf.gfile.GFile(path, "rb") as f:
+        graph_def.ParseFromString(f.read())
+    return graph_def
+
+
+def write_graph_def(graph_def, path):
+    with tf.gfile.GFile(path, "wb") as f:
+        f.write(graph_def.SerializeToString())
+
+
+def quantizable_weights(graph_def, min_elements=1024):
+    '''Names of the float constants of rank >= 2 (kernels and embeddings).'''
+    names = []
+    for node in graph_def.node:
+        if node.op != 'Const' or \
+                node.attr['dtype'].type != tf.float32.as_datatype_enum:
+            continue
+
+        dims = [dim.size for dim in node.attr['value'].tensor.tensor_shape.dim]
+        if len(dims) >= 2 and np.prod(dims) >= min_elements:
+            names.append(node.name)
+    return names
+
+
+def quantize_weight(weight, num_bits=8):
+    # Symmetric scale per output channel (last axis of dense and conv kernels)
+    max_value = 2 ** (num_bits - 1) - 1
+
+    scale = np.max(np.abs(weight.reshape(-1, weight.shape[-1])), 0) / max_value
+    scale[scale == 0] = 1.0
+
+    quantized = np.clip(np.round(weight / scale), -max_value, max_value)
+    return quantized.astype(np.int8), scale.astype(np.float32)
+
+
+def _add_const(graph_def, name, value, device):
+    node = graph_def.node.add()
+    node.op = 'Const'
+    node.name = name
+    node.device = device
+    node.attr['dtype'].type = tf.as_dtype(value.dtype).as_datatype_enum
+    node.attr['value'].tensor.CopyFrom(tensor_util.make_tensor_proto(value))
+    return node
+
+
+def quantize_graph(graph_def, names):
+    '''Replaces the constants in `names` with int8 values and float scales.
+
+    The dequantized weight keeps the name of the original constant, so the
+    rest of the graph (and the input and output names) is left untouched.
+    Only the file shrinks: the session folds the Cast and Mul of constants
+    back into float32 weights, so inference runs in float32.
+    '''
+    names = set(names)
+
+    quantized_graph_def = tf.GraphDef()
+    quantized_graph_def.versions.CopyFrom(graph_def.versions)
+    quantized_graph_def.library.CopyFrom(graph_def.library)
+
+    for node in graph_def.node:
+        if node.name not in names:
+            quantized_graph_def.node.extend([node])
+            continue
+
+        quantized, scale = quantize_weight(
+                tensor_util.MakeNdarray(node.attr['value'].tensor))
+
+        _add_const(quantized_graph_def,
+                node.name + QUANTIZED_SUFFIX, quantized, node.device)
+        _add_const(quantized_graph_def,
+                node.name + SCALE_SUFFIX, scale, node.device)
+
+        cast = quantized_graph_def.node.add()
+        cast.op = 'Cast'
+        cast.name = node.name + DEQUANTIZE_SUFFIX
+        cast.device = node.device
+        cast.input.append(node.name + QUANTIZED_SUFFIX)
+        cast.attr['SrcT'].type = tf.int8.as_datatype_enum
+        cast.attr['DstT'].type = tf.float32.as_datatype_enum
+
+        mul = quantized_graph_def.node.add()
+        mul.op = 'Mul'
+        mul.name = node.name
+        mul.device = node.device
+        mul.input.extend([cast.name, node.name + SCALE_SUFFIX])
+        mul.attr['T'].type = tf.float32.as_datatype_enum
+
+    return quantized_graph_def
+
+
+class GraphRunner(object):
+    def __init__(self, graph_def):
+        graph = tf.Graph()
+        with graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+
+        self.model = FrozenTacotron(graph)
+        self.sess = tf.Session(graph=graph)
+
+    def close(self):
+        self.sess.close()
+
+    def feed_dict(self, text):
+        inputs, input_lengths = get_inputs([text])
+        return {
+                self.model.inputs: inputs,
+                self.model.input_lengths: input_lengths,
+        }
+
+    def synthesize(self, texts):
+        results = []
+        for text in texts:
+            linear_outputs, output_lengths = self.sess.run(
+                    [self.model.linear_outputs, self.model.output_lengths],
+                    self.feed_dict(text))
+            results.append(linear_outputs[0][:output_lengths[0]])
+        return results
+
+    def latencies(self, texts, num_repeat):
+        # Used by benchmarks.pruning, whose shrunk kernels do change the latency
+        times = []
+        for text in texts:
+            feed_dict = self.feed_dict(text)
+            times.extend(measure(lambda: self.sess.run(
+                    self.model.linear_outputs, feed_dict), num_repeat))
+        return times
+
+
+def spectrogram_error(references, outputs):
+    # Mean absolute error of the normalized linear spectrograms. Decoding
+    # is autoregressive, so the lengths may differ and only the common
+    # frames are compared.
+    errors = []
+    for reference, output in zip(references, outputs):
+        length = min(len(reference), len(output))
+        errors.append(np.mean(np.abs(reference[:length] - output[:length])))
+    return float(np.mean(errors))
+
+
+def report(graph_defs, paths, texts):
+    results = OrderedDict()
+    references = None
+
+    for name, graph_def in graph_defs.items():
+        runner = GraphRunner(graph_def)
+        outputs = runner.synthesize(texts)
+        if references is None:
+            references = outputs
+
+        results[name] = OrderedDict([
+                ('size_mb', os.path.getsize(paths[name]) / 1024 / 1024),
+                ('error', spectrogram_error(references, outputs)),
+        ])
+        runner.close()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--load_path', required=True)
+    parser.add_argument('--export_dir', default=None)
+    parser.add_argument('--num_speakers', default=1, type=int)
+    parser.add_argument('--checkpoint_step', default=None, type=int)
+    parser.add_argument('--text_path', default=None,
+            help='Sentences to compare the outputs on, one per line (default: benchmark texts)')
+    parser.add_argument('--min_elements', default=1024, type=int)
+    config = parser.parse_args()
+
+    export_dir = config.export_dir or os.path.join(config.load_path, "quantized")
+
+    # Float32 baseline with folded batch norms, also loads the hparams
+    float_path = export(
+            config.load_path, tempfile.mkdtemp(), config.num_speakers,
+            config.checkpoint_step, optimize=True)
+    float_graph_def = read_graph_def(float_path)
+
+    if config.text_path is not None:
+        with open(config.text_path, encoding='utf-8') as f:
+            texts = [line.strip() for line in f if line.strip()]
+    else:
+        texts = get_texts()
+
+    names = quantizable_weights(float_graph_def, config.min_elements)
+    quantized_graph_def = quantize_graph(float_graph_def, names)
+
+    makedirs(export_dir)
+    quantized_path = os.path.join(export_dir, FROZEN_GRAPH_NAME)
+    write_graph_def(quantized_graph_def, quantized_path)
+    save_hparams(export_dir, hparams)
+
+    print(" [*] Quantized {} weights: {}".format(len(names), quantized_path))
+
+    results = report(
+            OrderedDict([('float32', float_graph_def), ('int8', quantized_graph_def)]),
+            {'float32': float_path, 'int8': quantized_path},
+            texts)
+
+    print_table(results, keys=('size_mb', 'error'))
+    write_json(os.path.join(export_dir, "quantize_report.json"), results)
+
+
+if __name__ == '__main__':
+    main()
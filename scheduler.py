@@ -0,0 +1,296 @@
+import time
+import queue
+import threading
+import traceback
+import numpy as np
+from multiprocessing import get_context
+from concurrent.futures import Future
+
+from hparams import hparams
+from audio import inv_spectrogram
+from text import text_to_sequence
+from datasets.datafeeder import _prepare_inputs
+
+
+class Request(object):
+    def __init__(self, text, speaker_id):
+        self.text = text
+        self.speaker_id = speaker_id
+        self.sequence = np.asarray(text_to_sequence(text), dtype=np.int32)
+
+        self.future = Future()
+        self.submit_time = time.time()
+
+        self.mels = []
+        self.num_steps = 0
+
+
+class DecoderScheduler(object):
+    '''Iteration-level batching on top of the step-wise decoder.
+
+    Runs the decoder steps of a Synthesizer loaded with `streaming=True` for a
+    batch of requests that changes at step boundaries: new requests are
+    encoded and join the running batch, every slot keeps its own attention
+    and GRU states, and finished slots leave right away. Their frames go
+    through the post CBHG and then to a pool of Griffin-Lim workers.
+
+    With `continuous=False`, new requests only start once the whole running
+    batch has finished (request-level batching).
+
+    Attention is masked to the inputs of each slot, but the encoder of a new
+    request still sees the padding of the requests admitted with it, so its
+    frames can differ slightly from decoding it alone.
+    '''
+
+    def __init__(self, synthesizer, max_batch_size=16, chunk_steps=5,
+            num_vocoder_workers=4, continuous=True):
+        self.model = synthesizer.model
+        self.sess = synthesizer.sess
+
+        self.max_batch_size = max_batch_size
+        self.chunk_steps = chunk_steps
+        self.continuous = continuous
+
+        self._requests = queue.Queue()
+        self._slots = []
+        self._batch = None
+
+        # The session already runs its threads, so the workers are spawned,
+        # not forked (see utils.background.BackgroundPool)
+        self._pool = get_context('spawn').Pool(num_vocoder_workers,
+                initializer=_init_vocoder_worker, initargs=(hparams.values(),))
+        self._stop = threading.Event()
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, text, speaker_id=0):
+        '''Returns a Future of the waveform of `text`.'''
+        if self._stop.is_set():
+            raise Exception(" [!] DecoderScheduler is closed")
+
+        request = Request(text, speaker_id)
+        self._requests.put(request)
+        return request.future
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+        # Requests that were still queued or decoding never get a result
+        error = Exception(" [!] DecoderScheduler is closed")
+        for request in self._slots:
+            request.future.set_exception(error)
+        self._slots, self._batch = [], None
+
+        while True:
+            try:
+                self._requests.get_nowait().future.set_exception(error)
+            except queue.Empty:
+                break
+
+        self._pool.close()
+        self._pool.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._admit()
+                if self._slots:
+                    self._step()
+                    self._evict()
+            except Exception as e:
+                traceback.print_exc()
+                for request in self._slots:
+                    request.future.set_exception(e)
+                self._slots, self._batch = [], None
+
+    def _admit(self):
+        if self._slots and not self.continuous:
+            return
+
+        new_requests = []
+        while len(self._slots) + len(new_requests) < self.max_batch_size:
+            # Only wait for requests when there is nothing to decode
+            is_idle = not self._slots and not new_requests
+            try:
+                new_requests.append(
+                        self._requests.get(block=is_idle, timeout=0.1))
+            except queue.Empty:
+                break
+
+        if not new_requests:
+            return
+
+        # The new requests are not in the slots yet, so _run cannot fail them
+        try:
+            self._start(new_requests)
+        except Exception as e:
+            traceback.print_exc()
+            for request in new_requests:
+                request.future.set_exception(e)
+
+    def _start(self, new_requests):
+        inputs = _prepare_inputs([request.sequence for request in new_requests])
+        input_lengths = np.argmax(inputs == 1, 1)
+        speaker_ids = np.asarray(
+                [request.speaker_id for request in new_requests], dtype=np.int32)
+
+        feed_dict = {
+                self.model.inputs: inputs,
+                self.model.input_lengths: input_lengths,
+                self.model.speaker_id: speaker_ids,
+        }
+        feed_dict.update(self.model.get_dummy_feed_dict())
+
+        encoder_outputs, attention_keys, states = self.sess.run([
+                self.model.encoder_outputs,
+                self.model.attention_keys,
+                self.model.stream_states,
+        ], feed_dict=feed_dict)
+
+        batch = {
+                'encoder_outputs': encoder_outputs,
+                'attention_keys': attention_keys,
+                'input_lengths': input_lengths,
+                'speaker_id': speaker_ids,
+                'states': states,
+                'inputs': np.zeros([len(new_requests), hparams.num_mels], dtype=np.float32),
+                'finished': np.zeros([len(new_requests)], dtype=np.bool_),
+        }
+
+        if self._batch is None:
+            self._batch = batch
+        else:
+            self._batch = concat_batches(
+                    self._batch, batch, self.model.stream_alignments_index)
+        self._slots.extend(new_requests)
+
+    def _step(self):
+        batch = self._batch
+
+        feed_dict = {
+                self.model.input_lengths: batch['input_lengths'],
+                self.model.speaker_id: batch['speaker_id'],
+                self.model.encoder_outputs: batch['encoder_outputs'],
+                self.model.attention_keys: batch['attention_keys'],
+                self.model.stream_num_steps: self.chunk_steps,
+                self.model.stream_inputs: batch['inputs'],
+                self.model.stream_finished: batch['finished'],
+        }
+        feed_dict.update(zip(self.model.stream_states, batch['states']))
+        feed_dict.update(self.model.get_dummy_feed_dict())
+
+        outputs, output_lengths, states, next_inputs, finished = self.sess.run([
+                self.model.stream_outputs,
+                self.model.stream_output_lengths,
+                self.model.stream_next_states,
+                self.model.stream_next_inputs,
+                self.model.stream_next_finished,
+        ], feed_dict=feed_dict)
+
+        batch.update({
+                'states': states,
+                'inputs': next_inputs,
+                'finished': finished,
+        })
+
+        for request, output, output_length in \
+                zip(self._slots, outputs, output_lengths):
+            request.mels.append(output[:output_length])
+            request.num_steps += self.chunk_steps
+
+    def _evict(self):
+        is_done = np.array([
+                is_finished or request.num_steps >= hparams.max_iters
+                for request, is_finished in zip(self._slots, self._batch['finished'])])
+
+        if not is_done.any():
+            return
+
+        for request, done in zip(self._slots, is_done):
+            if done:
+                self._vocode(request)
+
+        self._slots = [request for request, done in zip(self._slots, is_done) if not done]
+        if self._slots:
+            self._batch = select_batch(
+                    self._batch, ~is_done, self.model.stream_alignments_index)
+        else:
+            self._batch = None
+
+    def _vocode(self, request):
+        mels = np.concatenate(request.mels)
+        linear_outputs = self.sess.run(self.model.linear_outputs, {
+                self.model.mel_outputs: [mels],
+                self.model.speaker_id: [request.speaker_id],
+        })[0]
+
+        self._pool.apply_async(
+                inv_spectrogram, (linear_outputs.T,),
+                callback=request.future.set_result,
+                error_callback=request.future.set_exception)
+
+
+def _init_vocoder_worker(hparams_values):
+    # Spawned workers import the default hparams
+    for key, value in hparams_values.items():
+        setattr(hparams, key, value)
+
+
+def _pad_time(x, max_time):
+    # Pads axis 1 (encoder time) with zeros
+    padding = [(0, 0)] * x.ndim
+    padding[1] = (0, max_time - x.shape[1])
+    return np.pad(x, padding, mode='constant')
+
+
+def concat_batches(batch, new_batch, alignments_index):
+    max_time = max(
+            batch['encoder_outputs'].shape[1], new_batch['encoder_outputs'].shape[1])
+
+    merged = {}
+    for key in ['encoder_outputs', 'attention_keys']:
+        merged[key] = np.concatenate([
+                _pad_time(batch[key], max_time), _pad_time(new_batch[key], max_time)])
+
+    for key in ['input_lengths', 'speaker_id', 'inputs', 'finished']:
+        merged[key] = np.concatenate([batch[key], new_batch[key]])
+
+    merged['states'] = []
+    for idx, (state, new_state) in enumerate(zip(batch['states'], new_batch['states'])):
+        if np.ndim(state) == 0:
+            # Attention time step is shared by the batch and only used
+            # for the alignment history, which is disabled here.
+            merged['states'].append(state)
+        elif idx == alignments_index:
+            merged['states'].append(np.concatenate([
+                    _pad_time(state, max_time), _pad_time(new_state, max_time)]))
+        else:
+            merged['states'].append(np.concatenate([state, new_state]))
+
+    return merged
+
+
+def select_batch(batch, keep, alignments_index):
+    # Drops the encoder time steps that only the removed slots used
+    max_time = batch['input_lengths'][keep].max() + 1
+
+    selected = {}
+    for key in ['encoder_outputs', 'attention_keys']:
+        selected[key] = batch[key][keep, :max_time]
+
+    for key in ['input_lengths', 'speaker_id', 'inputs', 'finished']:
+        selected[key] = batch[key][keep]
+
+    selected['states'] = []
+    for idx, state in enumerate(batch['states']):
+        if np.ndim(state) == 0:
+            selected['states'].append(state)
+        elif idx == alignments_index:
+            selected['states'].append(state[keep, :max_time])
+        else:
+            selected['states'].append(state[keep])
+
+    return selected
@@ -1,6 +1,7 @@
 import io
 import os
 import re
+import time
 import librosa
 import argparse
 import numpy as np
@@ -8,16 +9,21 @@ from glob import glob
 from tqdm import tqdm
 import tensorflow as tf
 from functools import partial
+from multiprocessing import Pool
 
 from hparams import hparams
-from models import create_model, get_most_recent_checkpoint
+from models import create_model, get_most_recent_checkpoint, restore_variables
 from audio import save_audio, inv_spectrogram, inv_preemphasis, \
                   inv_spectrogram_tensorflow
 from utils import plot, PARAMS_NAME, load_json, load_hparams, \
-                  add_prefix, add_postfix, get_time, parallel_run, makedirs, str2bool
+                  add_prefix, add_postfix, get_time, parallel_run, makedirs, str2bool, \
+                  xla_scope
 
 from text.korean import tokenize
 from text import text_to_sequence, sequence_to_text
+from datasets.datafeeder import _prepare_inputs
+from export import FROZEN_GRAPH_NAME, load_frozen_graph
+from utils.tuning import load_tuned_config, get_session_config, set_cpu_affinity
 
 
 class Synthesizer(object):
@@ -25,8 +31,47 @@ class Synthesizer(object):
         tf.reset_default_graph()
         self.sess.close()
 
-    def load(self, checkpoint_path, num_speakers=2, checkpoint_step=None, model_name='tacotron'):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+
+    def _prepare_cpus(self, vocoder_workers, tuned_config):
+        '''Starts the Griffin-Lim workers and returns the session config.
+
+        Settings that are None come from autotune.py (tuned_config.json).
+        '''
+        if tuned_config is None:
+            tuned_config = load_tuned_config('synthesis')
+        if vocoder_workers is None:
+            vocoder_workers = tuned_config.get('vocoder_workers', 0)
+
+        # Workers fork before the session starts its threads
+        self.pool = None
+        if vocoder_workers > 0:
+            self.pool = Pool(vocoder_workers, initializer=set_cpu_affinity,
+                    initargs=(tuned_config.get('vocoder_cpu_affinity'),))
+        set_cpu_affinity(tuned_config.get('cpu_affinity'))
+
+        sess_config = get_session_config(tuned_config,
+                intra_op_parallelism_threads=1,
+                inter_op_parallelism_threads=2,
+                allow_soft_placement=True)
+        sess_config.gpu_options.allow_growth = True
+        return sess_config
+
+    def load(self, checkpoint_path, num_speakers=2, checkpoint_step=None,
+            model_name='tacotron', streaming=False, xla=False, bucket_size=1,
+            vocoder_workers=None, tuned_config=None):
         self.num_speakers = num_speakers
+        self.bucket_size = bucket_size
+
+        if checkpoint_path.endswith(".pb"):
+            return self.load_frozen(checkpoint_path, num_speakers,
+                    vocoder_workers, tuned_config, bucket_size)
+        elif os.path.exists(os.path.join(checkpoint_path, FROZEN_GRAPH_NAME)):
+            return self.load_frozen(
+                    os.path.join(checkpoint_path, FROZEN_GRAPH_NAME), num_speakers,
+                    vocoder_workers, tuned_config, bucket_size)
 
         if os.path.isdir(checkpoint_path):
             load_path = checkpoint_path
@@ -44,27 +89,37 @@ class Synthesizer(object):
                 tf.zeros([batch_size], dtype=tf.int32), [None], 'speaker_id')
 
         load_hparams(hparams, load_path)
-        with tf.variable_scope('model') as scope:
+        with xla_scope(xla), tf.variable_scope('model') as scope:
             self.model = create_model(hparams)
 
+            # Streaming decodes chunk by chunk, without manual attention
             self.model.initialize(
                     inputs, input_lengths,
-                    self.num_speakers, speaker_id)
+                    self.num_speakers, speaker_id,
+                    manual_attention=not streaming,
+                    streaming=streaming)
             self.wav_output = \
                     inv_spectrogram_tensorflow(self.model.linear_outputs)
 
         print('Loading checkpoint: %s' % checkpoint_path)
 
-        sess_config = tf.ConfigProto(
-                allow_soft_placement=True,
-                intra_op_parallelism_threads=1,
-                inter_op_parallelism_threads=2)
-        sess_config.gpu_options.allow_growth = True
-
+        sess_config = self._prepare_cpus(vocoder_workers, tuned_config)
         self.sess = tf.Session(config=sess_config)
         self.sess.run(tf.global_variables_initializer())
-        saver = tf.train.Saver()
-        saver.restore(self.sess, checkpoint_path)
+        restore_variables(self.sess, checkpoint_path)
+
+    def load_frozen(self, frozen_path, num_speakers=2,
+            vocoder_workers=None, tuned_config=None, bucket_size=1):
+        # Graph written by export.py: no variables to initialize or restore
+        self.num_speakers = num_speakers
+        self.bucket_size = bucket_size
+
+        print('Loading frozen graph: %s' % frozen_path)
+        load_hparams(hparams, os.path.dirname(frozen_path))
+        self.model = load_frozen_graph(frozen_path)
+
+        sess_config = self._prepare_cpus(vocoder_workers, tuned_config)
+        self.sess = tf.Session(config=sess_config)
 
     def synthesize(self,
             texts=None, tokens=None,
@@ -76,7 +131,7 @@ class Synthesizer(object):
             manual_attention_mode=0,
             base_alignment_path=None,
             librosa_trim=False,
-            attention_trim=True,
+            attention_trim=False,
             isKorean=True):
 
         # Possible inputs:
@@ -116,26 +171,35 @@ class Synthesizer(object):
                     attention_trim=attention_trim,
                     time_str=time_str,
                     isKorean=isKorean)
+            if self.pool is not None:
+                return self.pool.map(fn, items)
             return parallel_run(fn, items,
                     desc="plot_graph_and_save_audio", parallel=False)
 
-        input_lengths = np.argmax(np.array(sequences) == 1, 1)
+        # Padding after EOS for XLA buckets. Attention is not masked, so it
+        # slightly changes the outputs.
+        inputs = _prepare_inputs(
+                [np.asarray(sequence) for sequence in sequences], self.bucket_size)
+        input_lengths = np.argmax(inputs == 1, 1)
 
         fetches = [
                 #self.wav_output,
                 self.model.linear_outputs,
                 self.model.alignments,
+                self.model.output_lengths,
         ]
 
         feed_dict = {
-                self.model.inputs: sequences,
+                self.model.inputs: inputs,
                 self.model.input_lengths: input_lengths,
         }
+
+        if self.model.is_manual_attention is None and \
+                (manual_attention_mode > 0 or base_alignment_path is not None):
+            raise Exception(" [!] Manual attention is not supported by a frozen or streaming graph")
+
         if base_alignment_path is None:
-            feed_dict.update({
-                    self.model.manual_alignments: np.zeros([1, 1, 1]),
-                    self.model.is_manual_attention: False,
-            })
+            feed_dict.update(self.model.get_dummy_feed_dict())
         else:
             manual_alignments = []
             alignment_path = os.path.join(
@@ -148,7 +212,7 @@ class Synthesizer(object):
 
             alignments_T = np.transpose(manual_alignments, [0, 2, 1])
             feed_dict.update({
-                    self.model.manual_alignments: alignments_T,
+                    self.model.manual_alignments: pad_alignments(alignments_T),
                     self.model.is_manual_attention: True,
             })
 
@@ -165,49 +229,157 @@ class Synthesizer(object):
             else:
                 feed_dict[self.model.speaker_id] = speaker_ids
 
-        wavs, alignments = \
-                self.sess.run(fetches, feed_dict=feed_dict)
+        if manual_attention_mode > 0:
+            wavs, alignments, output_lengths, encoder_outputs, attention_keys = \
+                    self.sess.run(fetches + [
+                            self.model.encoder_outputs,
+                            self.model.attention_keys,
+                    ], feed_dict=feed_dict)
+        else:
+            wavs, alignments, output_lengths = \
+                    self.sess.run(fetches, feed_dict=feed_dict)
         results = plot_and_save_parallel(
-                wavs, alignments, True)
+                *trim_outputs(wavs, alignments, output_lengths), True)
 
         if manual_attention_mode > 0:
-            # argmax one hot
-            if manual_attention_mode == 1:
-                alignments_T = np.transpose(alignments, [0, 2, 1]) # [N, E, D]
-                new_alignments = np.zeros_like(alignments_T)
-
-                for idx in range(len(alignments)):
-                    argmax = alignments[idx].argmax(1)
-                    new_alignments[idx][(argmax, range(len(argmax)))] = 1
-            # sharpening
-            elif manual_attention_mode == 2:
-                new_alignments = np.transpose(alignments, [0, 2, 1]) # [N, E, D]
-
-                for idx in range(len(alignments)):
-                    var = np.var(new_alignments[idx], 1)
-                    mean_var = var[:input_lengths[idx]].mean()
-
-                    new_alignments = np.pow(new_alignments[idx], 2)
-            # prunning
-            elif manual_attention_mode == 3:
-                new_alignments = np.transpose(alignments, [0, 2, 1]) # [N, E, D]
-
-                for idx in range(len(alignments)):
-                    argmax = alignments[idx].argmax(1)
-                    new_alignments[idx][(argmax, range(len(argmax)))] = 1
-
+            # The inputs are the same, so only the decoder runs again
             feed_dict.update({
-                    self.model.manual_alignments: new_alignments,
+                    self.model.manual_alignments: pad_alignments(
+                            transform_alignments(alignments, manual_attention_mode)),
                     self.model.is_manual_attention: True,
+                    self.model.encoder_outputs: encoder_outputs,
+                    self.model.attention_keys: attention_keys,
             })
 
-            new_wavs, new_alignments = \
+            new_wavs, new_alignments, new_output_lengths = \
                     self.sess.run(fetches, feed_dict=feed_dict)
+            # Past the steps of the first pass, alignments are only padding
+            new_output_lengths = np.minimum(new_output_lengths, output_lengths)
             results = plot_and_save_parallel(
-                    new_wavs, new_alignments, True)
+                    *trim_outputs(new_wavs, new_alignments, new_output_lengths), True)
 
         return results
 
+    def synthesize_stream(self, text, speaker_id=0,
+            chunk_steps=10, lookahead_frames=20, context_frames=20):
+        '''Yields waveform chunks of `text` while it is being decoded.
+
+        Requires `load(..., streaming=True)`. The encoder runs once, then every
+        call runs `chunk_steps` decoder steps from the kept decoder state. New
+        frames are passed through the post CBHG and Griffin-Lim once
+        `lookahead_frames` later frames exist, with `context_frames` earlier
+        frames prepended to smooth chunk boundaries.
+        '''
+        sequence = text_to_sequence(text)
+        inputs = np.array([sequence])
+        input_lengths = np.argmax(inputs == 1, 1)
+
+        feed_dict = {
+                self.model.inputs: inputs,
+                self.model.input_lengths: input_lengths,
+                self.model.speaker_id: [speaker_id],
+        }
+        encoder_outputs, attention_keys, states = self.sess.run([
+                self.model.encoder_outputs,
+                self.model.attention_keys,
+                self.model.stream_states,
+        ], feed_dict=feed_dict)
+
+        # From now on the cached encoder outputs replace the inputs
+        feed_dict = {
+                self.model.input_lengths: input_lengths,
+                self.model.speaker_id: [speaker_id],
+                self.model.encoder_outputs: encoder_outputs,
+                self.model.attention_keys: attention_keys,
+                self.model.stream_num_steps: chunk_steps,
+        }
+        feed_dict.update(self.model.get_dummy_feed_dict())
+
+        hop_length = int(hparams.frame_shift_ms / 1000 * hparams.sample_rate)
+        mels = np.zeros([0, hparams.num_mels], dtype=np.float32)
+        next_inputs, finished = None, None
+        num_steps, num_vocoded = 0, 0
+
+        while True:
+            step_feed_dict = dict(feed_dict)
+            step_feed_dict.update(zip(self.model.stream_states, states))
+            if next_inputs is not None:
+                step_feed_dict[self.model.stream_inputs] = next_inputs
+                step_feed_dict[self.model.stream_finished] = finished
+
+            outputs, output_lengths, states, next_inputs, finished = self.sess.run([
+                    self.model.stream_outputs,
+                    self.model.stream_output_lengths,
+                    self.model.stream_next_states,
+                    self.model.stream_next_inputs,
+                    self.model.stream_next_finished,
+            ], feed_dict=step_feed_dict)
+
+            num_steps += chunk_steps
+            mels = np.concatenate([mels, outputs[0][:output_lengths[0]]])
+            is_done = finished[0] or num_steps >= hparams.max_iters
+
+            end = len(mels) if is_done else len(mels) - lookahead_frames
+            if end > num_vocoded:
+                start = max(0, num_vocoded - context_frames)
+                linear_outputs = self.sess.run(self.model.linear_outputs, {
+                        self.model.mel_outputs: [mels[start:]],
+                        self.model.speaker_id: [speaker_id],
+                })[0]
+
+                audio = inv_spectrogram(linear_outputs[:end - start].T)
+                yield audio[(num_vocoded - start) * hop_length:]
+                num_vocoded = end
+
+            if is_done:
+                break
+
+def transform_alignments(alignments, manual_attention_mode):
+    '''Manual alignments [N, D, E] for a second decode from alignments [N, E, D].'''
+    alignments_T = np.transpose(alignments, [0, 2, 1]) # [N, D, E]
+
+    # Decoder step with the most attention for each token
+    batch_idx, token_idx = np.meshgrid(
+            np.arange(alignments.shape[0]), np.arange(alignments.shape[1]), indexing='ij')
+    argmax = alignments.argmax(2) # [N, E]
+
+    # argmax one hot
+    if manual_attention_mode == 1:
+        new_alignments = np.zeros_like(alignments_T)
+        new_alignments[batch_idx, argmax, token_idx] = 1
+    # sharpening
+    elif manual_attention_mode == 2:
+        new_alignments = alignments_T ** 2
+        new_alignments /= np.maximum(
+                new_alignments.sum(axis=2, keepdims=True), 1e-8)
+    # prunning
+    elif manual_attention_mode == 3:
+        new_alignments = alignments_T.copy()
+        new_alignments[batch_idx, argmax, token_idx] = 1
+    else:
+        raise Exception(" [!] Unkown manual_attention_mode: {}".format(manual_attention_mode))
+
+    return new_alignments
+
+def pad_alignments(alignments):
+    '''Repeats the last step of manual alignments [N, D, E] up to max_iters.
+
+    Decoding stops early, so D can be smaller than the max_iters steps of a
+    manual decode, which reads the alignments of every step.
+    '''
+    num_steps = max(0, hparams.max_iters - alignments.shape[1])
+    return np.pad(alignments, [(0, 0), (0, num_steps), (0, 0)], mode='edge')
+
+def trim_outputs(wavs, alignments, output_lengths):
+    # Drop the frames generated after each item has finished decoding
+    # so that postprocessing and Griffin-Lim only see valid frames.
+    trimmed_wavs, trimmed_alignments = [], []
+    for wav, alignment, output_length in zip(wavs, alignments, output_lengths):
+        trimmed_wavs.append(wav[:output_length])
+        trimmed_alignments.append(
+                alignment[:, :output_length // hparams.reduction_factor])
+    return trimmed_wavs, trimmed_alignments
+
 def plot_graph_and_save_audio(args,
         base_path=None,
         start_of_sentence=None, end_of_sentence=None,
@@ -378,16 +550,38 @@ if __name__ == "__main__":
     parser.add_argument('--speaker_id', default=0, type=int)
     parser.add_argument('--checkpoint_step', default=None, type=int)
     parser.add_argument('--is_korean', default=True, type=str2bool)
+    parser.add_argument('--stream', default=False, type=str2bool)
+    parser.add_argument('--chunk_steps', default=10, type=int)
+    parser.add_argument('--xla', default=False, type=str2bool)
+    parser.add_argument('--bucket_size', default=1, type=int)
+    parser.add_argument('--vocoder_workers', default=None, type=int,
+            help='Griffin-Lim processes (default: autotune.py config, else 0)')
     config = parser.parse_args()
 
     makedirs(config.sample_path)
 
     synthesizer = Synthesizer()
-    synthesizer.load(config.load_path, config.num_speakers, config.checkpoint_step)
-
-    audio = synthesizer.synthesize(
-            texts=[config.text],
-            base_path=config.sample_path,
-            speaker_ids=[config.speaker_id],
-            attention_trim=False,
-            isKorean=config.is_korean)[0]
+    synthesizer.load(config.load_path, config.num_speakers,
+            config.checkpoint_step, streaming=config.stream,
+            xla=config.xla, bucket_size=config.bucket_size,
+            vocoder_workers=config.vocoder_workers)
+
+    if config.stream:
+        start_time = time.time()
+        chunks = []
+        for chunk in synthesizer.synthesize_stream(
+                config.text, config.speaker_id, config.chunk_steps):
+            if not chunks:
+                print(" [*] First chunk after {:.3f} sec".format(time.time() - start_time))
+            chunks.append(chunk)
+        print(" [*] Last chunk after {:.3f} sec".format(time.time() - start_time))
+
+        save_audio(np.concatenate(chunks),
+                "{}/{}.stream.wav".format(config.sample_path, get_time()))
+    else:
+        audio = synthesizer.synthesize(
+                texts=[config.text],
+                base_path=config.sample_path,
+                speaker_ids=[config.speaker_id],
+                attention_trim=False,
+                isKorean=config.is_korean)[0]
@@ -11,11 +11,17 @@ from datetime import datetime
 from functools import partial
 
 from hparams import hparams, hparams_debug_string
-from models import create_model, get_most_recent_checkpoint
+from models import create_model, get_most_recent_checkpoint, \
+                   restore_variables, restore_available_variables, \
+                   restore_resized_variables, restore_appended_rows
+from models.pruning import add_pruning
 
 from utils import ValueWindow, prepare_dirs
-from utils import infolog, warning, plot, load_hparams
-from utils import get_git_revision_hash, get_git_diff, str2bool, parallel_run
+from utils import infolog, warning, plot, load_hparams, save_hparams, load_json, write_json
+from utils import get_git_revision_hash, get_git_diff, str2bool, parallel_run, xla_scope
+from utils.profiler import write_profile
+from utils.background import AsyncSaver, BackgroundPool
+from utils.tuning import load_tuned_config, get_session_config
 
 from audio import save_audio, inv_spectrogram
 from text import sequence_to_text, text_to_sequence
@@ -103,23 +109,108 @@ def save_and_plot_fn(args, log_dir, step, loss, prefix):
                         skip_eos_and_pad=True, combine_jamo=False), isKorean=False) 
 
 def save_and_plot(sequences, spectrograms,
-        alignments, log_dir, step, loss, prefix):
+        alignments, log_dir, step, loss, prefix, pool=None):
 
     fn = partial(save_and_plot_fn,
         log_dir=log_dir, step=step, loss=loss, prefix=prefix)
     items = list(enumerate(zip(sequences, spectrograms, alignments)))
 
-    parallel_run(fn, items, parallel=False)
-    log('Test finished for step {}.'.format(step))
+    if pool is None:
+        parallel_run(fn, items, parallel=False)
+        log('Test finished for step {}.'.format(step))
+    elif not pool.submit(fn, items):
+        log(' [!] Previous tests are still running, skipped {} test of step {}'.format(prefix, step))
 
 
-def train(log_dir, config):
+def get_alignment_score(alignments):
+    '''Mean over decoder steps of the attention peak: close to 1 once the
+    attention is focused (aligned), low while it is spread out.
+
+    Args:
+        alignments: [N, T_in, T_out / r]
+    '''
+    return float(np.mean(np.max(alignments, axis=1)))
+
+
+def get_reduction_factor_schedule():
+    # "0:5,20000:3,60000:2" -> [(0, 5), (20000, 3), (60000, 2)]
+    if not hparams.reduction_factor_schedule:
+        return []
+    return [tuple(int(x) for x in stage.split(":")) \
+            for stage in hparams.reduction_factor_schedule.split(",")]
+
+
+def get_reduction_factor(step):
+    '''Reduction factor at `step` and the step where it changes next (or None).'''
+    reduction_factor, end_step = hparams.reduction_factor, None
+    for start_step, stage_reduction_factor in get_reduction_factor_schedule():
+        if step < start_step:
+            end_step = start_step
+            break
+        reduction_factor = stage_reduction_factor
+    return reduction_factor, end_step
+
+
+def get_start_step(config):
+    if config.load_path:
+        checkpoint_path = get_most_recent_checkpoint(config.model_dir)
+        return int(checkpoint_path.split('-')[-1])
+    # initialize_path resets the global step
+    return 0
+
+
+def get_adaptation_variables(model, adaptation_mode):
+    # Speaker embedding tables (one row per speaker) and, for "speaker",
+    # the deepvoice projections of the speaker embedding
+    if adaptation_mode == 'speaker':
+        return model.speaker_variables
+    return [var for var in model.speaker_variables \
+            if not var.op.name.endswith(('kernel', 'bias'))]
+
+
+def load_teacher_hparams(teacher_path):
+    teacher_hparams = tf.contrib.training.HParams(**hparams.values())
+    load_hparams(teacher_hparams, teacher_path)
+
+    for key in ['num_mels', 'num_freq', 'reduction_factor', 'cleaners', 'model_type']:
+        if getattr(teacher_hparams, key) != getattr(hparams, key):
+            raise Exception(" [!] {} of the teacher ({}) and the student ({}) should be equal". \
+                    format(key, getattr(teacher_hparams, key), getattr(hparams, key)))
+
+    return teacher_hparams
+
+
+def get_duration_kwargs(feeder):
+    # Durations are only an input of the duration decoder
+    if hparams.decoder_type == 'duration':
+        return {'durations': feeder.durations}
+    return {}
+
+
+def wait_for_variables(sess, var_list, interval=1):
+    # Workers wait for the chief to initialize (or restore) the variables
+    uninitialized = tf.report_uninitialized_variables(var_list)
+    while sess.run(uninitialized).size > 0:
+        time.sleep(interval)
+
+
+def init_test_worker(hparams_values):
+    # Spawned workers import the default hparams
+    for key, value in hparams_values.items():
+        setattr(hparams, key, value)
+
+
+def train(log_dir, config, server=None, end_step=None, test_pool=None):
+    '''Trains until `end_step` (forever if None) and returns the last step.
+
+    Test audio and alignments are written by `test_pool` (in the loop if None).
+    '''
     config.data_paths = config.data_paths
 
     data_dirs = [os.path.join(data_path, "data") \
             for data_path in config.data_paths]
-    num_speakers = len(data_dirs)
-    config.num_test = config.num_test_per_speaker * num_speakers
+    num_speakers = config.speaker_id_offset + len(data_dirs)
+    config.num_test = config.num_test_per_speaker * len(data_dirs)
 
     if num_speakers > 1 and hparams.model_type not in ["deepvoice", "simple"]:
         raise Exception("[!] Unkown model_type for multi-speaker: {}".format(config.model_type))
@@ -150,28 +241,73 @@ def train(log_dir, config):
     is_randomly_initialized = config.initialize_path is None
     global_step = tf.Variable(0, name='global_step', trainable=False)
 
-    with tf.variable_scope('model') as scope:
-        model = create_model(hparams)
-        model.initialize(
-                train_feeder.inputs, train_feeder.input_lengths,
-                num_speakers,  train_feeder.speaker_id,
-                train_feeder.mel_targets, train_feeder.linear_targets,
-                train_feeder.loss_coeff,
-                is_randomly_initialized=is_randomly_initialized)
-
-        model.add_loss()
-        model.add_optimizer(global_step)
-        train_stats = add_stats(model, scope_name='stats') # legacy
-
-    with tf.variable_scope('model', reuse=True) as scope:
-        test_model = create_model(hparams)
-        test_model.initialize(
-                test_feeder.inputs, test_feeder.input_lengths,
-                num_speakers, test_feeder.speaker_id,
-                test_feeder.mel_targets, test_feeder.linear_targets,
-                test_feeder.loss_coeff, rnn_decoder_test_mode=True,
-                is_randomly_initialized=is_randomly_initialized)
-        test_model.add_loss()
+    with xla_scope(config.xla):
+        if config.teacher_path is not None:
+            # Teacher-forced on the same targets, so that its outputs and
+            # alignments line up with the student's
+            with tf.variable_scope('teacher') as scope:
+                teacher = create_model(load_teacher_hparams(config.teacher_path))
+                teacher.initialize(
+                        train_feeder.inputs, train_feeder.input_lengths,
+                        num_speakers, train_feeder.speaker_id,
+                        train_feeder.mel_targets, train_feeder.linear_targets,
+                        train_feeder.loss_coeff,
+                        manual_attention=False, is_training=False)
+
+        with tf.variable_scope('model') as scope:
+            model = create_model(hparams)
+            model.initialize(
+                    train_feeder.inputs, train_feeder.input_lengths,
+                    num_speakers,  train_feeder.speaker_id,
+                    train_feeder.mel_targets, train_feeder.linear_targets,
+                    train_feeder.loss_coeff,
+                    is_randomly_initialized=is_randomly_initialized,
+                    **get_duration_kwargs(train_feeder))
+
+            model.add_loss()
+            if config.teacher_path is not None:
+                model.add_distillation_loss(teacher)
+
+            if config.adaptation_mode is not None:
+                # Only the new speakers' rows of the tables are updated
+                model.add_optimizer(global_step,
+                        var_list=get_adaptation_variables(model, config.adaptation_mode),
+                        num_replicas=config.num_workers,
+                        num_frozen_speakers=config.speaker_id_offset)
+            else:
+                model.add_optimizer(global_step, var_list=tf.get_collection(
+                        tf.GraphKeys.TRAINABLE_VARIABLES, scope.name),
+                        num_replicas=config.num_workers)
+            train_stats = add_stats(model, scope_name='stats') # legacy
+
+    if config.teacher_path is not None:
+        train_stats = tf.summary.merge([
+                train_stats,
+                tf.summary.scalar('stats/distill_mel_loss', model.distill_mel_loss),
+                tf.summary.scalar('stats/distill_linear_loss', model.distill_linear_loss),
+                tf.summary.scalar('stats/distill_alignment_loss', model.distill_alignment_loss),
+        ])
+
+    if hparams.decoder_type == 'duration':
+        train_stats = tf.summary.merge([
+                train_stats, tf.summary.scalar('stats/duration_loss', model.duration_loss)])
+
+    if hparams.prune_target_sparsity > 0:
+        model.optimize, sparsity = add_pruning(model.optimize, global_step, hparams)
+        train_stats = tf.summary.merge([
+                train_stats, tf.summary.scalar('stats/sparsity', sparsity)])
+
+    with xla_scope(config.xla):
+        with tf.variable_scope('model', reuse=True) as scope:
+            test_model = create_model(hparams)
+            test_model.initialize(
+                    test_feeder.inputs, test_feeder.input_lengths,
+                    num_speakers, test_feeder.speaker_id,
+                    test_feeder.mel_targets, test_feeder.linear_targets,
+                    test_feeder.loss_coeff, rnn_decoder_test_mode=True,
+                    is_randomly_initialized=is_randomly_initialized,
+                    **get_duration_kwargs(test_feeder))
+            test_model.add_loss()
 
     test_stats = add_stats(test_model, model, scope_name='test')
     test_stats = tf.summary.merge([test_stats, train_stats])
@@ -180,29 +316,55 @@ def train(log_dir, config):
     step = 0
     time_window = ValueWindow(100)
     loss_window = ValueWindow(100)
-    saver = tf.train.Saver(max_to_keep=None, keep_checkpoint_every_n_hours=2)
+    teacher_variables = tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES, 'teacher')
+    model_variables = [var for var in tf.global_variables() \
+            if var not in teacher_variables]
 
-    sess_config = tf.ConfigProto(
+    saver = AsyncSaver(model_variables, device=config.worker_device,
+            max_to_keep=None, keep_checkpoint_every_n_hours=2)
+
+    # Thread counts of autotune.py, TensorFlow defaults if not tuned
+    sess_config = get_session_config(config.tuned_config,
             log_device_placement=False,
             allow_soft_placement=True)
     sess_config.gpu_options.allow_growth=True
 
     # Train!
-    #with tf.Session(config=sess_config) as sess:
-    with tf.Session() as sess:
+    with tf.Session(server.target if server is not None else '', config=sess_config) as sess:
         try:
-            summary_writer = tf.summary.FileWriter(log_dir, sess.graph)
-            sess.run(tf.global_variables_initializer())
-
-            if config.load_path:
+            if config.is_chief:
+                summary_writer = tf.summary.FileWriter(log_dir, sess.graph)
+            if config.is_chief:
+                sess.run(tf.global_variables_initializer())
+            # Gradient accumulators
+            sess.run(tf.local_variables_initializer())
+
+            if not config.is_chief:
+                wait_for_variables(sess, tf.global_variables())
+                log('Worker %d joined the training' % config.task_index)
+            elif config.load_path:
                 # Restore from a checkpoint if the user requested it.
                 restore_path = get_most_recent_checkpoint(config.model_dir)
-                saver.restore(sess, restore_path)
+                # The output projection changes with the reduction factor
+                missing = restore_variables(
+                        sess, restore_path, model_variables, allow_missing=True)
+                restore_resized_variables(sess, restore_path, missing, hparams.num_mels)
                 log('Resuming from checkpoint: %s at commit: %s' % (restore_path, commit), slack=True)
             elif config.initialize_path:
                 restore_path = get_most_recent_checkpoint(config.initialize_path)
-                saver.restore(sess, restore_path)
+                # Variables added since, e.g. the pruning masks, keep their initial values
+                missing = restore_available_variables(
+                        sess, restore_path, model_variables)
+
+                if config.adaptation_mode is not None:
+                    # Existing speakers keep their rows, new ones are appended
+                    appended = [var for var in missing if var in model.speaker_variables]
+                    restore_appended_rows(sess, restore_path, appended)
+                    missing = [var for var in missing if var not in appended]
                 log('Initialized from checkpoint: %s at commit: %s' % (restore_path, commit), slack=True)
+                if missing:
+                    log(' [!] Not in checkpoint: {}'.format(
+                            ", ".join(var.op.name for var in missing)))
 
                 zero_step_assign = tf.assign(global_step, 0)
                 sess.run(zero_step_assign)
@@ -215,20 +377,72 @@ def train(log_dir, config):
             else:
                 log('Starting new training run at commit: %s' % commit, slack=True)
 
+            if config.is_chief and config.teacher_path is not None:
+                teacher_path = get_most_recent_checkpoint(config.teacher_path)
+                restore_variables(sess, teacher_path,
+                        teacher_variables, checkpoint_scope='model')
+                log('Loaded teacher from checkpoint: %s' % teacher_path, slack=True)
+
+            if config.num_workers > 1:
+                # Synchronous updates: the chief aggregates the gradients of
+                # every worker and hands out tokens for the next step
+                if config.is_chief:
+                    sess.run(model.optimizer.chief_init_op)
+                    sess.run(model.optimizer.get_init_tokens_op())
+                    model.optimizer.get_chief_queue_runner().create_threads(
+                            sess, coord=coord, start=True)
+                else:
+                    sess.run(model.optimizer.local_step_init_op)
+
             start_step = sess.run(global_step)
 
+            alignment_path = os.path.join(log_dir, 'alignment.json')
+            alignment_history = load_json(alignment_path) \
+                    if os.path.exists(alignment_path) else []
+
             train_feeder.start_in_session(sess, start_step)
             test_feeder.start_in_session(sess, start_step)
 
+            step_time, num_updates, num_micro_batches = 0., 0, 0
             while not coord.should_stop():
+                # Only traced steps get run options. With gradient accumulation,
+                # only the last micro-batch, which applies the update, is traced.
+                run_kwargs = {}
+                is_traced = config.is_chief and config.profile_interval > 0 and \
+                        (num_updates + 1) % config.profile_interval == 0 and \
+                        num_micro_batches == hparams.gradient_accumulation_steps - 1
+                if is_traced:
+                    run_metadata = tf.RunMetadata()
+                    run_kwargs = {
+                            'options': tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE),
+                            'run_metadata': run_metadata,
+                    }
+
                 start_time = time.time()
-                step, loss, opt = sess.run(
-                        [global_step, model.loss_without_coeff, model.optimize],
-                        feed_dict=model.get_dummy_feed_dict())
+                step, loss, is_update_step, opt = sess.run(
+                        [global_step, model.loss_without_coeff,
+                         model.is_update_step, model.optimize],
+                        feed_dict=model.get_dummy_feed_dict(), **run_kwargs)
 
-                time_window.append(time.time() - start_time)
+                run_time = time.time() - start_time
+                step_time += run_time
                 loss_window.append(loss)
 
+                if not is_update_step:
+                    # Micro-batch of gradient accumulation
+                    num_micro_batches += 1
+                    continue
+
+                num_updates, num_micro_batches = num_updates + 1, 0
+                if is_traced:
+                    # Tracing slows the step down, so it is not in the window
+                    profile_path = write_profile(
+                            log_dir, step, run_metadata, time_window.values, run_time)
+                    log('Wrote profile of step %d to: %s' % (step, profile_path))
+                else:
+                    time_window.append(step_time)
+                step_time = 0.
+
                 message = 'Step %-7d [%.03f sec/step, loss=%.05f, avg_loss=%.05f]' % (
                         step, time_window.average, loss, loss_window.average)
                 log(message, slack=(step % config.checkpoint_interval == 0))
@@ -237,7 +451,7 @@ def train(log_dir, config):
                     log('Loss exploded to %.05f at step %d!' % (loss, step), slack=True)
                     raise Exception('Loss Exploded')
 
-                if step % config.summary_interval == 0:
+                if config.is_chief and step % config.summary_interval == 0:
                     log('Writing summary at step: %d' % step)
 
                     feed_dict = {
@@ -247,11 +461,13 @@ def train(log_dir, config):
                     summary_writer.add_summary(sess.run(
                             test_stats, feed_dict=feed_dict), step)
 
-                if step % config.checkpoint_interval == 0:
-                    log('Saving checkpoint to: %s-%d' % (checkpoint_path, step))
-                    saver.save(sess, checkpoint_path, global_step=step)
+                if config.is_chief and step % config.checkpoint_interval == 0:
+                    if saver.save(sess, checkpoint_path, global_step=step):
+                        log('Saving checkpoint to: %s-%d' % (checkpoint_path, step))
+                    else:
+                        log(' [!] Previous checkpoint is still being written, skipped step %d' % step)
 
-                if step % config.test_interval == 0:
+                if config.is_chief and step % config.test_interval == 0:
                     log('Saving audio and alignment...')
                     num_test = config.num_test
 
@@ -273,15 +489,40 @@ def train(log_dir, config):
                                     sess.run(fetches, feed_dict=feed_dict)
 
                     save_and_plot(sequences[:1], spectrograms[:1], alignments[:1],
-                            log_dir, step, loss, "train")
+                            log_dir, step, loss, "train", test_pool)
                     save_and_plot(test_sequences, test_spectrograms, test_alignments,
-                            log_dir, step, loss, "test")
+                            log_dir, step, loss, "test", test_pool)
+
+                    alignment_score = get_alignment_score(test_alignments)
+                    log('Alignment score: %.4f (reduction_factor=%d)' % (
+                            alignment_score, hparams.reduction_factor))
+
+                    alignment_history.append({
+                            'step': int(step),
+                            'time': time.time(),
+                            'score': alignment_score,
+                            'reduction_factor': hparams.reduction_factor,
+                    })
+                    write_json(alignment_path, alignment_history)
+
+                if end_step is not None and step >= end_step:
+                    step = sess.run(global_step)
+                    if config.is_chief:
+                        log('Saving checkpoint to: %s-%d' % (checkpoint_path, step))
+                        saver.save(sess, checkpoint_path, global_step=step, block=True)
+
+                    train_feeder.stop()
+                    test_feeder.stop()
+                    return step
 
         except Exception as e:
             log('Exiting due to exception: %s' % e, slack=True)
             traceback.print_exc()
             coord.request_stop(e)
 
+        finally:
+            saver.wait()
+
 
 def main():
     parser = argparse.ArgumentParser()
@@ -290,12 +531,34 @@ def main():
     parser.add_argument('--data_paths', default='datasets/kr_example')
     parser.add_argument('--load_path', default=None)
     parser.add_argument('--initialize_path', default=None)
+    parser.add_argument('--teacher_path', default=None,
+            help='Distill the outputs and alignments of this (larger) trained model')
 
     parser.add_argument('--num_test_per_speaker', type=int, default=2)
     parser.add_argument('--random_seed', type=int, default=123)
     parser.add_argument('--summary_interval', type=int, default=100)
     parser.add_argument('--test_interval', type=int, default=500)
     parser.add_argument('--checkpoint_interval', type=int, default=1000)
+    parser.add_argument('--test_workers', type=int, default=2,
+            help='Processes that write the test audio and alignments (0: in the training loop)')
+    parser.add_argument('--test_queue_size', type=int, default=4,
+            help='Test jobs that can wait for the test workers before new ones are skipped')
+    parser.add_argument('--profile_interval', type=int, default=0,
+            help='Trace every n-th step: Chrome trace, op time table and step time percentiles in the log dir')
+    parser.add_argument('--xla', type=str2bool, default=False,
+            help='Compile the model with XLA JIT')
+    parser.add_argument('--bucket_size', type=int, default=1,
+            help='Pad tokens and decoder steps to multiples of this (fewer XLA compilations)')
+    parser.add_argument('--adaptation_mode', default=None, choices=['embedding', 'speaker'],
+            help='Adds the speakers of data_paths to the model of initialize_path and only trains '
+                 'their embedding rows (embedding) or also the deepvoice speaker projections (speaker)')
+    parser.add_argument('--ps_hosts', default=None,
+            help='Comma-separated host:port of the parameter servers')
+    parser.add_argument('--worker_hosts', default=None,
+            help='Comma-separated host:port of the workers of synchronous distributed training')
+    parser.add_argument('--job_name', default='worker', help='ps or worker')
+    parser.add_argument('--task_index', type=int, default=0,
+            help='Index of this process in its job. Worker 0 is the chief')
     parser.add_argument('--skip_path_filter',
             type=str2bool, default=False, help='Use only for debugging')
 
@@ -306,14 +569,63 @@ def main():
 
     config = parser.parse_args()
     config.data_paths = config.data_paths.split(",")
+    config.tuned_config = load_tuned_config('train')
     setattr(hparams, "num_speakers", len(config.data_paths))
 
-    prepare_dirs(config, hparams)
-
-    log_path = os.path.join(config.model_dir, 'train.log')
-    infolog.init(log_path, config.model_dir, config.slack_url)
+    server, device = None, None
+    if config.worker_hosts is not None:
+        if config.ps_hosts is None:
+            raise Exception(" [!] Distributed training needs ps_hosts")
+
+        cluster = tf.train.ClusterSpec({
+                'ps': config.ps_hosts.split(","),
+                'worker': config.worker_hosts.split(","),
+        })
+        server = tf.train.Server(
+                cluster, job_name=config.job_name, task_index=config.task_index)
+
+        if config.job_name == 'ps':
+            server.join()
+            return
+
+        # Variables on the parameter servers, the rest on this worker
+        device = tf.train.replica_device_setter(
+                worker_device='/job:worker/task:{}'.format(config.task_index),
+                cluster=cluster)
+
+    config.num_workers = 1 if server is None else cluster.num_tasks('worker')
+    config.is_chief = config.task_index == 0
+    # Snapshots of the checkpoints stay on this worker, not the ps
+    config.worker_device = None if server is None else \
+            '/job:worker/task:{}'.format(config.task_index)
+
+    if config.is_chief:
+        prepare_dirs(config, hparams)
+    else:
+        # Only the chief writes logs, summaries, checkpoints and samples,
+        # other workers only print their logs
+        config.model_dir = config.load_path or config.log_dir
+        if config.load_path:
+            load_hparams(hparams, config.load_path)
+
+    config.speaker_id_offset = 0
+    if config.adaptation_mode is not None:
+        if config.initialize_path is not None:
+            # Model of the checkpoint, with the new speakers appended
+            load_hparams(hparams, config.initialize_path)
+            hparams.num_speakers += len(config.data_paths)
+            if config.is_chief:
+                save_hparams(config.model_dir, hparams)
+        elif config.load_path is None:
+            raise Exception(" [!] Speaker adaptation needs initialize_path (or load_path to resume)")
+
+        # The new speakers get the last IDs
+        config.speaker_id_offset = hparams.num_speakers - len(config.data_paths)
+
+    if config.is_chief:
+        log_path = os.path.join(config.model_dir, 'train.log')
+        infolog.init(log_path, config.model_dir, config.slack_url)
 
-    tf.set_random_seed(config.random_seed)
     print(config.data_paths)
 
     if any("krbook" not in data_path for data_path in config.data_paths) and \
@@ -329,7 +641,49 @@ def main():
     if config.load_path is not None and config.initialize_path is not None:
         raise Exception(" [!] Only one of load_path and initialize_path should be set")
 
-    train(config.model_dir, config)
+    schedule = get_reduction_factor_schedule()
+    if schedule and schedule[0][0] != 0:
+        raise Exception(" [!] reduction_factor_schedule should start at step 0")
+    if schedule and config.num_workers > 1:
+        raise Exception(" [!] reduction_factor_schedule is not supported with multiple workers")
+    if schedule and config.teacher_path is not None:
+        # The teacher has a single reduction factor, which every stage must match
+        raise Exception(" [!] reduction_factor_schedule is not supported with teacher_path")
+
+    # Test audio and alignments are written by the same workers in every
+    # stage of the reduction factor schedule
+    test_pool = None
+    if config.is_chief and config.test_workers > 0:
+        test_pool = BackgroundPool(
+                config.test_workers, config.test_queue_size,
+                initializer=init_test_worker, initargs=(hparams.values(),))
+
+    try:
+        while True:
+            end_step = None
+            if schedule:
+                hparams.reduction_factor, end_step = \
+                        get_reduction_factor(get_start_step(config))
+                # Synthesizer loads the reduction factor of the last stage
+                save_hparams(config.model_dir, hparams)
+                log(' [*] reduction_factor: {} until step {}'.format(
+                        hparams.reduction_factor, end_step))
+
+            # A new r changes the shapes, so every stage builds a new graph
+            tf.reset_default_graph()
+            tf.set_random_seed(config.random_seed)
+
+            with tf.device(device):
+                step = train(config.model_dir, config, server, end_step, test_pool)
+
+            if end_step is None or step is None:
+                break
+
+            # The next stage resumes from the checkpoint of this one
+            config.load_path, config.initialize_path = config.model_dir, None
+    finally:
+        if test_pool is not None:
+            test_pool.close()
 
 
 if __name__ == '__main__':
@@ -5,7 +5,7 @@ import json
 import requests
 import subprocess
 from tqdm import tqdm
-from contextlib import closing
+from contextlib import closing, ExitStack
 from multiprocessing import Pool
 from collections import namedtuple
 from datetime import datetime, timedelta
@@ -33,6 +33,10 @@ class ValueWindow():
     def average(self):
         return self.sum / max(1, self.count)
 
+    @property
+    def values(self):
+        return list(self._values)
+
     def reset(self):
         self._values = []
 
@@ -222,3 +226,11 @@ def query_yes_no(question, default=None):
         else:
             sys.stdout.write("Please respond with 'yes' or 'no' "
                              "(or 'y' or 'n').\n")
+
+def xla_scope(enabled=True):
+    # Ops built inside are compiled with XLA JIT (on CPU as well)
+    if not enabled:
+        return ExitStack()
+
+    from tensorflow.contrib.compiler import jit
+    return jit.experimental_jit_scope()
@@ -0,0 +1,112 @@
+import threading
+import tensorflow as tf
+from multiprocessing import get_context
+
+from utils import infolog
+
+log = infolog.log
+
+
+class AsyncSaver(object):
+    '''Writes checkpoints in a background thread while training goes on.
+
+    The variables are first copied to local snapshot variables (one fast
+    sess.run between two steps), so the checkpoint holds a single step even
+    though the optimizer keeps updating the variables during the write.
+    Checkpoint names are the ones of the variables, so they restore as usual.
+    The snapshots are placed on `device` if given, e.g. the local worker of
+    distributed training, where a device setter would put them on the ps.
+    '''
+
+    def __init__(self, var_list, device=None, **saver_kwargs):
+        snapshots = {}
+        with tf.device(device), tf.name_scope('checkpoint_snapshot'):
+            for var in var_list:
+                snapshots[var.op.name] = tf.Variable(
+                        tf.zeros(var.shape, var.dtype.base_dtype),
+                        trainable=False, name=var.op.name,
+                        collections=[tf.GraphKeys.LOCAL_VARIABLES])
+
+            self.snapshot_op = tf.group(*[
+                    tf.assign(snapshots[var.op.name], var) for var in var_list])
+
+        self.saver = tf.train.Saver(snapshots, **saver_kwargs)
+        self.thread = None
+        self.error = None
+
+    @property
+    def is_saving(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def _save(self, sess, save_path, global_step):
+        try:
+            self.saver.save(sess, save_path, global_step=global_step)
+        except Exception as e:
+            self.error = e
+
+    def save(self, sess, save_path, global_step, block=False):
+        '''Returns False (and saves nothing) if the previous checkpoint is
+        still being written, unless `block` waits for it.'''
+        if self.is_saving and not block:
+            return False
+        self.wait()
+
+        sess.run(self.snapshot_op)
+        self.thread = threading.Thread(
+                target=self._save, args=(sess, save_path, global_step))
+        self.thread.start()
+
+        if block:
+            self.wait()
+        return True
+
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+
+class BackgroundPool(object):
+    '''Runs `fn` over items in worker processes. At most `max_pending`
+    submissions are queued or running: newer ones are dropped.
+
+    Workers are spawned, not forked, since forking a process that already
+    runs TensorFlow threads can deadlock. They start from fresh imports, so
+    `initializer(*initargs)` has to restore any state they need.
+    '''
+
+    def __init__(self, processes, max_pending, initializer=None, initargs=()):
+        self.pool = get_context('spawn').Pool(
+                processes, initializer=initializer, initargs=initargs)
+        self.max_pending = max_pending
+        self.pending = []
+
+    def _collect(self):
+        running = []
+        for result in self.pending:
+            if not result.ready():
+                running.append(result)
+            elif not result.successful():
+                try:
+                    result.get()
+                except Exception as e:
+                    log(' [!] Background job failed: {}'.format(e))
+        self.pending = running
+
+    def submit(self, fn, items):
+        '''Returns False if the job was dropped.'''
+        self._collect()
+        if len(self.pending) >= self.max_pending:
+            return False
+
+        self.pending.append(self.pool.map_async(fn, items))
+        return True
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        self._collect()
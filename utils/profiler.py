@@ -0,0 +1,102 @@
+import os
+import numpy as np
+from collections import defaultdict
+from tensorflow.python.client import timeline
+
+from utils import write_json
+
+
+# Top scopes of the model, in the order of a training step
+MODEL_PARTS = [
+    'prenet', 'encoder_cbhg', 'decoder', 'post_cbhg', 'loss', 'optimizer',
+]
+
+
+def get_model_part(node_name):
+    '''Part of the model that a node belongs to, e.g.
+    "model/inference/decoder/while/..." -> "decoder" and
+    "model/optimizer/gradients/model/inference/decoder/..." -> "gradients/decoder".
+    '''
+    scopes = node_name.split('/')
+
+    prefix = ''
+    if 'gradients' in scopes:
+        scopes = scopes[scopes.index('gradients') + 1:]
+        prefix = 'gradients/'
+
+    for scope in scopes:
+        if scope in MODEL_PARTS:
+            return prefix + scope
+    return prefix + 'other'
+
+
+def get_op_type(node_stats):
+    # timeline_label: "name = OpType(input, ...)"
+    label = node_stats.timeline_label
+    if ' = ' not in label:
+        return node_stats.node_name
+    return label.split(' = ', 1)[1].split('(', 1)[0]
+
+
+def summarize_step_stats(step_stats):
+    '''Total op time in milliseconds by model part and by op type.
+
+    Ops of different devices (and of the decoder loop iterations) overlap,
+    so the totals can add up to more than the step time.
+    '''
+    part_times, op_times = defaultdict(float), defaultdict(float)
+    for dev_stats in step_stats.dev_stats:
+        for node_stats in dev_stats.node_stats:
+            duration = node_stats.all_end_rel_micros / 1000.
+
+            part_times[get_model_part(node_stats.node_name)] += duration
+            op_times[get_op_type(node_stats)] += duration
+
+    sort = lambda times: sorted(times.items(), key=lambda item: -item[1])
+    return sort(part_times), sort(op_times)
+
+
+def get_percentiles(times):
+    return {
+        'mean': float(np.mean(times)),
+        'p50': float(np.percentile(times, 50)),
+        'p90': float(np.percentile(times, 90)),
+        'p99': float(np.percentile(times, 99)),
+        'count': len(times),
+    }
+
+
+def write_profile(log_dir, step, run_metadata, step_times, traced_step_time, num_op_types=30):
+    '''Writes the Chrome trace (chrome://tracing) of a traced step and a table
+    of its op time by model part and op type. `step_times` of the untraced
+    steps are recorded as percentiles in profile.json.
+
+    Returns:
+        path of the table
+    '''
+    trace_path = os.path.join(log_dir, 'timeline-step-{:09d}.json'.format(step))
+    with open(trace_path, 'w') as f:
+        f.write(timeline.Timeline(run_metadata.step_stats). \
+                generate_chrome_trace_format(show_memory=True))
+
+    part_times, op_times = summarize_step_stats(run_metadata.step_stats)
+
+    table_path = os.path.join(log_dir, 'profile-step-{:09d}.txt'.format(step))
+    with open(table_path, 'w') as f:
+        f.write('step {}: {:.1f} ms traced\n\n'.format(step, traced_step_time * 1000))
+        for title, times in [('model part', part_times), ('op type', op_times[:num_op_types])]:
+            f.write('{:<40} {:>12}\n'.format(title, 'time (ms)'))
+            for name, duration in times:
+                f.write('{:<40} {:>12.2f}\n'.format(name, duration))
+            f.write('\n')
+
+    profile_path = os.path.join(log_dir, 'profile.json')
+    write_json(profile_path, {
+        'step': step,
+        'step_time': get_percentiles(step_times) if step_times else None,
+        'traced_step_time': traced_step_time,
+        'model_parts': part_times,
+        'op_types': op_times[:num_op_types],
+    })
+
+    return table_path
@@ -0,0 +1,43 @@
+import os
+import tensorflow as tf
+
+from utils import load_json
+
+# Written by autotune.py for the host it runs on
+TUNED_CONFIG_PATH = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tuned_config.json')
+
+
+def load_tuned_config(role, path=TUNED_CONFIG_PATH):
+    '''Tuned settings of `role` ("train" or "synthesis"), {} if not tuned.
+
+    Settings tuned on a host with another number of CPUs are ignored.
+    '''
+    if not os.path.exists(path):
+        return {}
+
+    tuned_config = load_json(path)
+    if tuned_config.get('cpu_count') != os.cpu_count():
+        print(" [!] {} was tuned for {} cpus, not {}: ignored".format(
+                path, tuned_config.get('cpu_count'), os.cpu_count()))
+        return {}
+
+    print(" [*] Using tuned {} config: {}".format(role, path))
+    return tuned_config.get(role, {})
+
+
+def get_session_config(tuned_config,
+        intra_op_parallelism_threads=0, inter_op_parallelism_threads=0, **kwargs):
+    '''ConfigProto with the tuned thread counts, or the given ones (0: TensorFlow default).'''
+    return tf.ConfigProto(
+            intra_op_parallelism_threads=tuned_config.get(
+                    'intra_op_parallelism_threads', intra_op_parallelism_threads),
+            inter_op_parallelism_threads=tuned_config.get(
+                    'inter_op_parallelism_threads', inter_op_parallelism_threads),
+            **kwargs)
+
+
+def set_cpu_affinity(cpus):
+    # None keeps every cpu. Only supported on Linux.
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)